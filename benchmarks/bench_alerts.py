@@ -0,0 +1,86 @@
+#!/usr/bin/python
+"""Times AlertEngine evaluation on synthetic counters growing at noisy
+rates, where a few percent of samples cross a threshold: 5 rules per
+interface (each testing its own value), 20 rules per interface sharing a
+single value, and anomaly detection on rx and tx bytes.
+
+Usage: bench_alerts.py [interfaces] [ticks]
+"""
+
+import sys
+import time
+import random
+
+from net_monitor.alerts import AlertEngine, AnomalyDetector, parse_rule
+from net_monitor.rates import RateEngine
+from net_monitor.uptime import UptimeLog
+from net_monitor.monitor import Snapshot, InterfaceSnapshot
+from net_monitor.procfs import DEV_COUNTERS, DEV_INDEX
+
+RULES = ["tx_busy rate:tx_bytes * > 1100000 clear 1000000",
+         "rx_busy rate:rx_bytes * > 2200000 clear 2000000 for 3",
+         "tx_smoothed smoothed:tx_bytes * > 1050000",
+         "rx_packets rate:rx_packets * > 1650",
+         "errors error_rate * > 0.01 clear 0.001",
+         ]
+
+# tx levels, from 1.1 to 10.6 MB/s
+LEVEL_RULES = ["tx_%d rate:tx_bytes * > %d" % (i, 600000 + 500000 * i) for i in range(1, 21)]
+
+# base rates of counters, in units per second
+RATES = {"rx_bytes": 2000000, "tx_bytes": 1000000, "rx_packets": 1500, "tx_packets": 800}
+
+class Samples:
+    """Stand-in for the Monitor parts used by AlertEngine"""
+
+    def __init__(self, ifaces):
+        self.names = ["eth%d" % i for i in range(ifaces)]
+        self.counters = dict([(iface, [0] * DEV_COUNTERS) for iface in self.names])
+        self.rates = RateEngine()
+        self.uptime_log = UptimeLog("/nonexistent")
+        self.clock = 0.0
+
+    def snapshot(self):
+        """Advances counters by a second, returns a Snapshot"""
+        self.clock += 1.0
+        ifaces = {}
+        for iface in self.names:
+            counters = self.counters[iface]
+            for name, rate in RATES.items():
+                counters[DEV_INDEX[name]] += int(rate * random.gauss(1.0, 0.05))
+            ifaces[iface] = InterfaceSnapshot(iface, True, "up", None, None, 0, 0,
+                    list(counters), False, 0, None, None, None, None, None, None, None)
+        snapshot = Snapshot(time.time(), self.clock, ifaces)
+        self.rates.update(snapshot)
+        return snapshot
+
+def timed(engine, samples, ticks):
+    """Returns best and average time of AlertEngine.update, and events"""
+    times = []
+    events = 0
+    for tick in range(ticks):
+        snapshot = samples.snapshot()
+        start = time.time()
+        events += len(engine.update(samples, snapshot))
+        times.append(time.time() - start)
+    # first ticks compile rules and warm detectors up
+    times = times[2:]
+    return min(times), sum(times) / len(times), events
+
+def main():
+    ifaces = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    ticks = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    random.seed(0)
+    samples = Samples(ifaces)
+    for rules in (RULES, LEVEL_RULES):
+        rules = [parse_rule(rule) for rule in rules]
+        best, average, events = timed(AlertEngine(rules), samples, ticks)
+        print("%d rules on %d interfaces: best %.3f ms, average %.3f ms per tick, %d events" %
+                (len(rules) * ifaces, ifaces, best * 1000, average * 1000, events))
+    best, average, events = timed(AlertEngine([], [AnomalyDetector(warmup=10)]),
+            samples, ticks)
+    print("anomaly detection on %d counters: best %.3f ms, average %.3f ms per tick, %d events" %
+            (2 * ifaces, best * 1000, average * 1000, events))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/python
+"""Compares the per-row /proc/net/tcp parser of net_monitor <= 0.11 with
+the column-oriented ConnectionTable parser, on a generated fixture.
+
+Usage: bench_connections.py [rows]
+"""
+
+import sys
+import time
+import socket
+import struct
+
+from net_monitor.connections import parse_connections
+
+from bench_procfs import TCP_HEADER
+
+def make_table(rows):
+    """Generates /proc/net/tcp contents"""
+    lines = [TCP_HEADER]
+    for i in range(rows):
+        lines.append("%4d: %08X:%04X %08X:%04X %02X 00000000:00000000 00:00000000 00000000  1000        0 %d 1 0000000000000000 20 4 30 10 -1\n" %
+                (i, 0x0100007F, 1024 + i % 60000, 0x0A000000 + i % 65536, 443, 1 + i % 11, 10000 + i))
+    return "".join(lines)
+
+def legacy_connections(data):
+    """net_monitor <= 0.11 implementation"""
+    connections = []
+    for l in data.splitlines()[1:]:
+        fields = l.strip().split()
+        loc_a, loc_p = fields[1].split(":")
+        rem_a, rem_p = fields[2].split(":")
+        loc_addr = socket.inet_ntoa(struct.pack('I', int(loc_a, 16)))
+        rem_addr = socket.inet_ntoa(struct.pack('I', int(rem_a, 16)))
+        connections.append((loc_addr, int(loc_p, 16), rem_addr, int(rem_p, 16), int(fields[3], 16)))
+    return connections
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return result, time.time() - start
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    data = make_table(rows)
+    legacy, t_old = timed(legacy_connections, data)
+    table, t_new = timed(parse_connections, data)
+    assert len(table) == len(legacy) == rows
+    assert tuple(table[rows - 1])[:4] == legacy[-1][:4]
+    print("%d rows: legacy %.3f s, column table %.3f s (%.1fx)" % (rows, t_old, t_new, t_old / t_new))
+    counts, t_count = timed(table.count_states)
+    print("counting states: %.3f s" % t_count)
+
+if __name__ == "__main__":
+    main()
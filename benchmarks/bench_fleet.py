@@ -0,0 +1,138 @@
+#!/usr/bin/python
+"""Compares sequential polling of net_monitord peers, one DaemonClient at a
+time, with concurrent Fleet polls. Peers are stand-ins served by a child
+process, replying with canned data after a delay; some peers are dead
+(nothing listens) and some never reply.
+
+Usage: bench_fleet.py [peers] [delay ms]
+"""
+
+import os
+import sys
+import time
+import select
+import signal
+import socket
+
+from net_monitor.daemon import DaemonClient, encode
+from net_monitor.fleet import Fleet, FLEET_TOPICS
+
+TIMEOUT = 0.5
+
+def make_reply(host):
+    """Canned reply of a peer"""
+    interfaces = {}
+    for i, iface in enumerate(["lo", "eth0", "eth1", "wlan0"]):
+        interfaces[iface] = {"status": "up",
+                             "rates": {"rx_bytes": 1000.0 * (host + i),
+                                       "tx_bytes": 500.0 * (host + i)}}
+    return encode({"time": time.time(),
+                   "data": {"interfaces": interfaces,
+                            "connections": {"tcp_states": {"1": host % 97, "10": 3}}}})
+
+def serve(servers, delay):
+    """Serves stand-in peers: {listening socket: reply}"""
+    clients = {}
+    # (due time, socket, reply)
+    queue = []
+    while True:
+        timeout = None
+        if queue:
+            timeout = max(queue[0][0] - time.time(), 0)
+        readable, writable, errors = select.select(servers.keys() + clients.keys(),
+                [], [], timeout)
+        for sock in readable:
+            if sock in servers:
+                conn, addr = sock.accept()
+                clients[conn] = servers[sock]
+                continue
+            try:
+                data = sock.recv(65536)
+            except socket.error:
+                data = ""
+            if not data:
+                del clients[sock]
+                sock.close()
+            elif clients[sock] is not None:
+                queue.append((time.time() + delay, sock, clients[sock]))
+                queue.sort()
+        now = time.time()
+        while queue and queue[0][0] <= now:
+            due, sock, reply = queue.pop(0)
+            if sock in clients:
+                sock.sendall(reply)
+
+def start_peers(count, delay, ports=None):
+    """Forks a process serving count stand-in peers; every 20th peer is
+    dead and every 50th never replies. Peers listen on ports when given
+    (to restart them), on free ports otherwise. Returns (pid, peer specs)."""
+    servers = {}
+    specs = []
+    for i in range(count):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(("127.0.0.1", ports and ports[i] or 0))
+        port = sock.getsockname()[1]
+        specs.append("127.0.0.1:%d" % port)
+        if i % 20 == 19:
+            # nothing listens on this port
+            sock.close()
+            continue
+        sock.listen(16)
+        reply = make_reply(i)
+        if i % 50 == 49:
+            reply = None
+        servers[sock] = reply
+    pid = os.fork()
+    if pid == 0:
+        try:
+            serve(servers, delay)
+        finally:
+            os._exit(0)
+    for sock in servers:
+        sock.close()
+    return pid, specs
+
+def sequential(specs):
+    """Polls peers one at a time, as a loop over DaemonClients would"""
+    replies = 0
+    for spec in specs:
+        host, port = spec.rsplit(":", 1)
+        try:
+            client = DaemonClient((host, int(port)))
+            client.sock.settimeout(TIMEOUT)
+            client.get(FLEET_TOPICS)
+            client.close()
+            replies += 1
+        except (socket.error, IOError):
+            pass
+    return replies
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    delay = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.02
+    pid, specs = start_peers(count, delay)
+    try:
+        start = time.time()
+        replies = sequential(specs)
+        t_seq = time.time() - start
+        print("%d peers, %d ms replies: sequential %.3f s (%d replies)" %
+                (count, delay * 1000, t_seq, replies))
+        fleet = Fleet(specs, timeout=TIMEOUT)
+        for poll in range(3):
+            start = time.time()
+            replies = fleet.poll()
+            t_poll = time.time() - start
+            print("fleet poll %d: %.3f s (%d replies)" % (poll + 1, t_poll, replies))
+        start = time.time()
+        view = fleet.view()
+        t_view = time.time() - start
+        print("fleet view: %.3f s, %d hosts, %d down, busiest %s" %
+                (t_view, len(view.hosts), len(view.down), view.top_throughput(1)))
+        fleet.close()
+    finally:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+
+if __name__ == "__main__":
+    main()
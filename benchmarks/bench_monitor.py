@@ -0,0 +1,156 @@
+#!/usr/bin/python
+"""Times Monitor operations on synthetic trees of growing size, and
+reports regressions against saved results.
+
+Usage: bench_monitor.py [--full] [--save file] [--compare file] [--threshold percents]
+
+Interfaces scale from 10 to 1000 (5000 with --full), and sockets from 1k
+to 100k (1M with --full). Results are the best time per call, in
+milliseconds. With --compare, the script exits with status 1 when any
+benchmark got slower than the saved one by more than threshold percents
+(20 by default).
+"""
+
+import sys
+import json
+import time
+import getopt
+import shutil
+import tempfile
+
+from net_monitor import Monitor
+from net_monitor.rates import RX_BYTES, TX_BYTES
+from net_monitor.aggregate import ConnectionAggregator
+from net_monitor.routes import RouteTable
+
+from fixtures import make_tree
+
+IFACE_SCALES = [10, 100, 1000]
+SOCKET_SCALES = [1000, 10000, 100000]
+FULL_IFACE_SCALES = IFACE_SCALES + [5000]
+FULL_SOCKET_SCALES = SOCKET_SCALES + [1000000]
+
+# minimum time spent on each benchmark, in seconds
+MIN_TIME = 0.2
+
+def best_time(func, min_time=MIN_TIME):
+    """Returns best time of func(), running it at least 3 times and for at
+    least min_time seconds"""
+    best = None
+    runs = 0
+    start = time.time()
+    while runs < 3 or time.time() - start < min_time:
+        t = time.time()
+        func()
+        t = time.time() - t
+        if best is None or t < best:
+            best = t
+        runs += 1
+    return best
+
+def engine_update(monitor):
+    """Work done by the plasma data engine on each update, without Qt"""
+    snapshot = monitor.snapshot()
+    rates = monitor.rates
+    for iface in snapshot.interfaces():
+        data = snapshot.get(iface)
+        values = [rates.total(iface, RX_BYTES), rates.total(iface, TX_BYTES),
+                  rates.rate(iface, RX_BYTES), rates.rate(iface, TX_BYTES),
+                  rates.rate(iface, RX_BYTES, True), rates.rate(iface, TX_BYTES, True),
+                  data.quality(), monitor.get_uptime(iface)]
+        for counter in ["rx_errors", "rx_drops", "tx_errors", "tx_drops"]:
+            values.append(data.counter(counter))
+        for window, resolution in monitor.history.windows:
+            for counter in ["rx_bytes", "tx_bytes"]:
+                values.append(monitor.get_history(iface, counter, window))
+
+def run_tree(results, label, ifaces, connections, benchmarks):
+    """Runs benchmarks on a generated tree"""
+    root = tempfile.mkdtemp()
+    try:
+        make_tree(root, ifaces, connections, routes=ifaces, wireless=min(ifaces, 10))
+        monitor = Monitor(root=root)
+        monitor.load_uptime_log()
+        for name, func in benchmarks:
+            key = "%s@%s" % (name, label)
+            results[key] = best_time(lambda: func(monitor)) * 1000
+            print "%-40s %10.3f ms" % (key, results[key])
+            sys.stdout.flush()
+        monitor.proc.close()
+    finally:
+        shutil.rmtree(root)
+
+def run(full=False):
+    results = {}
+    iface_benchmarks = [("readnet", lambda m: m.readnet()),
+                        ("wireless_stats", lambda m: m.wireless_stats()),
+                        ("get_routes", lambda m: m.read_routes()),
+                        ("route_table", lambda m: RouteTable(m.read_route_list())),
+                        ("snapshot", lambda m: m.snapshot()),
+                        ("kernel_stats", lambda m: m.get_kernel_stats()),
+                        ("engine_update", engine_update),
+                        ]
+    for ifaces in (full and FULL_IFACE_SCALES or IFACE_SCALES):
+        run_tree(results, "%d_ifaces" % ifaces, ifaces, 1000, iface_benchmarks)
+    socket_benchmarks = [("get_connections", lambda m: m.get_connection_table("tcp")),
+                         ("aggregate", lambda m: ConnectionAggregator(m, ["tcp"],
+                             processes=False).update()),
+                         ("egress", lambda m: m.get_egress(m.get_connection_table("tcp"))),
+                         ]
+    for sockets in (full and FULL_SOCKET_SCALES or SOCKET_SCALES):
+        run_tree(results, "%d_sockets" % sockets, 10, sockets, socket_benchmarks)
+    return results
+
+def compare(results, baseline, threshold):
+    """Prints changes against baseline, returns number of regressions"""
+    regressions = 0
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        ratio = results[key] / baseline[key]
+        status = ""
+        if ratio > 1 + threshold / 100.0:
+            status = "REGRESSION"
+            regressions += 1
+        elif ratio < 1 - threshold / 100.0:
+            status = "improved"
+        print "%-40s %10.3f -> %10.3f ms (%+.1f%%) %s" % (key, baseline[key],
+                results[key], (ratio - 1) * 100, status)
+    return regressions
+
+def usage():
+    print __doc__
+
+if __name__ == "__main__":
+    full = False
+    save = None
+    baseline = None
+    threshold = 20.0
+    try:
+        opt, args = getopt.getopt(sys.argv[1:], 'h',
+                ['help', 'full', 'save=', 'compare=', 'threshold='])
+        for o, value in opt:
+            if o in ('-h', '--help'):
+                usage()
+                sys.exit(0)
+            elif o == '--full':
+                full = True
+            elif o == '--save':
+                save = value
+            elif o == '--compare':
+                baseline = value
+            elif o == '--threshold':
+                threshold = float(value)
+    except (getopt.error, ValueError):
+        usage()
+        sys.exit(1)
+    results = run(full)
+    if save:
+        with open(save, "w") as fd:
+            json.dump(results, fd, indent=1, sort_keys=True)
+    if baseline:
+        with open(baseline) as fd:
+            regressions = compare(results, json.load(fd), threshold)
+        if regressions:
+            print "%d regressions" % regressions
+            sys.exit(1)
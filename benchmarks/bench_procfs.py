@@ -0,0 +1,84 @@
+#!/usr/bin/python
+"""Compares reading /proc files with open()/readlines() against persistent
+ProcReader file descriptors, on a synthetic /proc fixture.
+
+Usage: bench_procfs.py [interfaces] [connections] [iterations]
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import timeit
+
+from net_monitor.procfs import ProcReader, parse_dev, parse_table
+
+DEV_HEADER = """Inter-|   Receive                                                |  Transmit
+ face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls carrier compressed
+"""
+
+TCP_HEADER = "  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode\n"
+
+def make_fixture(root, ifaces, connections):
+    """Writes synthetic net/dev and net/tcp files"""
+    os.makedirs(os.path.join(root, "net"))
+    with open(os.path.join(root, "net", "dev"), "w") as fd:
+        fd.write(DEV_HEADER)
+        for i in range(ifaces):
+            fd.write("%6s: %d %d 0 0 0 0 0 0 %d %d 0 0 0 0 0 0\n" % ("eth%d" % i, i * 1000, i, i * 2000, i * 2))
+    with open(os.path.join(root, "net", "tcp"), "w") as fd:
+        fd.write(TCP_HEADER)
+        for i in range(connections):
+            fd.write("%4d: 0100007F:%04X 0100007F:%04X 01 00000000:00000000 00:00000000 00000000  1000        0 %d 1 0000000000000000 20 4 30 10 -1\n" % (i, 1024 + i % 60000, 80, 10000 + i))
+
+def legacy_readnet(path):
+    """net_monitor <= 0.11 implementation"""
+    net = {}
+    with open(path) as fd:
+        data = fd.readlines()[2:]
+    for l in data:
+        dev, vals = l.split(":")
+        net[dev.strip()] = vals.split()
+    return net
+
+def dev_rows(net):
+    """Converts parsed net/dev into {iface: [int counters]}, for comparing"""
+    return dict([(iface, [int(x) for x in row]) for iface, row in net.items()])
+
+def legacy_table(path):
+    """net_monitor <= 0.11 implementation"""
+    with open(path) as fd:
+        data = fd.readlines()[1:]
+    return [l.strip().split() for l in data]
+
+def main():
+    ifaces = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    connections = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    iterations = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+    root = tempfile.mkdtemp()
+    try:
+        make_fixture(root, ifaces, connections)
+        dev = os.path.join(root, "net", "dev")
+        tcp = os.path.join(root, "net", "tcp")
+        reader = ProcReader()
+        for name, legacy, new, count, normalize in [
+                ("net/dev (%d ifaces)" % ifaces,
+                    # counters were converted with int() by every consumer
+                    lambda: dev_rows(legacy_readnet(dev)),
+                    lambda: parse_dev(reader.read(dev)),
+                    iterations, dev_rows),
+                ("net/tcp (%d rows)" % connections,
+                    lambda: legacy_table(tcp),
+                    lambda: list(parse_table(reader.read(tcp))),
+                    max(iterations // 100, 1), list),
+                ]:
+            assert normalize(legacy()) == normalize(new())
+            t_old = timeit.timeit(legacy, number=count) / count
+            t_new = timeit.timeit(new, number=count) / count
+            print("%-28s legacy: %9.1f us  procfs: %9.1f us  (%.2fx)" % (name, t_old * 1e6, t_new * 1e6, t_old / t_new))
+        reader.close()
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == "__main__":
+    main()
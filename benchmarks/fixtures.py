@@ -0,0 +1,101 @@
+#!/usr/bin/python
+"""Generates synthetic /proc, /sys, /etc and /var trees, for running
+Monitor(root=...) on a reproducible system of any size.
+
+Usage: fixtures.py root [interfaces] [connections] [routes] [wireless]
+"""
+
+import os
+import sys
+
+from bench_procfs import DEV_HEADER
+from bench_connections import make_table
+
+WIRELESS_HEADER = """Inter-| sta-|   Quality        |   Discarded packets               | Missed | WE
+ face | tus | link level noise |  nwid  crypt   frag  retry   misc | beacon | 22
+"""
+
+SNMP = """Ip: Forwarding DefaultTTL InReceives InHdrErrors InAddrErrors ForwDatagrams InUnknownProtos InDiscards InDelivers OutRequests OutDiscards OutNoRoutes
+Ip: 2 64 604712 0 0 0 0 0 604712 603725 0 0
+Tcp: RtoAlgorithm RtoMin RtoMax MaxConn ActiveOpens PassiveOpens AttemptFails EstabResets CurrEstab InSegs OutSegs RetransSegs InErrs OutRsts InCsumErrors
+Tcp: 1 200 120000 -1 1021 12 3 4 %(connections)d 530921 551287 210 0 17 0
+Udp: InDatagrams NoPorts InErrors OutDatagrams RcvbufErrors SndbufErrors InCsumErrors IgnoredMulti MemErrors
+Udp: 7312 12 0 7354 0 0 0 0 0
+"""
+
+NETSTAT = """TcpExt: SyncookiesSent SyncookiesRecv SyncookiesFailed EmbryonicRsts PruneCalled RcvPruned OfoPruned ListenOverflows ListenDrops TCPTimeouts TCPLostRetransmit
+TcpExt: 0 0 0 0 0 0 0 3 3 41 2
+IpExt: InNoRoutes InTruncatedPkts InMcastPkts OutMcastPkts InBcastPkts OutBcastPkts InOctets OutOctets
+IpExt: 0 0 120 44 31 0 912834711 81273411
+"""
+
+SOCKSTAT = """sockets: used %(connections)d
+TCP: inuse %(connections)d orphan 0 tw 3 alloc %(connections)d mem 12
+UDP: inuse 2 mem 1
+UDPLITE: inuse 0
+RAW: inuse 0
+FRAG: inuse 0 memory 0
+"""
+
+ROUTE_HEADER = "Iface\tDestination\tGateway \tFlags\tRefCnt\tUse\tMetric\tMask\t\tMTU\tWindow\tIRTT\n"
+
+def iface_names(ifaces, wireless=0):
+    """Returns names of generated interfaces: wireless ones first"""
+    return ["wlan%d" % i for i in range(min(wireless, ifaces))] + \
+           ["eth%d" % i for i in range(ifaces - min(wireless, ifaces))]
+
+def write(root, path, data):
+    path = os.path.join(root, path)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, "w") as fd:
+        fd.write(data)
+
+def make_tree(root, ifaces=10, connections=1000, routes=10, wireless=1):
+    """Writes a tree with ifaces interfaces (wireless of them wireless),
+    connections tcp sockets and routes routes under root"""
+    names = iface_names(ifaces, wireless)
+    dev = [DEV_HEADER]
+    for i, name in enumerate(names):
+        dev.append("%6s: %d %d 0 0 0 0 0 0 %d %d 0 0 0 0 0 0\n" %
+                (name, i * 1000, i, i * 2000, i * 2))
+    write(root, "proc/net/dev", "".join(dev))
+    wifi = [WIRELESS_HEADER]
+    for name in names[:wireless]:
+        wifi.append("%6s: 0000   54.  -56.  -256        0      0      0      0      0        0\n" % name)
+    write(root, "proc/net/wireless", "".join(wifi))
+    for name in names:
+        write(root, "sys/class/net/%s/operstate" % name, "up\n")
+        if name.startswith("wlan"):
+            os.makedirs(os.path.join(root, "sys/class/net/%s/wireless" % name))
+    write(root, "proc/net/tcp", make_table(connections))
+    for proto in ["tcp6", "udp", "udp6", "raw", "raw6"]:
+        write(root, "proc/net/%s" % proto, make_table(0))
+    table = [ROUTE_HEADER]
+    for i in range(routes):
+        iface = names[i % len(names)] if names else "lo"
+        # 10.<i>.0.0/16, the first one is the default route
+        if i == 0:
+            dst, gw, mask, flags = 0, 0x0100000A, 0, 3
+        else:
+            dst, gw, mask, flags = 0x0A | ((i % 256) << 8), 0, 0xFFFF, 1
+        table.append("%s\t%08X\t%08X\t%04X\t0\t0\t%d\t%08X\t0\t0\t0\n" %
+                (iface, dst, gw, flags, i, mask))
+    write(root, "proc/net/route", "".join(table))
+    write(root, "proc/net/snmp", SNMP % {"connections": connections})
+    write(root, "proc/net/netstat", NETSTAT)
+    write(root, "proc/net/sockstat", SOCKSTAT % {"connections": connections})
+    write(root, "proc/sys/net/ipv4/ip_forward", "0\n")
+    os.makedirs(os.path.join(root, "proc/1/fd"))
+    write(root, "etc/resolv.conf", "nameserver 10.0.0.53\nnameserver 10.0.1.53\n")
+    for name in names[:10]:
+        write(root, "var/lib/vnstat/%s" % name, "")
+    write(root, "var/log/net_monitor.log",
+            "".join(["%s:UP:%d\n" % (name, 1000000000) for name in names]))
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print __doc__
+        sys.exit(1)
+    args = [int(x) for x in sys.argv[2:]]
+    make_tree(sys.argv[1], *args)
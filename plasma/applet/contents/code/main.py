@@ -55,20 +55,9 @@ class NetMonitor(plasmascript.Applet):
             print "Error: data for %s not available yet" % iface
             return
         widget = self.widgets[iface]
-        data_in = int(data[QString("data_in")])
-        data_out = int(data[QString("data_out")])
-        old_data_in = self.monitoring[iface]["in"]
-        old_data_out = self.monitoring[iface]["out"]
-        if old_data_in == -1:
-            speed_in = 0
-        else:
-            speed_in = data_in - old_data_in
-        if old_data_out == -1:
-            speed_out = 0
-        else:
-            speed_out = data_out - old_data_out
-        self.monitoring[iface]["in"] = data_in
-        self.monitoring[iface]["out"] = data_out
+        # speeds are computed by the data engine
+        speed_in = int(data[QString("speed_in")])
+        speed_out = int(data[QString("speed_out")])
         widget.setText("%s\n\/: %d\n/\: %d" % (sourceName, speed_in, speed_out))
 
     def paintInterface(self, painter, option, rect):
@@ -4,7 +4,7 @@
 # Copyright, (C) Eugeni Dodonov <eugeni@mandriva.com>, 2011
 #
 
-from PyQt4.QtCore import Qt, QVariant
+from PyQt4.QtCore import Qt, QVariant, QSocketNotifier
 from PyKDE4.plasma import Plasma
 from PyKDE4 import plasmascript
 
@@ -16,8 +16,16 @@ except IOError:
     _ = str
 
 from net_monitor import Monitor
+from net_monitor.netlink import EVENT_ADDED, EVENT_REMOVED
+from net_monitor.aggregate import ConnectionAggregator
+from net_monitor.rates import RX_BYTES, TX_BYTES, monotonic
+from net_monitor.alerts import AlertEngine, AnomalyDetector, DEFAULT_RULES, \
+        EVENT_FIRING, parse_rule
  
 class NetMonitorDataEngine(plasmascript.DataEngine):
+    # minimum age of a snapshot before collecting a new one (in seconds)
+    SNAPSHOT_INTERVAL = 0.333
+
     def __init__(self,parent,args=None):
         plasmascript.DataEngine.__init__(self,parent)
 
@@ -27,7 +35,16 @@ class NetMonitorDataEngine(plasmascript.DataEngine):
         self.setMinimumPollingInterval(333)
 
         self.monitor = Monitor()
-        self.ifaces = self.monitor.readnet()
+        self.snapshot = None
+        self.connections = ConnectionAggregator(self.monitor)
+        self.ifaces = dict.fromkeys(self.monitor.readnet().keys())
+
+        # alerts, and names of firing ones per interface; unusual send
+        # rates are anomalies, to highlight busy interfaces
+        self.alerts = AlertEngine([parse_rule(rule) for rule in DEFAULT_RULES],
+                [AnomalyDetector(counters=("tx_bytes",))])
+        self.alerts.connect(self.alert_changed)
+        self.iface_alerts = {}
 
         self.enabled_ifaces = []
         self.wireless_ifaces = filter(self.monitor.has_wireless, self.ifaces.keys())
@@ -35,30 +52,77 @@ class NetMonitorDataEngine(plasmascript.DataEngine):
         sorted_ifaces = self.ifaces.keys()
         sorted_ifaces.sort()
 
-        net=self.monitor.readnet()
-
         for iface in sorted_ifaces:
-            device_exists, data_in, data_out = self.monitor.get_traffic(iface,net)
-            self.ifaces[iface] = {'data_in': 0,
-                              'data_out': 0,
-                              'total_in': 0,
-                              'total_out': 0,
-                              'graph': None,
-                              'histogram': [],
-                              'address': "",
-                              }
-            if self.monitor.has_network_accounting(iface):
-                self.enabled_ifaces.append(iface)
+            self.add_iface(iface)
+
+        # get notified about new and removed interfaces
+        self.notifier = None
+        if self.monitor.watch_links():
+            self.notifier = QSocketNotifier(self.monitor.watcher.fileno(),
+                    QSocketNotifier.Read, self)
+            self.notifier.activated.connect(self.process_events)
 
         self.refresh_connections()
 
+    def add_iface(self, iface):
+        """Starts monitoring an interface"""
+        self.ifaces[iface] = {'data_in': 0,
+                          'data_out': 0,
+                          'total_in': 0,
+                          'total_out': 0,
+                          'graph': None,
+                          'address': "",
+                          }
+        if self.monitor.has_wireless(iface) and iface not in self.wireless_ifaces:
+            self.wireless_ifaces.append(iface)
+        if self.monitor.has_network_accounting(iface) and iface not in self.enabled_ifaces:
+            self.enabled_ifaces.append(iface)
+
+    def remove_iface(self, iface):
+        """Stops monitoring an interface"""
+        del self.ifaces[iface]
+        for ifaces in [self.wireless_ifaces, self.enabled_ifaces]:
+            if iface in ifaces:
+                ifaces.remove(iface)
+        self.removeSource(iface)
+
+    def process_events(self, fd=None):
+        """Handles link notifications"""
+        for event, iface, data in self.monitor.process_events():
+            if event == EVENT_ADDED and iface not in self.ifaces:
+                self.add_iface(iface)
+                # force a new snapshot including the new interface
+                self.snapshot = None
+                self.updateSourceEvent(iface)
+            elif event == EVENT_REMOVED and iface in self.ifaces:
+                self.remove_iface(iface)
+
+    def alert_changed(self, alert):
+        """Publishes alerts in the "alerts" source, as "name iface" keys"""
+        key = alert.name
+        if alert.iface:
+            key = "%s %s" % (alert.name, alert.iface)
+        names = self.iface_alerts.setdefault(alert.iface, [])
+        if alert.event == EVENT_FIRING:
+            names.append(alert.name)
+            self.setData("alerts", key, QVariant(alert.value))
+        else:
+            if alert.name in names:
+                names.remove(alert.name)
+            # invalid values remove keys
+            self.setData("alerts", key, QVariant())
+
     def refresh_connections(self):
         """Updates connections"""
-        for proto in ["tcp", "udp"]:
-            connections = self.monitor.get_connections(proto=proto)
-            for loc_addr, loc_port, rem_addr, rem_port, status in connections:
-                #print "%s - %s - %s - %s - %s - %s" % (proto, loc_addr, loc_port, rem_addr, rem_port, status)
-                pass
+        self.connections.update()
+        self.alerts.update_connections(self.connections.state_counts("tcp"))
+        for item, value in [('tcp_states', self.connections.state_counts("tcp")),
+                            ('top_remote', self.connections.top_remote()),
+                            ('top_listening_ports', self.connections.top_listening_ports()),
+                            ('top_local_ports', self.connections.top_local_ports()),
+                            ('top_processes', self.connections.top_processes()),
+                            ]:
+            self.setData("connections", item, QVariant(str(value)))
 
     def sources(self):
         """List of provided sources"""
@@ -71,89 +135,90 @@ class NetMonitorDataEngine(plasmascript.DataEngine):
         self.refresh_connections()
         return self.updateSourceEvent(name)
 
+    def get_snapshot(self):
+        """Returns current snapshot, collecting a new one once per polling interval"""
+        now = monotonic()
+        if self.snapshot is None or now - self.snapshot.clock >= self.SNAPSHOT_INTERVAL:
+            self.snapshot = self.monitor.snapshot(self.ifaces.keys())
+            return self.snapshot, True
+        return self.snapshot, False
+
     def updateSourceEvent(self, name):
         """Returns monitoring data"""
         print "Getting info for %s " % name
-        net=self.monitor.readnet()
-        interval = 1 # update interval
-        wifi_stats = self.monitor.wireless_stats()
-        for iface in [name]:
-            iface = str(iface)
-            status = self.monitor.get_status(iface)
-            old_data_in = self.ifaces[iface]['data_in']
-            old_data_out = self.ifaces[iface]['data_out']
-            total_in = self.ifaces[iface]['total_in']
-            total_out = self.ifaces[iface]['total_out']
-            # get the uptime
-            uptime = self.monitor.get_uptime(iface)
-            # update widgets
-            ip, mac = self.monitor.get_address(iface)
-            device_exists, data_in, data_out = self.monitor.get_traffic(iface, net)
-            # is it a wireless interface?
-            if iface in self.wireless_ifaces:
-                essid = self.monitor.wifi_get_essid(iface)
-                mode = self.monitor.wifi_get_mode(iface)
-                bitrate = self.monitor.wifi_get_bitrate(iface)
-                ap = self.monitor.wifi_get_ap(iface)
-                link = wifi_stats.get(iface, 0)
-                # calculate link quality
-                if "max_quality" in self.ifaces[iface]:
-                    max_quality = self.ifaces[iface]["max_quality"]
-                    if max_quality != 0:
-                        quality = link * 100.0 / max_quality
-                    else:
-                        quality = 0
-                else:
-                    quality = 0
-            else:
-                essid = None
-                mode = None
-                bitrate = None
-                ap = None
-                quality = 0
-            # is it the first measure?
-            if old_data_in == 0 and old_data_out == 0:
-                old_data_in = data_in
-                old_data_out = data_out
-            # check if device exists
-            if not device_exists:
-                old_data_in = data_in
-                old_data_out = data_out
-            # check total download
-            diff_in = data_in - old_data_in
-            diff_out = data_out - old_data_out
-            # checking for 32bits overflow
-            if diff_in < 0:
-                diff_in += 2**32
-            if diff_out < 0:
-                diff_out += 2**32
-            total_in += diff_in
-            total_out += diff_out
-            # speed
-            speed_in = diff_in / interval
-            speed_out = diff_out / interval
-            # update saved values
-            self.ifaces[iface]['data_in'] = data_in
-            self.ifaces[iface]['data_out'] = data_out
-            self.ifaces[iface]['total_in'] = total_in
-            self.ifaces[iface]['total_out'] = total_out
-            # now set the applet data
-            self.setData(iface, "data_in", QVariant(data_in))
-            self.setData(iface, "data_out", QVariant(data_in))
-            self.setData(iface, "total_in", QVariant(data_in))
-            self.setData(iface, "total_out", QVariant(data_in))
-            for item, value in [('ip_address', ip),
-                                  ('status', status),
-                                  ('hw_address', mac),
-                                  ('essid', essid),
-                                  ('mode', mode),
-                                  ('bitrate', bitrate),
-                                  ('ap', ap),
-                                  ('quality', "%d%%" % quality),
-                                  ('widget_uptime', uptime),
-                                  ]:
-                self.setData(iface, item, QVariant(value))
-            return True
+        snapshot, updated = self.get_snapshot()
+        if updated:
+            self.alerts.update(self.monitor, snapshot)
+            # a single snapshot is shared by all sources
+            for iface in snapshot.interfaces():
+                self.update_source(iface, snapshot)
+        return True
+
+    def update_source(self, iface, snapshot):
+        """Updates data for a source from snapshot"""
+        data = snapshot.get(iface)
+        if data is None:
+            return
+        rates = self.monitor.rates
+        # get the uptime
+        uptime = self.monitor.get_uptime(iface)
+        device_exists, data_in, data_out = snapshot.get_traffic(iface)
+        # None when not wireless, or when the card does not report its
+        # maximum quality
+        quality = data.quality()
+        if quality is None:
+            quality = 0
+        # totals and speeds are computed by the monitor, from monotonic
+        # timestamps and with counter wraps and resets handled
+        total_in = rates.total(iface, RX_BYTES)
+        total_out = rates.total(iface, TX_BYTES)
+        speed_in = rates.rate(iface, RX_BYTES)
+        speed_out = rates.rate(iface, TX_BYTES)
+        # update saved values
+        self.ifaces[iface]['data_in'] = data_in
+        self.ifaces[iface]['data_out'] = data_out
+        self.ifaces[iface]['total_in'] = total_in
+        self.ifaces[iface]['total_out'] = total_out
+        # now set the applet data
+        self.setData(iface, "data_in", QVariant(data_in))
+        self.setData(iface, "data_out", QVariant(data_out))
+        self.setData(iface, "total_in", QVariant(total_in))
+        self.setData(iface, "total_out", QVariant(total_out))
+        self.setData(iface, "speed_in", QVariant(speed_in))
+        self.setData(iface, "speed_out", QVariant(speed_out))
+        self.setData(iface, "smoothed_in", QVariant(rates.rate(iface, RX_BYTES, True)))
+        self.setData(iface, "smoothed_out", QVariant(rates.rate(iface, TX_BYTES, True)))
+        for counter in ["rx_errors", "rx_drops", "tx_errors", "tx_drops"]:
+            self.setData(iface, counter, QVariant(data.counter(counter)))
+        for item, value in [('ip_address', data.ip),
+                              ('status', data.status),
+                              ('hw_address', data.mac),
+                              ('essid', data.essid),
+                              ('mode', data.mode),
+                              ('bitrate', data.bitrate),
+                              ('ap', data.ap),
+                              ('signal', data.signal),
+                              ('noise', data.noise),
+                              ('quality', "%d%%" % quality),
+                              ('widget_uptime', uptime),
+                              ('alerts', ", ".join(self.iface_alerts.get(iface, []))),
+                              ]:
+            self.setData(iface, item, QVariant(value))
+        # statistics of the access point, from nl80211
+        if data.wireless:
+            stations = self.monitor.get_stations().get(iface)
+            station = stations and stations[0] or {}
+            for item in ["tx_bitrate", "rx_bitrate", "tx_retries", "tx_failed"]:
+                self.setData(iface, item, QVariant(station.get(item)))
+            self.setData(iface, "station_signal", QVariant(station.get("signal")))
+        # rates history
+        for window, resolution in self.monitor.history.windows:
+            for counter in ["rx_bytes", "tx_bytes"]:
+                stats = self.monitor.get_history(iface, counter, window)
+                if not stats:
+                    continue
+                for name, value in zip(["min", "max", "avg"], stats):
+                    self.setData(iface, "%s_%ds_%s" % (counter, window, name), QVariant(value))
  
 def CreateDataEngine(parent):
     return NetMonitorDataEngine(parent)
@@ -1,9 +1,6 @@
 from version import *
 
-from distutils.core import setup, Extension
-
-module1 = Extension('net_monitor/_native',
-                        sources=['src/_native.c'])
+from distutils.core import setup
 
 setup (name='net_monitor',
         version=version,
@@ -21,5 +18,4 @@ detailed logging and network traffic statistics with help of vnstat reporting.
 """,
         packages=["net_monitor"],
         package_dir = {"net_monitor": "src"},
-        scripts=["src/net_monitor"],
-        ext_modules=[module1])
+        scripts=["src/net_monitor", "src/net_monitord", "src/net_monitor_fleet"])
@@ -0,0 +1,250 @@
+#!/usr/bin/python
+"""net_monitor: incremental connection aggregation"""
+
+import os
+import heapq
+import threading
+import traceback
+
+from net_monitor.connections import CONNECTION_PROTOS, TCP_LISTEN, format_ipv4, format_ipv6
+
+class CountIndex:
+    """Counters with a heap of (-count, key) entries, so the largest ones
+    are found in O(log n) instead of sorting all counters on every query.
+    Entries are not removed when a counter changes: outdated ones are
+    skipped and dropped by top(), and the heap is rebuilt when they
+    outnumber the counters."""
+
+    def __init__(self):
+        self.counts = {}
+        # (-count, key) entries, some of them outdated
+        self.heap = []
+
+    def __len__(self):
+        return len(self.counts)
+
+    def get(self, key):
+        return self.counts.get(key, 0)
+
+    def add(self, key, delta=1):
+        """Changes counter of key by delta"""
+        new = self.counts.get(key, 0) + delta
+        if new > 0:
+            self.counts[key] = new
+            heapq.heappush(self.heap, (-new, key))
+        else:
+            self.counts.pop(key, None)
+        if len(self.heap) > 2 * len(self.counts) + 64:
+            self.compact()
+
+    def compact(self):
+        """Rebuilds heap without outdated entries"""
+        self.heap = [(-value, key) for key, value in self.counts.items()]
+        heapq.heapify(self.heap)
+
+    def top(self, count=10):
+        """Returns [(key, count)] of the largest counters"""
+        results = []
+        while self.heap and len(results) < count:
+            value, key = heapq.heappop(self.heap)
+            # outdated entry, or a duplicate of one already found
+            if self.counts.get(key) != -value or (results and results[-1] == (key, -value)):
+                continue
+            results.append((key, -value))
+        for key, value in results:
+            heapq.heappush(self.heap, (-value, key))
+        return results
+
+    def items(self):
+        return self.counts.items()
+
+
+class ProcessMap:
+    """Maps socket inodes to processes, by reading /proc/*/fd links. The
+    table is only rescanned when unknown inodes are requested."""
+
+    def __init__(self, root="/proc"):
+        self.root = root
+        self.inodes = {}
+        # inodes not found on last scan (owned by inaccessible processes)
+        self.unresolved = set()
+
+    def scan(self):
+        """Rebuilds inode -> pid table"""
+        inodes = {}
+        for pid in os.listdir(self.root):
+            if not pid.isdigit():
+                continue
+            fd_dir = os.path.join(self.root, pid, "fd")
+            try:
+                fds = os.listdir(fd_dir)
+            except OSError:
+                # process is gone or not accessible
+                continue
+            for fd in fds:
+                try:
+                    link = os.readlink(os.path.join(fd_dir, fd))
+                except OSError:
+                    continue
+                if link.startswith("socket:["):
+                    inodes[int(link[8:-1])] = int(pid)
+        self.inodes = inodes
+
+    def lookup(self, inodes):
+        """Returns {inode: pid} for inodes, rescanning at most once"""
+        unknown = [inode for inode in inodes if inode and inode not in self.inodes
+                and inode not in self.unresolved]
+        if unknown:
+            self.scan()
+            self.unresolved.update([inode for inode in unknown
+                if inode not in self.inodes])
+        return dict([(inode, self.inodes[inode]) for inode in inodes
+                if inode in self.inodes])
+
+    def forget(self, inodes):
+        """Removes closed sockets from table"""
+        for inode in inodes:
+            self.inodes.pop(inode, None)
+            self.unresolved.discard(inode)
+
+
+class ConnectionAggregator:
+    """Keeps connection counts by state, remote address, local port,
+    listening port and process. Successive connection tables are diffed, so only connections
+    which appeared, disappeared or changed state update the indexes. Queries
+    may come from other threads: they only wait for the indexes to be
+    updated, not for the tables to be read."""
+
+    def __init__(self, monitor, protos=CONNECTION_PROTOS, processes=True):
+        self.monitor = monitor
+        self.protos = protos
+        # proto -> {connection key: (state, inode)}
+        self.current = {}
+        self.by_state = CountIndex()
+        self.by_remote = CountIndex()
+        self.by_port = CountIndex()
+        self.by_process = CountIndex()
+        # listening sockets per port, and connections on listened ports
+        self.listeners = CountIndex()
+        self.by_listening = CountIndex()
+        self.processes = None
+        if processes:
+            self.processes = ProcessMap(monitor.path("/proc"))
+        # inode -> pid of counted connections
+        self.pids = {}
+        # held while indexes are updated or queried
+        self.lock = threading.Lock()
+
+    def table_keys(self, table):
+        """Returns {(local addr, local port, remote addr, remote port): (state,
+        inode)} for a ConnectionTable"""
+        if table.addr_words == 1:
+            local_addr = table.local_addr
+            remote_addr = table.remote_addr
+        else:
+            local_addr = zip(*[table.local_addr[i::4] for i in range(4)])
+            remote_addr = zip(*[table.remote_addr[i::4] for i in range(4)])
+        return dict(zip(zip(local_addr, table.local_port, remote_addr, table.remote_port),
+                zip(table.state, table.inode)))
+
+    def update(self, tables=None):
+        """Reads connections (or uses {proto: ConnectionTable} from tables)
+        and updates indexes with the differences"""
+        for proto in self.protos:
+            if tables is not None:
+                if proto not in tables:
+                    continue
+                table = tables[proto]
+            else:
+                table = self.monitor.get_connection_table(proto)
+            new = self.table_keys(table)
+            old = self.current.get(proto, {})
+            removed = [(key, old[key]) for key in set(old) - set(new)]
+            # new connections and ones which changed state
+            changed = set(new.items()) - set(old.items())
+            added = [(key, value) for key, value in changed]
+            pids = self.resolve_processes([value[1] for key, value in added])
+            with self.lock:
+                for key, value in removed:
+                    self.count(proto, key, value, -1)
+                for key, value in changed:
+                    if key in old:
+                        self.count(proto, key, old[key], -1)
+                self.pids.update(pids)
+                for key, value in added:
+                    self.count(proto, key, value, 1)
+            if self.processes:
+                self.processes.forget([value[1] for key, value in removed])
+            self.current[proto] = new
+
+    def resolve_processes(self, inodes):
+        """Returns {inode: pid} of owners of new sockets"""
+        if self.processes:
+            try:
+                return self.processes.lookup(inodes)
+            except:
+                traceback.print_exc()
+        return {}
+
+    def count(self, proto, key, value, delta):
+        """Updates all indexes for a single connection"""
+        local_addr, local_port, remote_addr, remote_port = key
+        state, inode = value
+        pid = self.pids.get(inode)
+        if delta < 0 and pid is not None:
+            del self.pids[inode]
+        self.by_state.add((proto, state), delta)
+        port = (proto.rstrip("6"), local_port)
+        if state == TCP_LISTEN:
+            listening = self.listeners.get(port)
+            self.listeners.add(port, delta)
+            if not listening or not self.listeners.get(port):
+                # the port started or stopped listening
+                self.by_listening.add(port, delta * self.by_port.get(port))
+            return
+        if remote_port:
+            self.by_remote.add(remote_addr, delta)
+        self.by_port.add(port, delta)
+        if self.listeners.get(port):
+            self.by_listening.add(port, delta)
+        if pid is not None:
+            self.by_process.add(pid, delta)
+
+    def state_counts(self, proto="tcp"):
+        """Returns {state: count} for a protocol (both address families)"""
+        counts = {}
+        with self.lock:
+            items = self.by_state.items()
+        for (state_proto, state), count in items:
+            if state_proto.rstrip("6") == proto:
+                counts[state] = counts.get(state, 0) + count
+        return counts
+
+    def top_remote(self, count=10):
+        """Returns [(remote address, connections)] of most active peers"""
+        results = []
+        with self.lock:
+            top = self.by_remote.top(count)
+        for addr, value in top:
+            if isinstance(addr, tuple):
+                results.append((format_ipv6(addr), value))
+            else:
+                results.append((format_ipv4(addr), value))
+        return results
+
+    def top_local_ports(self, count=10):
+        """Returns [((proto, local port), connections)] of busiest local
+        ports, listened on or not"""
+        with self.lock:
+            return self.by_port.top(count)
+
+    def top_listening_ports(self, count=10):
+        """Returns [((proto, port), connections)] of listening ports with
+        most connections"""
+        with self.lock:
+            return self.by_listening.top(count)
+
+    def top_processes(self, count=10):
+        """Returns [(pid, connections)] of processes with most connections"""
+        with self.lock:
+            return self.by_process.top(count)
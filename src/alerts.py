@@ -0,0 +1,630 @@
+#!/usr/bin/python
+"""net_monitor: threshold and anomaly alerts.
+
+Rules are compiled into series: a series is a single value (a counter rate
+of an interface, a connection count, ...) shared by all rules testing it.
+After each evaluation, a series keeps the band of values within which none
+of its rules can change state, and its rules are only evaluated when the
+value leaves the band. Series of a group (a metric of all interfaces)
+mostly share a band, so values leaving it are found in bulk. Rules fire
+after their condition held for a number of consecutive samples, and resolve
+once the value gets back past their clear value (hysteresis).
+
+Rules are written as
+    name metric[:argument] [interface pattern] (>|<) threshold [clear value] [for samples]
+for example "tx_busy rate:tx_bytes eth* > 1000000 clear 800000 for 3".
+"""
+
+import math
+import time
+import threading
+from fnmatch import fnmatch
+from collections import namedtuple
+
+from net_monitor.procfs import DEV_INDEX
+from net_monitor.connections import TCP_STATE_NAMES
+
+EVENT_FIRING = "firing"
+EVENT_RESOLVED = "resolved"
+
+# an alert event; iface is None for rules on connections
+Alert = namedtuple("Alert", "event name iface value timestamp")
+
+# metrics: name -> (per interface, default argument)
+#   rate:<counter>         per-second rate of a /proc/net/dev counter
+#   smoothed:<counter>     the same, smoothed (EWMA)
+#   error_rate             receive and send errors per packet
+#   quality                wireless link quality, in percents
+#   flaps:<secs>           link flaps over the last secs seconds
+#   connections:<state>    number of tcp connections in a state
+METRICS = {"rate": (True, "rx_bytes"),
+           "smoothed": (True, "rx_bytes"),
+           "error_rate": (True, None),
+           "quality": (True, None),
+           "flaps": (True, 3600),
+           "connections": (False, "established"),
+           }
+
+# flap counts slide with time, and are refreshed at least this often
+FLAPS_INTERVAL = 10.0
+
+# rules used when none are configured
+DEFAULT_RULES = ["errors error_rate > 0.01 clear 0.001 for 3",
+                 "weak_signal quality < 20 clear 25 for 3",
+                 "flapping flaps:3600 > 5 clear 2",
+                 "time_wait connections:time_wait > 5000 clear 4000",
+                 ]
+
+INFINITY = float("inf")
+
+STATE_NUMBERS = dict([(name, state) for state, name in TCP_STATE_NAMES.items()])
+
+RX_ERRORS = DEV_INDEX["rx_errors"]
+TX_ERRORS = DEV_INDEX["tx_errors"]
+RX_PACKETS = DEV_INDEX["rx_packets"]
+TX_PACKETS = DEV_INDEX["tx_packets"]
+
+def positions(values, found):
+    """Returns indexes in values of found, a subsequence of values selected
+    by value (by filter())"""
+    indexes = []
+    i = -1
+    for value in found:
+        i = values.index(value, i + 1)
+        indexes.append(i)
+    return indexes
+
+def pick(values, rows):
+    """Returns values of rows (in increasing order) from values of all
+    RateEngine rows"""
+    if len(values) == len(rows):
+        return values
+    return map(values.__getitem__, rows)
+
+def reorder(values, indexes, default):
+    """Returns values at indexes, default where an index is None"""
+    result = []
+    for i in indexes:
+        if i is None:
+            result.append(default)
+        else:
+            result.append(values[i])
+    return result
+
+def error_rates(rates):
+    """Errors per packet of all interfaces of a RateEngine, by row"""
+    rx_errors = rates.column(RX_ERRORS)
+    tx_errors = rates.column(TX_ERRORS)
+    values = [0.0] * len(rx_errors)
+    # errors are rare: only rows with some are computed
+    rows = set(positions(rx_errors, filter(None, rx_errors)))
+    rows.update(positions(tx_errors, filter(None, tx_errors)))
+    if rows:
+        rx_packets = rates.column(RX_PACKETS)
+        tx_packets = rates.column(TX_PACKETS)
+        for row in rows:
+            packets = rx_packets[row] + tx_packets[row]
+            if packets:
+                values[row] = (rx_errors[row] + tx_errors[row]) / packets
+    return values
+
+
+class Rule:
+    """A threshold on a metric (see METRICS): fires when the value is above
+    (or below) threshold for samples consecutive samples, and resolves when
+    it gets back to clear (threshold by default)"""
+
+    def __init__(self, name, metric, threshold, below=False, clear=None,
+            samples=1, iface="*", arg=None):
+        if metric not in METRICS:
+            raise ValueError("unknown metric: %s" % metric)
+        per_iface, default = METRICS[metric]
+        if arg is None:
+            arg = default
+        if metric in ("rate", "smoothed"):
+            if arg not in DEV_INDEX:
+                raise ValueError("unknown counter: %s" % arg)
+            arg = DEV_INDEX[arg]
+        elif metric == "flaps":
+            arg = int(arg)
+        elif metric == "connections":
+            if arg not in STATE_NUMBERS:
+                raise ValueError("unknown tcp state: %s" % arg)
+            arg = STATE_NUMBERS[arg]
+        if clear is None:
+            clear = threshold
+        # rules are evaluated on sign * value, so below rules work as above
+        # ones
+        self.sign = below and -1 or 1
+        self.trigger = self.sign * threshold
+        self.clear = self.sign * clear
+        if self.clear > self.trigger:
+            raise ValueError("clear value of %s is beyond its threshold" % name)
+        self.name = name
+        self.metric = metric
+        self.arg = arg
+        self.samples = max(int(samples), 1)
+        self.iface = per_iface and iface or None
+
+    def matches(self, iface):
+        return self.iface == iface or fnmatch(iface, self.iface)
+
+def parse_rule(line):
+    """Parses a rule (see module documentation)"""
+    fields = line.split()
+    try:
+        if len(fields) < 2:
+            raise ValueError("missing metric")
+        name, metric = fields[:2]
+        fields = fields[2:]
+        metric, sep, arg = metric.partition(":")
+        iface = "*"
+        if not fields:
+            raise ValueError("missing threshold")
+        if fields[0] not in ("<", ">"):
+            iface = fields.pop(0)
+        if len(fields) < 2:
+            raise ValueError("missing threshold")
+        op, threshold = fields[:2]
+        options = dict(zip(fields[2::2], fields[3::2]))
+        if op not in ("<", ">") or len(fields) % 2 or \
+                [key for key in options if key not in ("clear", "for")]:
+            raise ValueError
+        clear = options.get("clear")
+        if clear is not None:
+            clear = float(clear)
+        return Rule(name, metric, float(threshold), below=op == "<", clear=clear,
+                samples=int(options.get("for", 1)), iface=iface, arg=arg or None)
+    except (IndexError, ValueError), e:
+        message = str(e)
+        if message:
+            message = ": " + message
+        raise ValueError("invalid rule '%s'%s" % (line, message))
+
+def load_rules(path):
+    """Reads rules from a file, one per line"""
+    rules = []
+    with open(path) as fd:
+        for line in fd:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                rules.append(parse_rule(line))
+    return rules
+
+
+class Series:
+    """Rules testing a single value, and their state"""
+
+    def __init__(self, iface):
+        self.iface = iface
+        self.rules = []
+        self.active = []
+        self.counts = []
+        self.value = None
+        # values outside (low, high) need evaluation: new series always do
+        self.low = INFINITY
+        self.high = -INFINITY
+
+    def add(self, rule):
+        self.rules.append(rule)
+        self.active.append(False)
+        self.counts.append(0)
+        self.low = INFINITY
+        self.high = -INFINITY
+
+    def evaluate(self, value, timestamp, events):
+        """Updates rule states from a new value, and computes its band"""
+        if value is None:
+            return
+        self.value = value
+        low = -INFINITY
+        high = INFINITY
+        pending = False
+        active = self.active
+        counts = self.counts
+        i = 0
+        for rule in self.rules:
+            sign = rule.sign
+            x = sign * value
+            if active[i]:
+                if x <= rule.clear:
+                    active[i] = False
+                    counts[i] = 0
+                    events.append(Alert(EVENT_RESOLVED, rule.name, self.iface, value, timestamp))
+            elif x > rule.trigger:
+                counts[i] += 1
+                if counts[i] >= rule.samples:
+                    active[i] = True
+                    events.append(Alert(EVENT_FIRING, rule.name, self.iface, value, timestamp))
+                else:
+                    pending = True
+            elif counts[i]:
+                counts[i] = 0
+            # state holds while x > clear (active) or x <= trigger
+            # (inactive); boundaries are excluded from the band, and are
+            # always evaluated
+            if active[i]:
+                limit = sign * rule.clear
+            else:
+                limit = sign * rule.trigger
+            if (sign > 0) == active[i]:
+                if limit > low:
+                    low = limit
+            elif limit < high:
+                high = limit
+            i += 1
+        if pending:
+            # consecutive samples are counted on every sample
+            low, high = INFINITY, -INFINITY
+        self.low = low
+        self.high = high
+
+    def default_band(self):
+        """Returns the band of values when no rule is active or pending"""
+        low = -INFINITY
+        high = INFINITY
+        for rule in self.rules:
+            if rule.sign > 0:
+                high = min(high, rule.trigger)
+            else:
+                low = max(low, -rule.trigger)
+        return low, high
+
+    def resolve(self, timestamp, events):
+        """Resolves active rules, when the value is gone"""
+        for i, rule in enumerate(self.rules):
+            if self.active[i]:
+                self.active[i] = False
+                events.append(Alert(EVENT_RESOLVED, rule.name, self.iface, None, timestamp))
+            self.counts[i] = 0
+
+
+class SeriesGroup:
+    """Series of a metric and argument, evaluated together. sources are
+    parallel to series, holding what their values are computed from:
+    RateEngine rows of interfaces (in increasing order), interface names or
+    tcp states.
+
+    Series with the same rules share a band while none of them is active
+    or pending: the band of the group. Values outside of it are found with
+    filter(), and only series with another band (special ones) are compared
+    one by one."""
+
+    def __init__(self, metric, arg):
+        self.metric = metric
+        self.arg = arg
+        self.series = []
+        self.sources = []
+        self.low = INFINITY
+        self.high = -INFINITY
+        # indexes of series whose band is not the band of the group
+        self.special = set()
+
+    def append(self, series, source):
+        self.series.append(series)
+        self.sources.append(source)
+
+    def compile(self):
+        """Sets the band of the group, the most common default band of its
+        series, once they are all appended"""
+        counts = {}
+        for series in self.series:
+            band = series.default_band()
+            counts[band] = counts.get(band, 0) + 1
+        if counts:
+            # bound methods of floats are used by evaluate()
+            self.low, self.high = map(float, max(counts, key=counts.get))
+        self.special = set([i for i, series in enumerate(self.series)
+                            if (series.low, series.high) != (self.low, self.high)])
+
+    def evaluate(self, values, timestamp, events):
+        """Evaluates series whose values left their bands"""
+        low = self.low
+        high = self.high
+        special = self.special
+        outside = set()
+        # None (unknown quality, or a missing interface) compares as
+        # NotImplemented, so it is found too, and ignored by
+        # Series.evaluate()
+        if high < INFINITY:
+            outside.update(positions(values, filter(high.__le__, values)))
+        if low > -INFINITY:
+            outside.update(positions(values, filter(low.__ge__, values)))
+        outside.difference_update(special)
+        for i in special:
+            series = self.series[i]
+            if not series.low < values[i] < series.high:
+                outside.add(i)
+        for i in sorted(outside):
+            series = self.series[i]
+            series.evaluate(values[i], timestamp, events)
+            if series.low == low and series.high == high:
+                special.discard(i)
+            else:
+                special.add(i)
+
+
+class AnomalyDetector:
+    """Rolling anomaly detection on interface counter rates: each counter
+    keeps an EWMA of its rate and of its variance, and an anomaly fires when
+    the z-score of a sample is above threshold, resolving when it gets back
+    below clear. Until the EWMA time constant is reached, statistics are
+    plain averages of the samples so far, so they are usable after warmup
+    samples. Deviations are at least min_deviation (in counter units
+    per second), so idle counters do not alert on the first packets.
+
+    State is kept by counter, in lists parallel to the tracked interfaces,
+    so that rates of a counter are read at once from RateEngine tables."""
+
+    def __init__(self, name="anomaly", counters=("rx_bytes", "tx_bytes"), tau=300.0,
+            threshold=4.0, clear=2.0, warmup=30, min_deviation=1024.0, iface="*"):
+        self.name = name
+        self.names = ["%s.%s" % (name, counter) for counter in counters]
+        self.columns = [DEV_INDEX[counter] for counter in counters]
+        self.tau = tau
+        self.threshold = threshold
+        self.clear = clear
+        self.warmup = warmup
+        self.min_variance = min_deviation ** 2
+        self.iface = iface
+        # tracked interfaces, their RateEngine rows and numbers of samples
+        self.ifaces = []
+        self.rows = []
+        self.samples = []
+        # by counter, parallel to ifaces: EWMA of rates and of variances,
+        # the square of the deviation above which the z-score of the next
+        # sample is computed, which is where inactive anomalies fire (-1 for
+        # active ones, infinite during warmup), and anomaly states
+        self.means = [[] for column in self.columns]
+        self.variances = [[] for column in self.columns]
+        self.limits = [[] for column in self.columns]
+        self.active = [[] for column in self.columns]
+        self.clock = None
+
+    def matches(self, iface):
+        return self.iface == iface or fnmatch(iface, self.iface)
+
+    def bind(self, rates, timestamp, events):
+        """Tracks matching interfaces of a RateEngine, forgetting the others"""
+        indexes = dict([(iface, k) for k, iface in enumerate(self.ifaces)])
+        for iface, k in indexes.items():
+            if iface not in rates.rows:
+                for name, active in zip(self.names, self.active):
+                    if active[k]:
+                        events.append(Alert(EVENT_RESOLVED, name, iface, None, timestamp))
+        self.ifaces = [iface for iface in rates.names
+                       if iface in indexes or self.matches(iface)]
+        self.rows = [rates.rows[iface] for iface in self.ifaces]
+        previous = [indexes.get(iface) for iface in self.ifaces]
+        limit = INFINITY
+        if self.warmup <= 0:
+            limit = self.threshold ** 2 * self.min_variance
+        self.samples = reorder(self.samples, previous, 0)
+        for i in range(len(self.columns)):
+            self.means[i] = reorder(self.means[i], previous, 0.0)
+            self.variances[i] = reorder(self.variances[i], previous, 0.0)
+            self.limits[i] = reorder(self.limits[i], previous, limit)
+            self.active[i] = reorder(self.active[i], previous, False)
+
+    def update(self, rates, clock, timestamp, events):
+        """Adds a sample of RateEngine rates taken at clock"""
+        if self.clock is None or clock <= self.clock:
+            self.clock = clock
+            return
+        alpha = 1.0 - math.exp(-(clock - self.clock) / self.tau)
+        self.clock = clock
+        count = len(self.ifaces)
+        samples = self.samples
+        valid = pick(rates.valid, self.rows)
+        if all(valid):
+            indexes = range(count)
+        else:
+            indexes = [k for k in range(count) if valid[k]]
+        # weights of samples, and squared z-score thresholds
+        if not samples or 1.0 / (min(samples) + 1) <= alpha:
+            weights = [alpha] * count
+            keeps = [1.0 - alpha] * count
+        else:
+            weights = [max(alpha, 1.0 / (n + 1)) for n in samples]
+            keeps = [1.0 - weight for weight in weights]
+        scales = [self.threshold ** 2] * count
+        if samples and min(samples) + 1 < self.warmup:
+            for k, n in enumerate(samples):
+                if n + 1 < self.warmup:
+                    scales[k] = INFINITY
+        min_variance = self.min_variance
+        for i, column in enumerate(self.columns):
+            values = pick(rates.column(column), self.rows)
+            means = self.means[i]
+            variances = self.variances[i]
+            limits = self.limits[i]
+            active = self.active[i]
+            for k in indexes:
+                diff = values[k] - means[k]
+                square = diff * diff
+                if square > limits[k]:
+                    # z-score against statistics preceding this sample
+                    z = abs(diff) / math.sqrt(max(variances[k], min_variance))
+                    if not active[k]:
+                        active[k] = True
+                        events.append(Alert(EVENT_FIRING, self.names[i], self.ifaces[k], z,
+                                timestamp))
+                    elif z < self.clear:
+                        active[k] = False
+                        events.append(Alert(EVENT_RESOLVED, self.names[i], self.ifaces[k], z,
+                                timestamp))
+                weight = weights[k]
+                means[k] += weight * diff
+                variance = keeps[k] * (variances[k] + weight * square)
+                variances[k] = variance
+                if active[k]:
+                    limits[k] = -1.0
+                elif variance > min_variance:
+                    limits[k] = scales[k] * variance
+                else:
+                    limits[k] = scales[k] * min_variance
+        for k in indexes:
+            samples[k] += 1
+
+
+class AlertEngine:
+    """Evaluates Rules and AnomalyDetectors on Monitor samples, calling
+    callbacks with an Alert on every state change"""
+
+    def __init__(self, rules=(), detectors=()):
+        self.rules = list(rules)
+        self.detectors = list(detectors)
+        self.callbacks = []
+        self.lock = threading.Lock()
+        # (metric, arg, iface) -> Series
+        self.series = {}
+        # SeriesGroups of interface metrics, and of connections
+        self.groups = []
+        self.connection_group = SeriesGroup("connections", None)
+        for rule in self.rules:
+            if rule.iface is None:
+                self.add_series(rule, None)
+        self.rebuild({})
+        # (name, iface) -> firing Alert
+        self.alerts = {}
+        # version of RateEngine interfaces series are bound to
+        self.rates_version = None
+        # uptime log version and clock of the last flaps evaluation
+        self.uptime_version = None
+        self.flaps_checked = -INFINITY
+
+    def connect(self, callback):
+        """Calls callback(alert) on every firing or resolved alert. Callbacks
+        run in the thread feeding samples."""
+        self.callbacks.append(callback)
+
+    def active(self):
+        """Returns firing Alerts"""
+        with self.lock:
+            return sorted(self.alerts.values())
+
+    def add_series(self, rule, iface):
+        key = (rule.metric, rule.arg, iface)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = Series(iface)
+        series.add(rule)
+
+    def rebuild(self, rows):
+        """Groups series by metric and argument, binding them to RateEngine
+        rows of interfaces ({iface: row})"""
+        groups = {}
+        connections = SeriesGroup("connections", None)
+        for (metric, arg, iface), series in sorted(self.series.items(),
+                key=lambda item: (item[0][:2], rows.get(item[0][2]))):
+            if metric == "connections":
+                connections.append(series, arg)
+                continue
+            group = groups.get((metric, arg))
+            if group is None:
+                group = groups[(metric, arg)] = SeriesGroup(metric, arg)
+            if metric in ("rate", "smoothed", "error_rate"):
+                source = rows[iface]
+            else:
+                source = iface
+            group.append(series, source)
+        self.groups = [groups[key] for key in sorted(groups)]
+        self.connection_group = connections
+        for group in self.groups + [connections]:
+            group.compile()
+
+    def bind(self, monitor, snapshot, events):
+        """Compiles rules for the interfaces known to monitor rates"""
+        ifaces = monitor.rates.ifaces
+        for key, series in self.series.items():
+            if key[2] is not None and key[2] not in ifaces:
+                series.resolve(snapshot.timestamp, events)
+                del self.series[key]
+        # interfaces may be added by another snapshot meanwhile
+        for iface in ifaces.keys():
+            data = snapshot.ifaces.get(iface)
+            for rule in self.rules:
+                if rule.iface is None or not rule.matches(iface):
+                    continue
+                if rule.metric == "quality" and not (data and data.wireless):
+                    continue
+                series = self.series.get((rule.metric, rule.arg, iface))
+                if series is None or rule not in series.rules:
+                    self.add_series(rule, iface)
+        self.rebuild(monitor.rates.rows)
+        for detector in self.detectors:
+            detector.bind(monitor.rates, snapshot.timestamp, events)
+        self.rates_version = monitor.rates.version
+
+    def values(self, group, monitor, snapshot):
+        """Returns values of a group of interface series, or None when they
+        need no evaluation"""
+        metric = group.metric
+        if metric in ("rate", "smoothed"):
+            return pick(monitor.rates.column(group.arg, metric == "smoothed"), group.sources)
+        elif metric == "error_rate":
+            return pick(error_rates(monitor.rates), group.sources)
+        elif metric == "quality":
+            ifaces = snapshot.ifaces
+            return [ifaces[iface].quality() if iface in ifaces else None
+                    for iface in group.sources]
+        elif metric == "flaps":
+            uptime = monitor.uptime_log
+            uptime.update(force=False)
+            if uptime.version == self.uptime_version and \
+                    snapshot.clock - self.flaps_checked < FLAPS_INTERVAL:
+                return None
+            devices = uptime.devices
+            # events may be recorded meanwhile by link notifications
+            with uptime.lock:
+                return [iface in devices and
+                        devices[iface].availability(group.arg, snapshot.timestamp)[0] or 0
+                        for iface in group.sources]
+        return None
+
+    def update(self, monitor, snapshot):
+        """Evaluates rules on a new Monitor snapshot, returns alerts"""
+        events = []
+        with self.lock:
+            if monitor.rates.version != self.rates_version:
+                self.bind(monitor, snapshot, events)
+            timestamp = snapshot.timestamp
+            flaps = False
+            for group in self.groups:
+                values = self.values(group, monitor, snapshot)
+                if values is not None:
+                    group.evaluate(values, timestamp, events)
+                    flaps = flaps or group.metric == "flaps"
+            if flaps:
+                self.uptime_version = monitor.uptime_log.version
+                self.flaps_checked = snapshot.clock
+            for detector in self.detectors:
+                detector.update(monitor.rates, snapshot.clock, timestamp, events)
+            self.record(events)
+        self.emit(events)
+        return events
+
+    def update_connections(self, counts):
+        """Evaluates connection rules on tcp connection counts by state
+        ({state: count}), returns alerts"""
+        events = []
+        with self.lock:
+            group = self.connection_group
+            if group.series:
+                group.evaluate([counts.get(state, 0) for state in group.sources],
+                        time.time(), events)
+            self.record(events)
+        self.emit(events)
+        return events
+
+    def record(self, events):
+        for alert in events:
+            if alert.event == EVENT_FIRING:
+                self.alerts[(alert.name, alert.iface)] = alert
+            else:
+                self.alerts.pop((alert.name, alert.iface), None)
+
+    def emit(self, events):
+        for alert in events:
+            for callback in self.callbacks:
+                callback(alert)
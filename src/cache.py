@@ -0,0 +1,96 @@
+#!/usr/bin/python
+"""net_monitor: change-detection cache for slow-changing data"""
+
+import os
+import threading
+
+from net_monitor.rates import monotonic
+
+# time to live of cached items, in seconds, used when there is no cheap
+# way to detect changes
+CACHE_TTL = {"routes": 5.0,
+             "address": 5.0,
+             "essid": 10.0,
+             "mode": 10.0,
+             "ap": 10.0,
+             "bitrate": 2.0,
+             "signal": 2.0,
+             "noise": 2.0,
+             # does not change for a card, kept until the interface changes
+             "max_quality": None,
+             }
+
+def file_token(path):
+    """Returns a token which changes when a file is replaced or modified"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_ino, st.st_mtime, st.st_size
+
+
+class Cache:
+    """Values keyed by (name, argument), kept until their TTL expires or
+    their validation token changes. Tokens are cheap to compute values
+    which change together with the data, such as a file_token() or a
+    generation counter increased when a change notification arrives."""
+
+    def __init__(self):
+        # key -> (value, expiration time, token)
+        self.entries = {}
+        # name -> generation counter
+        self.generations = {}
+        self.hits = 0
+        self.misses = 0
+        # values are computed without it, so a slow one does not hold up
+        # lookups of the others
+        self.lock = threading.Lock()
+
+    def lookup(self, key, token=None):
+        """Returns (True, value) for a valid entry, (False, None) otherwise"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, expires, old_token = entry
+                if old_token == token and (expires is None or monotonic() < expires):
+                    self.hits += 1
+                    return True, value
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value, ttl=None, token=None):
+        """Stores a value, valid for ttl seconds (forever if None) and while
+        token does not change"""
+        expires = None
+        if ttl is not None:
+            expires = monotonic() + ttl
+        with self.lock:
+            self.entries[key] = (value, expires, token)
+
+    def get(self, key, func, ttl=None, token=None):
+        """Returns cached value of key, or calls func() to get a new one"""
+        found, value = self.lookup(key, token)
+        if not found:
+            value = func()
+            self.set(key, value, ttl, token)
+        return value
+
+    def invalidate(self, name=None, arg=None):
+        """Drops entries of name and/or argument (all entries if both are
+        None)"""
+        with self.lock:
+            if name is None and arg is None:
+                self.entries = {}
+                return
+            for key in self.entries.keys():
+                if (name is None or key[0] == name) and (arg is None or key[1] == arg):
+                    self.entries.pop(key, None)
+
+    def generation(self, name):
+        return self.generations.get(name, 0)
+
+    def bump(self, name):
+        """Increases generation counter of name, invalidating entries which
+        use it as token"""
+        with self.lock:
+            self.generations[name] = self.generations.get(name, 0) + 1
@@ -0,0 +1,285 @@
+#!/usr/bin/python
+"""net_monitor: column-oriented connection tables"""
+
+import re
+import sys
+import socket
+import struct
+import array
+import binascii
+
+from net_monitor.procfs import COUNTER_TYPECODE
+
+# tcp states, as in include/net/tcp_states.h
+TCP_ESTABLISHED = 1
+TCP_SYN_SENT = 2
+TCP_SYN_RECV = 3
+TCP_FIN_WAIT1 = 4
+TCP_FIN_WAIT2 = 5
+TCP_TIME_WAIT = 6
+TCP_CLOSE = 7
+TCP_CLOSE_WAIT = 8
+TCP_LAST_ACK = 9
+TCP_LISTEN = 10
+TCP_CLOSING = 11
+
+# names of tcp states
+TCP_STATE_NAMES = {TCP_ESTABLISHED: "established",
+                   TCP_SYN_SENT: "syn_sent",
+                   TCP_SYN_RECV: "syn_recv",
+                   TCP_FIN_WAIT1: "fin_wait1",
+                   TCP_FIN_WAIT2: "fin_wait2",
+                   TCP_TIME_WAIT: "time_wait",
+                   TCP_CLOSE: "close",
+                   TCP_CLOSE_WAIT: "close_wait",
+                   TCP_LAST_ACK: "last_ack",
+                   TCP_LISTEN: "listen",
+                   TCP_CLOSING: "closing",
+                   }
+
+# supported /proc/net connection tables
+CONNECTION_PROTOS = ["tcp", "tcp6", "udp", "udp6", "raw", "raw6"]
+
+# /proc/net/{tcp,udp,raw}[6] row: the addresses, ports, state and queues
+# have fixed width and are captured as a single field, followed by uid and
+# inode. IPv6 addresses are printed as four 32-bit words.
+CONNECTION_RE = {
+        socket.AF_INET: re.compile(r": (.{48}) .{20} +(\d+) +\S+ (\d+)"),
+        socket.AF_INET6: re.compile(r": (.{96}) .{20} +(\d+) +\S+ (\d+)"),
+        }
+
+# tcp_info fields kept by tables read with sock_diag: (name, typecode)
+TCP_INFO_FIELDS = [("rtt", "I"),
+                   ("rttvar", "I"),
+                   ("retransmits", "B"),
+                   ("total_retrans", "I"),
+                   ("lost", "I"),
+                   ("snd_cwnd", "I"),
+                   ("bytes_acked", COUNTER_TYPECODE),
+                   ("bytes_received", COUNTER_TYPECODE)]
+
+# size of addresses, in 32-bit words
+ADDRESS_WORDS = {socket.AF_INET: 1, socket.AF_INET6: 4}
+
+def connection_fields(family):
+    """Hex fields of the fixed-width part of a row: (name, typecode, size
+    in bytes)"""
+    addr_size = ADDRESS_WORDS[family] * 4
+    return [("local_addr", "I", addr_size),
+            ("local_port", "H", 2),
+            ("remote_addr", "I", addr_size),
+            ("remote_port", "H", 2),
+            ("state", "B", 1),
+            ("tx_queue", "I", 4),
+            ("rx_queue", "I", 4)]
+
+def proto_family(proto):
+    """Returns address family of a /proc/net connection table"""
+    if proto.endswith("6"):
+        return socket.AF_INET6
+    return socket.AF_INET
+
+def decode_columns(rows, fields):
+    """Decodes fixed-width hex rows into {field: array}, using only
+    strided slicing of the decoded bytes"""
+    row_size = sum([size for name, typecode, size in fields])
+    # strip ':' and ' ' separators, keeping only hex digits
+    raw = binascii.unhexlify("".join(rows).translate(None, ": "))
+    count = len(raw) // row_size
+    columns = {}
+    offset = 0
+    for name, typecode, size in fields:
+        data = bytearray(size * count)
+        for byte in range(size):
+            data[byte::size] = raw[offset + byte::row_size]
+        column = array.array(typecode)
+        column.fromstring(str(data))
+        if sys.byteorder == "little" and column.itemsize > 1:
+            # hex values are printed most significant digit first
+            column.byteswap()
+        columns[name] = column
+        offset += size
+    return columns
+
+def format_ipv4(addr):
+    """Formats an IPv4 address as printed by /proc/net/tcp"""
+    return socket.inet_ntoa(struct.pack("I", addr))
+
+def format_ipv6(words):
+    """Formats an IPv6 address as printed by /proc/net/tcp6"""
+    return socket.inet_ntop(socket.AF_INET6, struct.pack("4I", *words))
+
+
+class Connection(object):
+    """A single connection: a lightweight view into a ConnectionTable row.
+    Iterating over it gives the (local address, local port, remote address,
+    remote port, state name) tuple returned by Monitor.get_connections."""
+    __slots__ = ("table", "index")
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def __iter__(self):
+        return iter((self.local_addr, self.local_port, self.remote_addr,
+                self.remote_port, self.status))
+
+    def __repr__(self):
+        return "<Connection %s %s:%d %s:%d %s>" % ((self.proto,) + tuple(self))
+
+    @property
+    def proto(self):
+        return self.table.proto
+
+    @property
+    def family(self):
+        return self.table.family
+
+    @property
+    def local_addr(self):
+        return self.table.format_address(self.table.local_addr, self.index)
+
+    @property
+    def local_port(self):
+        return self.table.local_port[self.index]
+
+    @property
+    def remote_addr(self):
+        return self.table.format_address(self.table.remote_addr, self.index)
+
+    @property
+    def remote_port(self):
+        return self.table.remote_port[self.index]
+
+    @property
+    def state(self):
+        return self.table.state[self.index]
+
+    @property
+    def status(self):
+        return self.table.state_name(self.table.state[self.index])
+
+    @property
+    def uid(self):
+        return self.table.uid[self.index]
+
+    @property
+    def inode(self):
+        return self.table.inode[self.index]
+
+    @property
+    def tcp_info(self):
+        """tcp_info fields as a dict, if the table has them"""
+        return self.table.tcp_info_row(self.index)
+
+
+class ConnectionTable:
+    """Connections of a protocol, stored as arrays of integers. Rows are only
+    formatted as strings when accessed."""
+
+    def __init__(self, proto, states=None):
+        self.proto = proto
+        self.family = proto_family(proto)
+        # words per address in local_addr and remote_addr
+        self.addr_words = ADDRESS_WORDS[self.family]
+        # translated state names, indexed by state
+        self.states = states
+        self.local_addr = array.array("I")
+        self.local_port = array.array("H")
+        self.remote_addr = array.array("I")
+        self.remote_port = array.array("H")
+        self.state = array.array("B")
+        self.tx_queue = array.array("I")
+        self.rx_queue = array.array("I")
+        self.uid = array.array("I")
+        self.inode = array.array("L")
+        # {field: array} of tcp_info fields, when available
+        self.tcp_info = None
+
+    def __len__(self):
+        return len(self.state)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return Connection(self, i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield Connection(self, i)
+
+    def address(self, column, i):
+        """Returns address from column as an integer (IPv4) or a tuple of
+        words (IPv6)"""
+        if self.addr_words == 1:
+            return column[i]
+        return tuple(column[i * 4:i * 4 + 4])
+
+    def format_address(self, column, i):
+        """Pretty-formats address from column"""
+        if self.addr_words == 1:
+            return format_ipv4(column[i])
+        return format_ipv6(column[i * 4:i * 4 + 4])
+
+    def state_name(self, state):
+        """Pretty-formats connection state"""
+        if self.states and state < len(self.states):
+            return self.states[state]
+        return _("Unknown")
+
+    def count_states(self):
+        """Returns {state: number of connections}"""
+        counts = {}
+        for state in self.state:
+            counts[state] = counts.get(state, 0) + 1
+        return counts
+
+    def tcp_info_row(self, i):
+        """Returns tcp_info fields of a row, or None"""
+        if self.tcp_info is None:
+            return None
+        info = {}
+        for name, typecode in TCP_INFO_FIELDS:
+            info[name] = self.tcp_info[name][i]
+        return info
+
+    def subset(self, indexes):
+        """Returns a new table with rows from indexes"""
+        table = ConnectionTable(self.proto, self.states)
+        words = self.addr_words
+        for i in indexes:
+            table.local_addr.extend(self.local_addr[i * words:(i + 1) * words])
+            table.remote_addr.extend(self.remote_addr[i * words:(i + 1) * words])
+        for name in ["local_port", "remote_port", "state", "tx_queue",
+                "rx_queue", "uid", "inode"]:
+            column = getattr(self, name)
+            getattr(table, name).extend([column[i] for i in indexes])
+        if self.tcp_info is not None:
+            table.tcp_info = {}
+            for name, column in self.tcp_info.items():
+                table.tcp_info[name] = array.array(column.typecode,
+                        [column[i] for i in indexes])
+        return table
+
+    def find(self, state=None, port=None):
+        """Returns indexes of connections in state and/or on local port"""
+        return [i for i in range(len(self))
+                if (state is None or self.state[i] == state)
+                and (port is None or self.local_port[i] == port)]
+
+
+def parse_connections(data, proto="tcp", states=None):
+    """Parses contents of /proc/net/{tcp,udp,raw}[6] into a ConnectionTable"""
+    table = ConnectionTable(proto, states)
+    rows = CONNECTION_RE[table.family].findall(data)
+    if not rows:
+        return table
+    fixed, uid, inode = zip(*rows)
+    for name, column in decode_columns(fixed,
+            connection_fields(table.family)).items():
+        setattr(table, name, column)
+    table.uid = array.array("I", map(int, uid))
+    table.inode = array.array("L", map(int, inode))
+    return table
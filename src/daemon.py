@@ -0,0 +1,609 @@
+#!/usr/bin/python
+"""net_monitor: headless collector daemon and its client.
+
+The daemon runs a single collection loop and serves its results over a
+unix socket, and optionally over TCP for remote aggregators (see
+fleet.py). The protocol is line-delimited JSON: every request and reply is
+a JSON object on a single line.
+
+The unix socket can only be used by root and by members of the group it
+is given to (SOCKET_MODE). The TCP listener has no authentication: anyone
+who can reach its port reads all collected data, including connections
+and the processes owning them, so it should only be bound to trusted
+networks.
+
+Requests:
+    {"cmd": "get", "topics": ["interfaces", ...]}
+    {"cmd": "subscribe", "topics": [...], "interval": 1.0}
+    {"cmd": "unsubscribe"}
+    {"cmd": "ping"}
+
+Replies to "get" and subscription updates are
+    {"time": <snapshot timestamp>, "data": {topic: ...}}
+link notifications are sent to subscribers as
+    {"event": "added", "iface": "eth0"}
+and errors as {"error": "message"}.
+"""
+
+import os
+import grp
+import time
+import json
+import math
+import errno
+import select
+import socket
+import traceback
+
+from net_monitor import Monitor
+from net_monitor.rates import monotonic
+from net_monitor.procfs import DEV_COLUMNS
+from net_monitor.netlink import EVENT_ADDED
+from net_monitor.aggregate import ConnectionAggregator
+from net_monitor.scheduler import Scheduler, COLLECTOR_INTERVALS, monitor_collectors
+from net_monitor.recorder import Recorder
+from net_monitor.alerts import AlertEngine
+
+# default location of the query socket
+SOCKET_PATH = "/var/run/net_monitor.sock"
+
+# permissions of the query socket: clients must run as root or be members
+# of its group
+SOCKET_MODE = 0660
+
+# default TCP port, when listening for remote clients
+PORT = 9466
+
+# default collection intervals, in seconds
+COLLECT_INTERVAL = COLLECTOR_INTERVALS["counters"]
+CONNECTIONS_INTERVAL = COLLECTOR_INTERVALS["connections"]
+
+# shortest subscription interval accepted
+MIN_INTERVAL = 0.1
+
+# clients whose output buffer grows above this are too slow, and dropped
+MAX_BUFFER = 1024 * 1024
+
+# longest request accepted; clients sending longer lines are dropped
+MAX_REQUEST = 64 * 1024
+
+# data which can be requested or subscribed to, and collectors it comes from
+TOPICS = {"interfaces": ["counters", "interfaces"],
+          "history": ["counters", "interfaces"],
+          "connections": ["connections"],
+          "routes": ["routes"],
+          "dns": ["dns"],
+          "accounting": ["vnstat"],
+          "stations": ["stations"],
+          "kernel": ["kernel"],
+          "neighbors": ["neighbors"],
+          "alerts": ["counters", "interfaces", "connections"],
+          }
+
+def encode(message):
+    """Encodes a message as a JSON line"""
+    return json.dumps(message, separators=(",", ":")) + "\n"
+
+def group_id(group):
+    """Returns id of a group, given by name or number"""
+    try:
+        if group.isdigit():
+            return grp.getgrgid(int(group)).gr_gid
+        return grp.getgrnam(group).gr_gid
+    except KeyError:
+        raise ValueError("unknown group: %s" % group)
+
+
+class Collector:
+    """Keeps a Monitor and its latest data, collected by a Scheduler: each
+    collector (counters, interfaces, routes, dns, connections, vnstat,
+    stations, kernel, neighbors) runs on its own interval. When alert rules
+    are given, they are evaluated on every new sample."""
+
+    def __init__(self, backend="proc", interval=COLLECT_INTERVAL,
+            connections_interval=CONNECTIONS_INTERVAL, record=None, rules=None):
+        self.monitor = Monitor(backend)
+        self.monitor.load_uptime_log()
+        self.connections = ConnectionAggregator(self.monitor)
+        intervals = dict(COLLECTOR_INTERVALS)
+        intervals["counters"] = interval
+        intervals["stations"] = interval
+        intervals["kernel"] = interval
+        intervals["connections"] = connections_interval
+        self.interval = interval
+        self.scheduler = monitor_collectors(Scheduler(), self.monitor,
+                intervals, self.connections)
+        # topic -> (generations of its collectors, data)
+        self.cache = {}
+        # snapshots and connection summaries are recorded to a file
+        self.recorder = None
+        if record:
+            self.recorder = Recorder(record)
+            for name in ["counters", "interfaces"]:
+                self.scheduler.connect(name, self.record_snapshot)
+            self.scheduler.connect("connections", self.record_connections)
+        self.alerts = None
+        if rules:
+            self.alerts = AlertEngine(rules)
+            for name in ["counters", "interfaces"]:
+                self.scheduler.connect(name, self.check_snapshot)
+            self.scheduler.connect("connections", self.check_connections)
+
+    def start(self):
+        self.scheduler.start()
+
+    def stop(self):
+        self.scheduler.stop()
+        if self.recorder:
+            self.recorder.close()
+
+    def record_snapshot(self, name, snapshot):
+        self.recorder.write_snapshot(snapshot)
+
+    def record_connections(self, name, aggregator):
+        self.recorder.write_connections(time.time(), dict(aggregator.by_state.items()))
+
+    def check_snapshot(self, name, snapshot):
+        self.alerts.update(self.monitor, snapshot)
+
+    def check_connections(self, name, aggregator):
+        self.alerts.update_connections(aggregator.state_counts("tcp"))
+
+    def refresh(self):
+        """Collects interface details as soon as possible"""
+        self.scheduler.trigger("interfaces")
+
+    def get(self, topic):
+        """Returns data of a topic, formatted for JSON"""
+        generations = tuple([self.scheduler.generation(name)
+                for name in TOPICS[topic]])
+        if topic not in self.cache or self.cache[topic][0] != generations:
+            self.cache[topic] = (generations, getattr(self, "get_%s" % topic)())
+        return self.cache[topic][1]
+
+    def get_interfaces(self):
+        """{iface: state, counters and rates}"""
+        result = {}
+        snapshot = self.monitor.last_snapshot
+        if snapshot is None:
+            return result
+        monitor = self.monitor
+        for iface, data in snapshot.ifaces.items():
+            info = {"exists": data.exists,
+                    "status": data.status,
+                    "ip": data.ip,
+                    "mac": data.mac,
+                    "counters": dict(zip(DEV_COLUMNS, data.counters)),
+                    "uptime": monitor.get_uptime(iface),
+                    }
+            # rates are updated in place by snapshot collectors
+            with monitor.snapshot_lock:
+                rates = monitor.rates.get(iface)
+                if rates is not None and rates.valid:
+                    info["rates"] = dict(zip(DEV_COLUMNS, rates.rates))
+                    info["smoothed"] = dict(zip(DEV_COLUMNS, rates.smoothed))
+                    info["totals"] = dict(zip(DEV_COLUMNS, [int(x) for x in rates.totals]))
+            if data.wireless:
+                info.update({"essid": data.essid,
+                             "mode": data.mode,
+                             "bitrate": data.bitrate,
+                             "ap": data.ap,
+                             "quality": data.quality(),
+                             "signal": data.signal,
+                             "noise": data.noise,
+                             })
+            result[iface] = info
+        return result
+
+    def get_history(self):
+        """{iface: {counter: {window: [min, max, avg]}}}"""
+        result = {}
+        history = self.monitor.history
+        with self.monitor.snapshot_lock:
+            for iface, data in history.ifaces.items():
+                counters = {}
+                for counter, series in data.series.items():
+                    windows = {}
+                    for tier in series.tiers:
+                        stats = tier.stats()
+                        if stats:
+                            windows[str(tier.window)] = stats
+                    counters[counter] = windows
+                result[iface] = counters
+        return result
+
+    def get_connections(self):
+        """Connection aggregates"""
+        connections = self.connections
+        return {"tcp_states": connections.state_counts("tcp"),
+                "top_remote": connections.top_remote(),
+                "top_listening_ports": connections.top_listening_ports(),
+                "top_local_ports": connections.top_local_ports(),
+                "top_processes": connections.top_processes(),
+                }
+
+    def get_routes(self):
+        """[(iface, destination, mask, gateway, metric)] and default routes"""
+        return self.scheduler.latest("routes")
+
+    def get_dns(self):
+        """DNS servers"""
+        return self.scheduler.latest("dns")
+
+    def get_stations(self):
+        """{iface: [stations]} of wireless interfaces"""
+        return self.scheduler.latest("stations") or {}
+
+    def get_kernel(self):
+        """{file: {"values": {counter: value}, "deltas": {counter: change}
+        or None, "interval": seconds}} and ip forwarding state"""
+        result = {}
+        for name, sample in (self.scheduler.latest("kernel") or {}).items():
+            deltas = None
+            if sample.deltas is not None:
+                deltas = dict(sample.delta_items())
+            result[name] = {"values": dict(sample.items()),
+                            "deltas": deltas,
+                            "interval": sample.interval,
+                            }
+        result["forwarding"] = self.monitor.get_forwarding()
+        return result
+
+    def get_neighbors(self):
+        """{iface: [[address, mac, state]]}"""
+        result = {}
+        for neighbor in self.scheduler.latest("neighbors") or []:
+            result.setdefault(neighbor.iface, []).append(
+                    [neighbor.address, neighbor.mac, neighbor.state])
+        return result
+
+    def get_accounting(self):
+        """{iface: vnstat totals, with hours, days and months as [date, rx, tx]}"""
+        result = {}
+        for iface, data in (self.scheduler.latest("vnstat") or {}).items():
+            if data is not None:
+                result[iface] = data._asdict()
+        return result
+
+    def get_alerts(self):
+        """[[name, iface, value, timestamp]] of firing alerts"""
+        if self.alerts is None:
+            return []
+        return [[alert.name, alert.iface, alert.value, alert.timestamp]
+                for alert in self.alerts.active()]
+
+    def data(self, topics):
+        """Returns a reply with data of topics"""
+        timestamp = None
+        snapshot = self.monitor.last_snapshot
+        if snapshot is not None:
+            timestamp = snapshot.timestamp
+        return {"time": timestamp,
+                "data": dict([(topic, self.get(topic)) for topic in topics])}
+
+
+class ClientConnection:
+    """A connected client: buffers and subscription state"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.input = ""
+        self.output = ""
+        self.topics = None
+        self.interval = None
+        self.next_update = None
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send(self, message):
+        self.output += encode(message)
+
+    def subscribe(self, topics, interval, now):
+        self.topics = topics
+        self.interval = max(interval, MIN_INTERVAL)
+        self.next_update = now
+
+    def unsubscribe(self):
+        self.topics = None
+        self.next_update = None
+
+
+class Daemon:
+    """Serves Collector data over a unix socket, and over TCP when address
+    ((host, port)) is given. The unix socket is given to group (a group
+    id), if set."""
+
+    def __init__(self, collector, path=SOCKET_PATH, address=None, group=None):
+        self.collector = collector
+        self.path = path
+        self.address = address
+        self.group = group
+        self.server = None
+        self.tcp_server = None
+        self.clients = {}
+        self.running = False
+
+    def listen(self):
+        """Creates the server sockets, replacing a stale unix one"""
+        try:
+            os.unlink(self.path)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.path)
+        if self.group is not None:
+            os.chown(self.path, -1, self.group)
+        os.chmod(self.path, SOCKET_MODE)
+        self.server.listen(16)
+        self.server.setblocking(False)
+        if self.address:
+            self.tcp_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.tcp_server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.tcp_server.bind(self.address)
+            # aggregators connect to many hosts at once
+            self.tcp_server.listen(128)
+            self.tcp_server.setblocking(False)
+
+    def close(self):
+        """Disconnects clients and removes the sockets"""
+        for client in self.clients.values():
+            client.sock.close()
+        self.clients = {}
+        if self.tcp_server:
+            self.tcp_server.close()
+            self.tcp_server = None
+        if self.server:
+            self.server.close()
+            self.server = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def stop(self):
+        self.running = False
+
+    def accept(self, server):
+        try:
+            sock, addr = server.accept()
+        except socket.error:
+            return
+        if server is self.tcp_server:
+            # replies are small, do not delay them
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = ClientConnection(sock)
+        self.clients[client.fileno()] = client
+
+    def disconnect(self, client):
+        self.clients.pop(client.fileno(), None)
+        client.sock.close()
+
+    def read(self, client, now):
+        """Reads and handles requests of a client"""
+        try:
+            data = client.sock.recv(65536)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EINTR):
+                return
+            data = ""
+        if not data:
+            self.disconnect(client)
+            return
+        client.input += data
+        while "\n" in client.input:
+            line, client.input = client.input.split("\n", 1)
+            if line.strip():
+                self.handle(client, line, now)
+        if len(client.input) > MAX_REQUEST:
+            # not a client of ours
+            self.disconnect(client)
+
+    def write(self, client):
+        """Flushes output buffer of a client"""
+        try:
+            sent = client.sock.send(client.output)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EINTR):
+                return
+            self.disconnect(client)
+            return
+        client.output = client.output[sent:]
+
+    def handle(self, client, line, now):
+        """Handles a single request"""
+        try:
+            request = json.loads(line)
+            cmd = request.get("cmd")
+        except (ValueError, AttributeError):
+            client.send({"error": "invalid request"})
+            return
+        topics = request.get("topics", TOPICS.keys())
+        if cmd in ("get", "subscribe"):
+            if not isinstance(topics, list) or \
+                    [topic for topic in topics if not isinstance(topic, basestring)]:
+                client.send({"error": "topics must be a list of names"})
+                return
+            unknown = [topic for topic in topics if topic not in TOPICS]
+            if unknown:
+                client.send({"error": "unknown topics: %s" % ", ".join(unknown)})
+                return
+        if cmd == "get":
+            client.send(self.collector.data(topics))
+        elif cmd == "subscribe":
+            try:
+                interval = float(request.get("interval", self.collector.interval))
+            except (TypeError, ValueError):
+                interval = None
+            if interval is None or not interval > 0 or math.isinf(interval):
+                client.send({"error": "invalid interval"})
+                return
+            client.subscribe(topics, interval, now)
+        elif cmd == "unsubscribe":
+            client.unsubscribe()
+        elif cmd == "ping":
+            client.send({"pong": True})
+        else:
+            client.send({"error": "unknown command: %s" % cmd})
+
+    def process_events(self):
+        """Forwards link notifications to subscribers"""
+        events = self.collector.monitor.process_events()
+        for event, iface, data in events:
+            if event == EVENT_ADDED:
+                self.collector.refresh()
+            for client in self.clients.values():
+                if client.topics is not None:
+                    client.send({"event": event, "iface": iface})
+
+    def update_subscribers(self, now):
+        """Sends data to subscribers which are due, returns when next
+        update is due"""
+        next_update = None
+        for client in self.clients.values():
+            if client.next_update is None:
+                continue
+            if now >= client.next_update:
+                try:
+                    client.send(self.collector.data(client.topics))
+                except:
+                    traceback.print_exc()
+                    self.disconnect(client)
+                    continue
+                client.next_update += client.interval
+                if client.next_update < now:
+                    # we are late, do not send updates in bursts
+                    client.next_update = now + client.interval
+            if next_update is None or client.next_update < next_update:
+                next_update = client.next_update
+        return next_update
+
+    def run(self):
+        """Main loop"""
+        if not self.server:
+            self.listen()
+        watcher = None
+        if self.collector.monitor.watch_links():
+            watcher = self.collector.monitor.watcher
+        self.collector.start()
+        self.running = True
+        while self.running:
+            now = monotonic()
+            timeout = None
+            next_update = self.update_subscribers(now)
+            if next_update is not None:
+                timeout = max(next_update - now, 0)
+            for client in self.clients.values():
+                if len(client.output) > MAX_BUFFER:
+                    self.disconnect(client)
+            servers = [self.server]
+            if self.tcp_server:
+                servers.append(self.tcp_server)
+            readers = servers + self.clients.values()
+            if watcher:
+                readers.append(watcher)
+            writers = [client for client in self.clients.values() if client.output]
+            try:
+                readable, writable, errors = select.select(readers, writers, [],
+                        timeout)
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            now = monotonic()
+            for obj in readable:
+                if obj in servers:
+                    self.accept(obj)
+                elif obj is watcher:
+                    self.process_events()
+                elif obj.fileno() in self.clients:
+                    try:
+                        self.read(obj, now)
+                    except:
+                        # a failed request only drops its client
+                        traceback.print_exc()
+                        self.disconnect(obj)
+            for client in writable:
+                if client.fileno() in self.clients:
+                    self.write(client)
+        self.collector.stop()
+        self.close()
+
+
+class DaemonClient:
+    """Client of the collector daemon, at a unix socket path or a (host,
+    port) address"""
+
+    def __init__(self, path=SOCKET_PATH):
+        if isinstance(path, tuple):
+            self.sock = socket.create_connection(path)
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(path)
+        self.input = ""
+
+    def close(self):
+        self.sock.close()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send(self, cmd, **args):
+        args["cmd"] = cmd
+        self.sock.sendall(encode(args))
+
+    def receive(self):
+        """Waits for the next message"""
+        while "\n" not in self.input:
+            data = self.sock.recv(65536)
+            if not data:
+                raise IOError(errno.ECONNRESET, "connection closed by daemon")
+            self.input += data
+        line, self.input = self.input.split("\n", 1)
+        return json.loads(line)
+
+    def messages(self):
+        """Returns messages which can be read without blocking, for use
+        with select() or a socket notifier on fileno()"""
+        self.sock.setblocking(False)
+        try:
+            while True:
+                try:
+                    data = self.sock.recv(65536)
+                except socket.error, e:
+                    if e.args[0] in (errno.EAGAIN, errno.EINTR):
+                        break
+                    raise
+                if not data:
+                    raise IOError(errno.ECONNRESET, "connection closed by daemon")
+                self.input += data
+        finally:
+            self.sock.setblocking(True)
+        messages = []
+        while "\n" in self.input:
+            line, self.input = self.input.split("\n", 1)
+            messages.append(json.loads(line))
+        return messages
+
+    def request(self, cmd, **args):
+        """Sends a request and waits for its reply. Notifications received
+        in between are discarded."""
+        self.send(cmd, **args)
+        while True:
+            message = self.receive()
+            if "event" not in message:
+                return message
+
+    def get(self, topics=TOPICS.keys()):
+        """Returns current data of topics"""
+        return self.request("get", topics=topics)
+
+    def subscribe(self, topics=TOPICS.keys(), interval=COLLECT_INTERVAL):
+        """Subscribes to topics; updates are read with receive() or
+        messages()"""
+        self.send("subscribe", topics=topics, interval=interval)
+
+    def unsubscribe(self):
+        self.send("unsubscribe")
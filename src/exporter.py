@@ -0,0 +1,227 @@
+#!/usr/bin/python
+"""net_monitor: OpenMetrics exporter.
+
+Serves data of a daemon Collector over HTTP, in the OpenMetrics text
+format scraped by Prometheus. Metrics are rendered from the latest
+collected data: scrapes never read /proc themselves, and the rendered text
+is reused until collectors produce new data.
+"""
+
+import threading
+import SocketServer
+import BaseHTTPServer
+from operator import add
+
+from net_monitor.procfs import DEV_COLUMNS, DEV_COUNTERS
+from net_monitor.connections import TCP_STATE_NAMES
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+METRICS_PATH = "/metrics"
+
+# collectors metrics are rendered from
+SOURCES = ["counters", "interfaces", "connections", "routes"]
+
+# help of /proc/net/dev counters
+COUNTER_HELP = {"rx_bytes": "Received bytes",
+                "rx_packets": "Received packets",
+                "rx_errors": "Receive errors",
+                "rx_drops": "Dropped received packets",
+                "rx_fifo": "Receive FIFO errors",
+                "rx_frame": "Receive frame errors",
+                "rx_compressed": "Received compressed packets",
+                "multicast": "Received multicast packets",
+                "tx_bytes": "Sent bytes",
+                "tx_packets": "Sent packets",
+                "tx_errors": "Send errors",
+                "tx_drops": "Dropped sent packets",
+                "tx_fifo": "Send FIFO errors",
+                "collisions": "Collisions",
+                "tx_carrier": "Carrier errors",
+                "tx_compressed": "Sent compressed packets",
+                }
+
+def escape(value):
+    """Escapes a label value"""
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def header(name, metric_type, help):
+    """Returns metric family header"""
+    return "# TYPE %s %s\n# HELP %s %s.\n" % (name, metric_type, name, help)
+
+def counter_name(column):
+    return "net_monitor_interface_%s" % column
+
+# per-interface metrics: (name, type, help), with headers pre-built
+INTERFACE_METRICS = [(counter_name(column), "counter", COUNTER_HELP[column])
+                     for column in DEV_COLUMNS] + \
+                    [("net_monitor_interface_up", "gauge", "Interface is operational"),
+                     ("net_monitor_interface_up_since_seconds", "gauge",
+                         "Time the interface went up")]
+HEADERS = dict([(name, header(name, metric_type, help))
+                for name, metric_type, help in INTERFACE_METRICS])
+
+
+class MetricsRenderer:
+    """Renders Collector data as OpenMetrics text. Sample prefixes (names
+    with interface labels) are built once for a set of interfaces, so each
+    family is rendered by joining prefixes with formatted values, and
+    families whose values did not change reuse their previous text."""
+
+    def __init__(self, collector):
+        self.collector = collector
+        self.lock = threading.Lock()
+        # generations of SOURCES the cached text was rendered from
+        self.generations = None
+        self.text = ""
+        # interfaces of the current layout, and sample prefixes by metric
+        self.ifaces = None
+        self.prefixes = {}
+        # metric -> (values, rendered samples) of per-interface families
+        self.families = {}
+        # (uptime log version, interfaces) -> up since times
+        self.uptimes = (None, ())
+
+    def render(self):
+        """Returns metrics text, rendered again only when collectors have
+        new data"""
+        scheduler = self.collector.scheduler
+        generations = tuple([scheduler.generation(name) for name in SOURCES])
+        with self.lock:
+            if generations != self.generations:
+                self.text = self.build()
+                self.generations = generations
+            return self.text
+
+    def layout(self, ifaces):
+        """Returns {metric: [sample prefix per interface]}"""
+        if ifaces != self.ifaces:
+            labels = ['{interface="%s"} ' % escape(iface) for iface in ifaces]
+            self.prefixes = {}
+            for name, metric_type, help in INTERFACE_METRICS:
+                if metric_type == "counter":
+                    sample = name + "_total"
+                else:
+                    sample = name
+                self.prefixes[name] = [sample + label for label in labels]
+            self.families = {}
+            self.ifaces = ifaces
+        return self.prefixes
+
+    def build(self):
+        parts = []
+        # snapshots are immutable, and replaced as a whole by collectors,
+        # so a scrape never waits for them
+        snapshot = self.collector.monitor.last_snapshot
+        if snapshot is not None and snapshot.ifaces:
+            self.build_interfaces(parts, snapshot)
+        self.build_connections(parts)
+        self.build_routes(parts)
+        parts.append("# EOF\n")
+        return "".join(parts)
+
+    def family(self, parts, name, prefixes, values):
+        """Appends a family of per-interface samples (values is a tuple)"""
+        cached = self.families.get(name)
+        if cached is not None and cached[0] == values:
+            text = cached[1]
+        else:
+            text = "\n".join(map(add, prefixes, map(str, values)))
+            self.families[name] = (values, text)
+        parts.append(HEADERS[name])
+        parts.append(text)
+        parts.append("\n")
+
+    def build_interfaces(self, parts, snapshot):
+        ifaces = tuple(sorted(snapshot.ifaces))
+        rows = [snapshot.ifaces[iface] for iface in ifaces]
+        prefixes = self.layout(ifaces)
+        zeros = (0,) * DEV_COUNTERS
+        columns = zip(*[row.counters or zeros for row in rows])
+        for column, name in enumerate(DEV_COLUMNS):
+            name = counter_name(name)
+            self.family(parts, name, prefixes[name], columns[column])
+        self.family(parts, "net_monitor_interface_up",
+                prefixes["net_monitor_interface_up"],
+                tuple([int(row.status == "up") for row in rows]))
+        uptime = self.collector.monitor.uptime_log
+        # lines appended to the log since the last check bump its version
+        uptime.update(force=False)
+        key = (uptime.version, ifaces)
+        if key != self.uptimes[0]:
+            self.uptimes = (key, tuple([max(uptime.uptime(iface), 0) for iface in ifaces]))
+        self.family(parts, "net_monitor_interface_up_since_seconds",
+                prefixes["net_monitor_interface_up_since_seconds"], self.uptimes[1])
+        wireless = [row for row in rows if row.wireless]
+        if not wireless:
+            return
+        for name, help, attr in [("net_monitor_wireless_quality_percent", "Link quality", "quality"),
+                                 ("net_monitor_wireless_signal_dbm", "Signal level", "signal"),
+                                 ("net_monitor_wireless_bitrate_bits", "Bit rate", "bitrate")]:
+            parts.append(header(name, "gauge", help))
+            for row in wireless:
+                value = getattr(row, attr)
+                if callable(value):
+                    value = value()
+                if isinstance(value, (int, long, float)):
+                    parts.append('%s{interface="%s"} %s\n' % (name, escape(row.name), value))
+
+    def build_connections(self, parts):
+        aggregator = self.collector.scheduler.latest("connections")
+        if aggregator is None:
+            return
+        name = "net_monitor_tcp_connections"
+        parts.append(header(name, "gauge", "TCP connections by state"))
+        for state, count in sorted(aggregator.state_counts("tcp").items()):
+            parts.append('%s{state="%s"} %d\n' % (name, TCP_STATE_NAMES.get(state, state), count))
+
+    def build_routes(self, parts):
+        routes = self.collector.scheduler.latest("routes")
+        if routes is None:
+            return
+        routes, default_routes = routes
+        parts.append(header("net_monitor_routes", "gauge", "IPv4 routes"))
+        parts.append("net_monitor_routes %d\n" % len(routes))
+        parts.append(header("net_monitor_default_routes", "gauge", "IPv4 default routes"))
+        parts.append("net_monitor_default_routes %d\n" % len(default_routes))
+
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves metrics on METRICS_PATH"""
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != METRICS_PATH:
+            self.send_error(404)
+            return
+        body = self.server.renderer.render()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scrapes are too frequent to be logged
+        pass
+
+
+class MetricsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """HTTP server for a MetricsRenderer, serving each scrape in a thread"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, renderer):
+        BaseHTTPServer.HTTPServer.__init__(self, address, MetricsHandler)
+        self.renderer = renderer
+
+    def start(self):
+        """Serves requests in a background thread"""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        return thread
+
+def parse_address(value):
+    """Parses a '[host:]port' listen address"""
+    host, sep, port = value.rpartition(":")
+    return host, int(port)
@@ -0,0 +1,324 @@
+#!/usr/bin/python
+"""net_monitor: fleet aggregation of many net_monitord instances.
+
+A Fleet keeps a connection to each peer daemon (see daemon.py) and pulls
+their data concurrently: requests are sent to all peers at once and replies
+are read as they arrive, from non-blocking sockets multiplexed with poll().
+Connections are reused between polls, so a poll costs a single round trip
+per peer. Peers which do not reply in time, or cannot be reached, are
+reported as down and retried with an increasing delay, without holding up
+the others.
+"""
+
+import json
+import errno
+import select
+import socket
+from fnmatch import fnmatch
+
+from net_monitor.rates import monotonic
+from net_monitor.daemon import PORT, encode
+from net_monitor.connections import TCP_ESTABLISHED
+
+# topics pulled from each peer
+FLEET_TOPICS = ["interfaces", "connections"]
+
+# default time to wait for replies, in seconds
+TIMEOUT = 2.0
+
+# delays before reconnecting to a failed peer, doubled on each failure
+RETRY_DELAY = 1.0
+MAX_RETRY_DELAY = 60.0
+
+# interface groups: (group, pattern), first match wins
+GROUPS = [("loopback", "lo"),
+          ("wireless", "wl*"),
+          ("wireless", "ath*"),
+          ("ethernet", "eth*"),
+          ("ethernet", "en*"),
+          ("bridge", "br*"),
+          ("tunnel", "tun*"),
+          ("tunnel", "tap*"),
+          ("tunnel", "wg*"),
+          ("ppp", "ppp*"),
+          ]
+
+# groups not counted in host throughput
+LOCAL_GROUPS = ["loopback"]
+
+def parse_peer(spec):
+    """Parses a peer: a unix socket path, or host[:port]. Returns (name,
+    address)."""
+    if spec.startswith("/"):
+        return spec, spec
+    host, sep, port = spec.rpartition(":")
+    if not sep or "]" in port:
+        # no port, or a bare IPv6 address
+        host, port = spec, PORT
+    return spec, (host.strip("[]"), int(port))
+
+def interface_group(iface, groups=GROUPS):
+    """Returns group of an interface; unmatched interfaces are grouped by
+    their name without trailing digits"""
+    for group, pattern in groups:
+        if fnmatch(iface, pattern):
+            return group
+    return iface.rstrip("0123456789") or iface
+
+
+class Peer:
+    """Connection to a peer daemon and its latest reply"""
+
+    def __init__(self, name, address):
+        self.name = name
+        self.address = address
+        self.sock = None
+        self.sockaddr = None
+        self.connecting = False
+        # connection was used by a previous poll
+        self.reused = False
+        self.input = ""
+        self.output = ""
+        # latest reply, and when it was received
+        self.reply = None
+        self.updated = None
+        self.latency = None
+        self.error = None
+        self.failures = 0
+        self.retry_at = 0
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def resolve(self):
+        """Returns (family, sockaddr) of the peer, resolved once"""
+        if self.sockaddr is None:
+            if isinstance(self.address, tuple):
+                host, port = self.address
+                info = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)[0]
+                self.sockaddr = (info[0], info[4])
+            else:
+                self.sockaddr = (socket.AF_UNIX, self.address)
+        return self.sockaddr
+
+    def connect(self):
+        """Starts a non-blocking connection"""
+        family, sockaddr = self.resolve()
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.setblocking(False)
+        if family != socket.AF_UNIX:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        err = self.sock.connect_ex(sockaddr)
+        if err not in (0, errno.EINPROGRESS, errno.EAGAIN, errno.EWOULDBLOCK):
+            raise socket.error(err, "cannot connect")
+        self.connecting = err != 0
+        self.reused = False
+        self.input = ""
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        self.connecting = False
+        self.reused = False
+
+    def fail(self, error, now):
+        """Drops the connection, and delays the next attempt"""
+        self.close()
+        self.error = error
+        self.failures += 1
+        self.retry_at = now + min(RETRY_DELAY * 2 ** (self.failures - 1), MAX_RETRY_DELAY)
+
+    def handle(self, event):
+        """Handles a poll() event. Returns the reply, or None while it is
+        incomplete; raises socket.error when the connection failed."""
+        if self.connecting and event & (select.POLLOUT | select.POLLERR | select.POLLHUP):
+            err = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                raise socket.error(err, "cannot connect")
+            self.connecting = False
+        if event & select.POLLNVAL:
+            raise socket.error(errno.EBADF, "invalid socket")
+        if self.output and event & select.POLLOUT:
+            sent = self.sock.send(self.output)
+            self.output = self.output[sent:]
+        if event & (select.POLLIN | select.POLLERR | select.POLLHUP):
+            data = self.sock.recv(65536)
+            if not data:
+                raise socket.error(errno.ECONNRESET, "connection closed by peer")
+            self.input += data
+            while "\n" in self.input:
+                line, self.input = self.input.split("\n", 1)
+                message = json.loads(line)
+                # link notifications are only sent to subscribers, but
+                # skip them anyway
+                if "event" not in message:
+                    return message
+        return None
+
+
+class Fleet:
+    """Pulls data from many peer daemons concurrently"""
+
+    def __init__(self, peers, topics=FLEET_TOPICS, timeout=TIMEOUT):
+        self.peers = [Peer(name, address) for name, address in
+                [parse_peer(spec) for spec in peers]]
+        self.topics = topics
+        self.timeout = timeout
+
+    def close(self):
+        for peer in self.peers:
+            peer.close()
+
+    def start(self, peer, request, now):
+        """Queues request to a peer, connecting if needed. Returns False if
+        the peer cannot be reached."""
+        try:
+            if peer.sock is None:
+                peer.connect()
+        except (socket.error, socket.gaierror), e:
+            peer.fail(str(e), now)
+            return False
+        peer.output = request
+        peer.sent = now
+        return True
+
+    def poll(self):
+        """Sends a request to every peer and waits for replies, at most
+        timeout seconds. Returns the number of peers which replied."""
+        now = monotonic()
+        deadline = now + self.timeout
+        request = encode({"cmd": "get", "topics": self.topics})
+        poller = select.poll()
+        pending = {}
+        for peer in self.peers:
+            if peer.sock is None and now < peer.retry_at:
+                continue
+            if self.start(peer, request, now):
+                pending[peer.fileno()] = peer
+                poller.register(peer.sock, select.POLLIN | select.POLLOUT)
+        replies = 0
+        while pending:
+            timeout = deadline - monotonic()
+            if timeout <= 0:
+                break
+            try:
+                events = poller.poll(timeout * 1000)
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            now = monotonic()
+            for fd, event in events:
+                peer = pending.get(fd)
+                if peer is None:
+                    continue
+                try:
+                    reply = peer.handle(event)
+                except socket.error, e:
+                    if e.args[0] in (errno.EAGAIN, errno.EINTR):
+                        continue
+                    del pending[fd]
+                    poller.unregister(fd)
+                    if peer.reused:
+                        # the daemon was restarted since the last poll:
+                        # reconnect once
+                        peer.close()
+                        if self.start(peer, request, now):
+                            pending[peer.fileno()] = peer
+                            poller.register(peer.sock, select.POLLIN | select.POLLOUT)
+                        continue
+                    peer.fail(str(e), now)
+                    continue
+                except ValueError:
+                    del pending[fd]
+                    poller.unregister(fd)
+                    peer.fail("invalid reply", now)
+                    continue
+                if reply is not None:
+                    del pending[fd]
+                    poller.unregister(fd)
+                    peer.reply = reply
+                    peer.updated = now
+                    peer.latency = now - peer.sent
+                    peer.error = reply.get("error")
+                    peer.failures = 0
+                    peer.reused = True
+                    replies += 1
+                elif not peer.output and not peer.connecting:
+                    poller.modify(fd, select.POLLIN)
+        # a late reply would be mistaken for the next one, so slow peers are
+        # disconnected
+        for peer in pending.values():
+            peer.fail("timeout", now)
+        return replies
+
+    def view(self, groups=GROUPS):
+        """Returns a FleetView of the latest replies"""
+        return FleetView(self.peers, groups)
+
+
+class FleetView:
+    """Merged data of fleet peers: throughput per host and interface group,
+    and established connections per host. Only peers which replied to the
+    latest poll are counted; the others are listed in down."""
+
+    def __init__(self, peers, groups=GROUPS):
+        # host -> [rx, tx] bytes per second
+        self.hosts = {}
+        # host -> {group: [rx, tx]}
+        self.host_groups = {}
+        # group -> [rx, tx] over all hosts
+        self.groups = {}
+        # host -> established tcp connections
+        self.established = {}
+        # host -> error
+        self.down = {}
+        # group of each interface name, computed once
+        names = {}
+        for peer in peers:
+            if peer.sock is None or peer.reply is None or "data" not in peer.reply:
+                self.down[peer.name] = peer.error or "no reply"
+                continue
+            data = peer.reply["data"]
+            host = [0.0, 0.0]
+            host_groups = {}
+            for iface, info in (data.get("interfaces") or {}).items():
+                rates = info.get("rates")
+                if not rates:
+                    continue
+                group = names.get(iface)
+                if group is None:
+                    group = names[iface] = interface_group(iface, groups)
+                rx = rates.get("rx_bytes", 0)
+                tx = rates.get("tx_bytes", 0)
+                totals = host_groups.setdefault(group, [0.0, 0.0])
+                totals[0] += rx
+                totals[1] += tx
+                if group not in LOCAL_GROUPS:
+                    host[0] += rx
+                    host[1] += tx
+            for group, (rx, tx) in host_groups.items():
+                totals = self.groups.setdefault(group, [0.0, 0.0])
+                totals[0] += rx
+                totals[1] += tx
+            self.hosts[peer.name] = host
+            self.host_groups[peer.name] = host_groups
+            # state keys are strings in JSON
+            states = (data.get("connections") or {}).get("tcp_states") or {}
+            self.established[peer.name] = states.get(str(TCP_ESTABLISHED), 0)
+
+    def total(self):
+        """Returns [rx, tx] of the whole fleet"""
+        return [sum([host[0] for host in self.hosts.values()]),
+                sum([host[1] for host in self.hosts.values()])]
+
+    def top_throughput(self, count=10):
+        """Returns [(host, rx, tx)] of the busiest hosts"""
+        hosts = sorted(self.hosts.items(), key=lambda item: -(item[1][0] + item[1][1]))
+        return [(host, rx, tx) for host, (rx, tx) in hosts[:count]]
+
+    def top_established(self, count=10):
+        """Returns [(host, connections)] of hosts with most established
+        connections"""
+        return sorted(self.established.items(), key=lambda item: -item[1])[:count]
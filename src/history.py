@@ -0,0 +1,180 @@
+#!/usr/bin/python
+"""net_monitor: bounded rate history"""
+
+import array
+
+from net_monitor.procfs import DEV_INDEX
+
+# history counters: (name, /proc/net/dev column)
+HISTORY_COUNTERS = [(name, DEV_INDEX[name]) for name in
+        ["rx_bytes", "rx_packets", "rx_errors", "rx_drops",
+         "tx_bytes", "tx_packets", "tx_errors", "tx_drops"]]
+
+# downsampling tiers: (window length, bucket resolution), in seconds
+HISTORY_WINDOWS = [(60, 1), (300, 5), (3600, 60)]
+
+INF = float("inf")
+
+class Tier:
+    """Fixed number of buckets of a given resolution. Each bucket keeps min,
+    max, sum and number of samples in preallocated arrays, and the totals
+    of the whole window are updated as buckets are filled and evicted."""
+
+    def __init__(self, window, resolution):
+        self.window = window
+        self.resolution = resolution
+        self.size = max(int(window // resolution), 1)
+        self.min = array.array("d", [INF]) * self.size
+        self.max = array.array("d", [-INF]) * self.size
+        self.sum = array.array("d", [0.0]) * self.size
+        self.count = array.array("L", [0]) * self.size
+        # current bucket: position in arrays and its time index
+        self.pos = 0
+        self.bucket = None
+        # window totals
+        self.total = 0.0
+        self.samples = 0
+        self.window_min = INF
+        self.window_max = -INF
+
+    def advance(self, bucket):
+        """Moves to bucket, evicting the buckets falling out of the window"""
+        if self.bucket is None:
+            self.bucket = bucket
+            return
+        steps = min(bucket - self.bucket, self.size)
+        recompute = False
+        for i in range(steps):
+            self.pos = (self.pos + 1) % self.size
+            pos = self.pos
+            if self.count[pos]:
+                self.total -= self.sum[pos]
+                self.samples -= self.count[pos]
+                if self.min[pos] <= self.window_min or self.max[pos] >= self.window_max:
+                    recompute = True
+            self.min[pos] = INF
+            self.max[pos] = -INF
+            self.sum[pos] = 0.0
+            self.count[pos] = 0
+        self.bucket = bucket
+        if recompute:
+            # evicted bucket held an extreme value
+            self.window_min = min(self.min)
+            self.window_max = max(self.max)
+
+    def append(self, timestamp, value):
+        """Adds a sample"""
+        bucket = int(timestamp // self.resolution)
+        if bucket != self.bucket:
+            if self.bucket is not None and bucket < self.bucket:
+                # clock went backwards: samples older than current bucket
+                # are accounted into it
+                bucket = self.bucket
+            self.advance(bucket)
+        pos = self.pos
+        if value < self.min[pos]:
+            self.min[pos] = value
+        if value > self.max[pos]:
+            self.max[pos] = value
+        self.sum[pos] += value
+        self.count[pos] += 1
+        self.total += value
+        self.samples += 1
+        if value < self.window_min:
+            self.window_min = value
+        if value > self.window_max:
+            self.window_max = value
+
+    def stats(self):
+        """Returns (min, max, avg) of the window, or None without samples"""
+        if not self.samples:
+            return None
+        return self.window_min, self.window_max, self.total / self.samples
+
+    def values(self):
+        """Returns per-bucket averages, oldest first (None for empty buckets)"""
+        values = []
+        for i in range(1, self.size + 1):
+            pos = (self.pos + i) % self.size
+            if self.count[pos]:
+                values.append(self.sum[pos] / self.count[pos])
+            else:
+                values.append(None)
+        return values
+
+
+class Series:
+    """History of a single value, kept in several downsampling tiers"""
+
+    def __init__(self, windows=HISTORY_WINDOWS):
+        self.tiers = [Tier(window, resolution) for window, resolution in windows]
+        self.last = None
+
+    def append(self, timestamp, value):
+        self.last = value
+        for tier in self.tiers:
+            tier.append(timestamp, value)
+
+    def tier(self, window):
+        """Returns the tier covering window seconds"""
+        for tier in self.tiers:
+            if tier.window >= window:
+                return tier
+        return self.tiers[-1]
+
+    def stats(self, window=60):
+        """Returns (min, max, avg) over window seconds"""
+        return self.tier(window).stats()
+
+    def values(self, window=60):
+        """Returns downsampled values over window seconds"""
+        return self.tier(window).values()
+
+
+class InterfaceHistory:
+    """Rates history of an interface's counters"""
+
+    def __init__(self, windows=HISTORY_WINDOWS):
+        self.series = {}
+        for name, column in HISTORY_COUNTERS:
+            self.series[name] = Series(windows)
+
+    def update(self, clock, rates):
+        """Adds rates from a CounterRates"""
+        for name, column in HISTORY_COUNTERS:
+            self.series[name].append(clock, rates.rates[column])
+
+
+class History:
+    """Rates history of all interfaces"""
+
+    def __init__(self, windows=HISTORY_WINDOWS):
+        self.windows = windows
+        self.ifaces = {}
+
+    def update(self, clock, engine):
+        """Adds current rates of a RateEngine, computed at clock"""
+        for iface, rates in engine.ifaces.items():
+            if not rates.valid or rates.clock != clock:
+                # no new rate for this interface
+                continue
+            if iface not in self.ifaces:
+                self.ifaces[iface] = InterfaceHistory(self.windows)
+            self.ifaces[iface].update(clock, rates)
+
+    def remove(self, iface):
+        """Forgets history of a removed interface"""
+        self.ifaces.pop(iface, None)
+
+    def get(self, iface, counter="rx_bytes"):
+        """Returns Series for an interface counter, or None"""
+        if iface not in self.ifaces:
+            return None
+        return self.ifaces[iface].series.get(counter)
+
+    def stats(self, iface, counter="rx_bytes", window=60):
+        """Returns (min, max, avg) rate of counter over window seconds"""
+        series = self.get(iface, counter)
+        if series is None:
+            return None
+        return series.stats(window)
@@ -0,0 +1,197 @@
+#!/usr/bin/python
+"""net_monitor: kernel network statistics (/proc/net/snmp, netstat,
+sockstat, neighbor tables)"""
+
+from collections import namedtuple
+
+from net_monitor.procfs import parse_table
+
+# keyed counter files: name -> (path, format)
+STATS_FILES = {"snmp": ("/proc/net/snmp", "keyed"),
+               "netstat": ("/proc/net/netstat", "keyed"),
+               "sockstat": ("/proc/net/sockstat", "sockstat"),
+               "sockstat6": ("/proc/net/sockstat6", "sockstat"),
+               "arp_cache": ("/proc/net/stat/arp_cache", "percpu"),
+               "ndisc_cache": ("/proc/net/stat/ndisc_cache", "percpu"),
+               }
+
+# ip forwarding switches
+FORWARDING_FILES = {"ipv4": "/proc/sys/net/ipv4/ip_forward",
+                    "ipv6": "/proc/sys/net/ipv6/conf/all/forwarding"}
+
+# neighbor (ARP) flags, as in include/uapi/linux/if_arp.h
+ATF_COM = 0x02
+ATF_PERM = 0x04
+
+# neighbor states, as in include/uapi/linux/neighbour.h
+NUD_STATES = [(0x01, "incomplete"), (0x02, "reachable"), (0x04, "stale"),
+              (0x08, "delay"), (0x10, "probe"), (0x20, "failed"),
+              (0x40, "noarp"), (0x80, "permanent")]
+
+Neighbor = namedtuple("Neighbor", "address mac state iface")
+
+def nud_state(state):
+    """Names a neighbor state"""
+    for flag, name in NUD_STATES:
+        if state & flag:
+            return name
+    return "none"
+
+def arp_state(flags):
+    """Names the state of a /proc/net/arp entry"""
+    if flags & ATF_PERM:
+        return "permanent"
+    if flags & ATF_COM:
+        return "reachable"
+    return "incomplete"
+
+def parse_keyed(data, names_cache):
+    """Parses /proc/net/snmp and /proc/net/netstat, made of header and value
+    line pairs ('Tcp: RtoAlgorithm ...', 'Tcp: 1 ...'), into (names,
+    values) lists. Names are 'Tcp.RtoAlgorithm'. Lists of names are cached
+    in names_cache by header, so unchanged headers return the same list."""
+    lines = data.splitlines()
+    headers = tuple(lines[0::2])
+    names = names_cache.get(headers)
+    if names is None:
+        names = []
+        for header in headers:
+            fields = header.split()
+            prefix = fields[0].rstrip(":")
+            names.extend(["%s.%s" % (prefix, name) for name in fields[1:]])
+        names_cache[headers] = names
+    values = []
+    for line in lines[1::2]:
+        values.extend(map(int, line.split()[1:]))
+    return names, values
+
+def parse_sockstat(data, names_cache):
+    """Parses /proc/net/sockstat ('TCP: inuse 4 orphan 0 ...') into (names,
+    values) lists, with names such as 'TCP.inuse'"""
+    names = []
+    values = []
+    for line in data.splitlines():
+        fields = line.split()
+        if not fields:
+            continue
+        prefix = fields[0].rstrip(":")
+        names.extend(["%s.%s" % (prefix, name) for name in fields[1::2]])
+        values.extend(map(int, fields[2::2]))
+    key = tuple(names)
+    names = names_cache.setdefault(key, names)
+    return names, values
+
+def parse_percpu(data, names_cache):
+    """Parses /proc/net/stat/* tables (a header followed by a line of hex
+    values per cpu) into (names, values) lists, summing all cpus. The first
+    column (table entries) is global, and is not summed."""
+    lines = data.splitlines()
+    names = names_cache.get(lines[0])
+    if names is None:
+        names = names_cache[lines[0]] = lines[0].split()
+    values = None
+    for line in lines[1:]:
+        row = [int(x, 16) for x in line.split()]
+        if not row:
+            continue
+        if values is None:
+            values = row
+        else:
+            values[1:] = [a + b for a, b in zip(values[1:], row[1:])]
+    return names, values or [0] * len(names)
+
+PARSERS = {"keyed": parse_keyed,
+           "sockstat": parse_sockstat,
+           "percpu": parse_percpu}
+
+def parse_arp(data):
+    """Parses /proc/net/arp into a list of Neighbors"""
+    neighbors = []
+    for fields in parse_table(data):
+        if len(fields) < 6:
+            continue
+        neighbors.append(Neighbor(fields[0], fields[3], arp_state(int(fields[2], 16)),
+            fields[5]))
+    return neighbors
+
+
+class CounterSample:
+    """Named counters of a single sample. deltas are the changes since the
+    previous sample of the same file (None for the first one), over
+    interval seconds."""
+
+    def __init__(self, names, values, deltas=None, interval=None):
+        self.names = names
+        self.values = values
+        self.deltas = deltas
+        self.interval = interval
+        self.index = None
+
+    def position(self, name):
+        if self.index is None:
+            self.index = dict([(key, i) for i, key in enumerate(self.names)])
+        return self.index.get(name)
+
+    def get(self, name, default=0):
+        """Returns value of a counter"""
+        i = self.position(name)
+        if i is None:
+            return default
+        return self.values[i]
+
+    def delta(self, name, default=0):
+        """Returns change of a counter since the previous sample"""
+        i = self.position(name)
+        if i is None or self.deltas is None:
+            return default
+        return self.deltas[i]
+
+    def rate(self, name):
+        """Returns per-second change of a counter"""
+        if not self.interval:
+            return 0.0
+        return self.delta(name) / self.interval
+
+    def items(self):
+        return zip(self.names, self.values)
+
+    def delta_items(self):
+        if self.deltas is None:
+            return []
+        return zip(self.names, self.deltas)
+
+
+class KernelStats:
+    """Samples kernel statistics files, computing deltas against the
+    previous sample of each"""
+
+    def __init__(self):
+        # name -> (clock, CounterSample)
+        self.samples = {}
+        # parsed headers, reused while files keep their layout
+        self.names_cache = {}
+
+    def update(self, name, data, clock):
+        """Parses contents of a statistics file (see STATS_FILES) sampled at
+        clock, and returns its CounterSample"""
+        path, fmt = STATS_FILES[name]
+        names, values = PARSERS[fmt](data, self.names_cache)
+        sample = CounterSample(names, values)
+        previous = self.samples.get(name)
+        if previous is not None and previous[1].names is names:
+            last_clock, last = previous
+            sample.deltas = [a - b for a, b in zip(values, last.values)]
+            sample.interval = clock - last_clock
+            # layout did not change, so counter positions are reused
+            sample.index = last.index
+        self.samples[name] = (clock, sample)
+        return sample
+
+    def get(self, name):
+        """Returns the latest CounterSample of name, or None"""
+        if name not in self.samples:
+            return None
+        return self.samples[name][1]
+
+    def remove(self, name):
+        self.samples.pop(name, None)
@@ -8,9 +8,26 @@ import struct
 import traceback
 import array
 import time
-
-# native library implements a few bits
-import _native
+import threading
+from collections import namedtuple
+
+from net_monitor.procfs import ProcReader, DevCounters, DEV_INDEX, parse_dev, parse_wireless, parse_table
+from net_monitor.history import History
+from net_monitor.cache import Cache, CACHE_TTL, file_token
+from net_monitor.uptime import UptimeLog
+from net_monitor.vnstat import VnstatReader, VNSTAT_DIR
+from net_monitor.wireless import WirelessQuery, WIRELESS_PARAMETERS
+from net_monitor.rates import RateEngine, monotonic, RX_BYTES, TX_BYTES
+from net_monitor.connections import ConnectionTable, parse_connections, CONNECTION_PROTOS
+from net_monitor.sockdiag import SockDiag, PROTOCOLS as SOCK_DIAG_PROTOCOLS
+from net_monitor.nl80211 import Nl80211Backend
+from net_monitor.kstats import KernelStats, Neighbor, STATS_FILES, FORWARDING_FILES, \
+        parse_arp, nud_state
+from net_monitor.routes import RouteTable, Route, RTN_UNICAST, packed_to_int, \
+        parse_route, parse_ipv6_route
+from net_monitor.netlink import RtnetlinkBackend, LinkWatcher, NetlinkError, \
+        proc_dev_columns, IFA_F_SECONDARY, EVENT_ADDED, EVENT_REMOVED, EVENT_UP, EVENT_DOWN, \
+        EVENT_STATE_CHANGED, EVENT_ADDRESS_ADDED, EVENT_ADDRESS_REMOVED, EVENT_ROUTE_CHANGED
 
 # localization
 import gettext
@@ -20,19 +37,65 @@ except IOError:
     _ = str
 
 
+class InterfaceSnapshot(namedtuple("InterfaceSnapshot",
+        "name exists status ip mac bytes_in bytes_out counters "
+        "wireless link max_quality essid mode bitrate ap signal noise")):
+    """Immutable state of a single interface at snapshot time"""
+    __slots__ = ()
+
+    def quality(self):
+        """Link quality in percents (None if unknown)"""
+        if not self.wireless or not isinstance(self.max_quality, int) or self.max_quality == 0:
+            return None
+        return self.link * 100.0 / self.max_quality
+
+    def counter(self, name):
+        """Returns a /proc/net/dev counter by name (see DEV_COLUMNS)"""
+        if not self.counters:
+            return 0
+        return self.counters[DEV_INDEX[name]]
+
+
+class Snapshot(namedtuple("Snapshot", "timestamp clock ifaces")):
+    """Immutable state of all interfaces, collected in a single pass.
+    timestamp is the wall clock time, clock is monotonic time used for
+    computing rates."""
+    __slots__ = ()
+
+    def get(self, iface):
+        """Returns InterfaceSnapshot for iface, or None"""
+        return self.ifaces.get(iface)
+
+    def interfaces(self):
+        """Sorted list of interfaces present in snapshot"""
+        return sorted(self.ifaces.keys())
+
+    def get_traffic(self, iface):
+        """Same as Monitor.get_traffic, but from snapshot data"""
+        if iface in self.ifaces:
+            data = self.ifaces[iface]
+            return data.exists, data.bytes_in, data.bytes_out
+        return False, 0, 0
+
+
 class Monitor:
     # based on http://svn.pardus.org.tr/pardus/tags/pardus-1.0/system/base/wireless-tools/comar/link.py
 
     # network uptime log file
     LOGFILE="/var/log/net_monitor.log"
 
-    # wireless IOCTL constants
-    SIOCGIWMODE = 0x8B07    # get operation mode
-    SIOCGIWRATE = 0x8B21    # get default bit rate
-    SIOCGIWESSID = 0x8B1B   # get essid
+    # DNS configuration
+    RESOLV_CONF = "/etc/resolv.conf"
 
-    # wireless modes
-    modes = ['Auto', 'Ad-Hoc', 'Managed', 'Master', 'Repeat', 'Second', 'Monitor']
+    # values of wireless parameters which could not be queried
+    wireless_defaults = {"max_quality": _("Unknown"),
+                         "ap": _("Unknown"),
+                         "essid": "",
+                         "mode": _("Unknown"),
+                         "bitrate": 0,
+                         "signal": None,
+                         "noise": None,
+                         }
 
     # tcp statuses
     netstats = {"tcp": [
@@ -64,92 +127,151 @@ class Monitor:
                 _("CLOSING")
                 ],
             }
+    # raw sockets use the same states as udp ones
+    netstats["raw"] = netstats["udp"]
 
     # constants
     SIZE_KB=1000
     SIZE_MB=1000**2
     SIZE_GB=1000**3
 
-    def __init__(self):
+    # supported backends
+    BACKENDS = ["proc", "netlink"]
+
+    def __init__(self, backend="proc", root="/"):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.net = {}
-        self.uptime_log = {}
+        # held by snapshot collectors, as they update rates and history
+        # (see monitor_collectors()); other shared state has its own locks
+        self.snapshot_lock = threading.RLock()
+        # filesystem root where /proc, /sys, /etc and /var are looked up,
+        # so monitoring can run on a synthetic tree
+        self.root = root
+        self.net = DevCounters()
+        # network uptime log, read incrementally
+        self.uptime_log = UptimeLog(self.path(self.LOGFILE))
+        # vnstat databases, read on demand
+        self.vnstat = VnstatReader(self.path(VNSTAT_DIR))
+        # /proc files are kept opened between polls
+        self.proc = ProcReader()
+        # rtnetlink and sock_diag backends, when selected and available
+        self.netlink = None
+        self.sockdiag = None
+        # interface index -> name, as seen by rtnetlink
+        self.link_names = {}
+        # link notifications subscriber, see watch_links()
+        self.watcher = None
+        self.link_state = {}
+        self.log_uptime = False
+        if backend == "netlink":
+            try:
+                self.netlink = RtnetlinkBackend()
+            except:
+                # no netlink support, fall back to /proc
+                traceback.print_exc()
+            try:
+                self.sockdiag = SockDiag()
+            except:
+                traceback.print_exc()
+        self.last_snapshot = None
+        # counter rates and their history, fed by snapshot()
+        self.rates = RateEngine()
+        self.history = History()
+        # wireless parameters queries
+        self.iw = WirelessQuery(self.sock)
+        # nl80211 station statistics, connected on first use (False when
+        # not available)
+        self.nl80211 = None
+        # slow-changing data: dns, routes, addresses, wireless parameters
+        self.cache = Cache()
+        # latest route table, kept while routes do not change
+        self.route_table = None
+        # previous samples of kernel statistics, for computing deltas
+        self.kstats = KernelStats()
+
+    def path(self, path):
+        """Returns location of a system file under root"""
+        if self.root == "/":
+            return path
+        return os.path.join(self.root, path.lstrip("/"))
 
     def ioctl(self, func, params):
         return fcntl.ioctl(self.sock.fileno(), func, params)
 
-    def wifi_ioctl(self, iface, func, arg=None):
-        """Prepares some variables for wifi and runs ioctl"""
-        if not arg:
-            data = (iface + '\0' * 32)[:32]
-        else:
-            data = (iface + '\0' * 16)[:16] + arg
-        try:
-            res = self.ioctl(func, data)
-            return res
-        except:
-            return None
+    def wifi_get_info(self, iface, parameters=WIRELESS_PARAMETERS):
+        """Returns {parameter: value} of wireless parameters of an interface.
+        Cached values are reused, and the expired ones are queried together."""
+        result = {}
+        missing = []
+        for name in parameters:
+            found, value = self.cache.lookup((name, iface))
+            if found:
+                result[name] = value
+            else:
+                missing.append(name)
+        if missing:
+            for name, value in self.iw.query(iface, missing).items():
+                if value is None:
+                    value = self.wireless_defaults[name]
+                self.cache.set((name, iface), value, CACHE_TTL[name])
+                result[name] = value
+        return result
 
     def wifi_get_max_quality(self, iface):
         """Gets maximum quality value"""
-        try:
-            ret = _native.wifi_get_max_quality(iface)
-            return ret
-        except:
-            # TODO: this happens when the card does not supports the settings
-            # but maybe we could log it somewhere..
-            return _("Unknown")
+        return self.wifi_get_info(iface, ["max_quality"])["max_quality"]
 
     def wifi_get_ap(self, iface):
         """Gets access point address"""
-        try:
-            ret = _native.wifi_get_ap(iface)
-            return ret
-        except:
-            # TODO: this happens when the card does not supports the settings
-            # but maybe we could log it somewhere..
-            return _("Unknown")
+        return self.wifi_get_info(iface, ["ap"])["ap"]
 
     def wifi_get_essid(self, iface):
         """Get current essid for an interface"""
-        buffer = array.array('c', '\0' * 16)
-        addr, length = buffer.buffer_info()
-        arg = struct.pack('Pi', addr, length)
-        self.wifi_ioctl(iface, self.SIOCGIWESSID, arg)
-        return buffer.tostring().strip('\0')
+        return self.wifi_get_info(iface, ["essid"])["essid"]
 
     def wifi_get_mode(self, iface):
         """Get current mode from an interface"""
-        result = self.wifi_ioctl(iface, self.SIOCGIWMODE)
-        if not result:
-            return _("Unknown")
-        mode = struct.unpack("i", result[16:20])[0]
-        return self.modes[mode]
+        return self.wifi_get_info(iface, ["mode"])["mode"]
 
     def wifi_get_bitrate(self, iface):
         """Gets current operating rate from an interface"""
-        # Note: KILO is not 2^10 in wireless tools world
-
-        result = self.wifi_ioctl(iface, self.SIOCGIWRATE)
-
-        if result:
-            size = struct.calcsize('ihbb')
-            m, e, i, pad = struct.unpack('ihbb', result[16:16+size])
-            if e == 0:
-                bitrate =  m
-            else:
-                bitrate = float(m) * 10**e
-            return bitrate
-        else:
-            return 0
+        return self.wifi_get_info(iface, ["bitrate"])["bitrate"]
+
+    def get_stations(self):
+        """Returns {iface: [stations]} of wireless interfaces, with signal,
+        bitrates, MCS index, retries and failures of each station (for a
+        client, its access point). nl80211 is queried once per snapshot."""
+        token = None
+        if self.last_snapshot is not None:
+            token = self.last_snapshot.clock
+        return self.cache.get(("stations", None), self.query_stations, token=token)
+
+    def query_stations(self):
+        """Queries stations of all wireless interfaces"""
+        if self.nl80211 is None:
+            try:
+                self.nl80211 = Nl80211Backend()
+            except (socket.error, NetlinkError):
+                # no nl80211 support (or no wireless drivers loaded)
+                self.nl80211 = False
+        if not self.nl80211:
+            return {}
+        try:
+            return self.nl80211.all_stations()
+        except:
+            traceback.print_exc()
+            return {}
 
     def get_status(self, ifname):
         """Determines interface status"""
-        try:
-            with open("/sys/class/net/%s/operstate" % ifname) as fd:
-                status = fd.readline().strip()
-        except:
-            status="unknown"
+        if self.watcher and ifname in self.link_state:
+            # kept up to date by link notifications
+            status = self.link_state[ifname]
+        else:
+            try:
+                with open(self.path("/sys/class/net/%s/operstate" % ifname)) as fd:
+                    status = fd.readline().strip()
+            except:
+                status="unknown"
         if status == "unknown":
             # pretty-format interface status
             status = _("Unknown")
@@ -158,19 +280,7 @@ class Monitor:
     def wireless_stats(self):
         """Check if device is wireless and get its details if necessary"""
         try:
-            stats = {}
-            with open("/proc/net/wireless") as fd:
-                ifaces = fd.readlines()[2:]
-            for line in ifaces:
-                line = line.strip()
-                if not line:
-                    continue
-                iface, params = line.split(":", 1)
-                iface = iface.strip()
-                params = params.replace(".", "").split()
-                link = int(params[1])
-                stats[iface] = link
-            return stats
+            return parse_wireless(self.proc.read(self.path("/proc/net/wireless")))
         except:
             # something bad happened
             traceback.print_exc()
@@ -178,10 +288,14 @@ class Monitor:
 
     def has_wireless(self, iface):
         """Checks if device has wireless capabilities"""
-        return os.access("/sys/class/net/%s/wireless" % iface, os.R_OK)
+        return os.access(self.path("/sys/class/net/%s/wireless" % iface), os.R_OK)
 
     def get_address(self, ifname):
         """Get MAC address of a card"""
+        return self.get_addresses([ifname])[ifname]
+
+    def query_address(self, ifname):
+        """Queries (ip address, MAC address) of a card"""
         mac=_("No physical address")
         # ip address
         try:
@@ -198,45 +312,193 @@ class Monitor:
         # addr, mac
         return addr, mac
 
+    def get_addresses(self, ifaces):
+        """Get (ip address, MAC address) of several cards at once"""
+        ttl, token = self.cache_validity("address", "addresses")
+        addresses = {}
+        missing = []
+        for iface in ifaces:
+            found, value = self.cache.lookup(("address", iface), token)
+            if found:
+                addresses[iface] = value
+            else:
+                missing.append(iface)
+        if missing:
+            for iface, value in self.query_addresses(missing).items():
+                self.cache.set(("address", iface), value, ttl, token)
+                addresses[iface] = value
+        return addresses
+
+    def query_addresses(self, ifaces):
+        """Queries addresses of several cards"""
+        if self.netlink:
+            try:
+                return self.netlink_addresses(ifaces)
+            except:
+                traceback.print_exc()
+        addresses = {}
+        for iface in ifaces:
+            addresses[iface] = self.query_address(iface)
+        return addresses
+
+    def cache_validity(self, item, generation):
+        """Returns (ttl, token) for caching item: with link notifications,
+        it is valid until the generation counter changes, otherwise for
+        its TTL"""
+        if self.watcher:
+            return None, self.cache.generation(generation)
+        return CACHE_TTL[item], None
+
+    def netlink_addresses(self, ifaces):
+        """Reads addresses with rtnetlink"""
+        links = self.netlink.links()
+        ips = {}
+        for addr in self.netlink.addresses(socket.AF_INET):
+            if addr["flags"] & IFA_F_SECONDARY or addr["index"] in ips:
+                continue
+            ips[addr["index"]] = addr["address"]
+        addresses = {}
+        for index, link in links.items():
+            if link["name"] not in ifaces:
+                continue
+            addresses[link["name"]] = (ips.get(index, _("No address assigned")),
+                    link["mac"] or _("No physical address"))
+        for iface in ifaces:
+            if iface not in addresses:
+                addresses[iface] = (_("No address assigned"), _("No physical address"))
+        return addresses
+
     def readnet(self):
-        """Reads values from /proc/net/dev"""
-        net = {}
+        """Reads values from /proc/net/dev, as DevCounters"""
+        net = DevCounters()
+        if self.netlink:
+            try:
+                return self.netlink_readnet()
+            except:
+                traceback.print_exc()
         try:
-            with open("/proc/net/dev") as fd:
-                data = fd.readlines()[2:]
-            for l in data:
-                dev, vals = l.split(":")
-                dev = dev.strip()
-                vals = vals.split()
-                net[dev] = vals
+            net = parse_dev(self.proc.read(self.path("/proc/net/dev")))
         except:
             traceback.print_exc()
         return net
 
+    def netlink_readnet(self):
+        """Reads interface counters with rtnetlink, in /proc/net/dev format"""
+        net = DevCounters()
+        links = self.netlink.links()
+        link_names = {}
+        for index, link in links.items():
+            link_names[index] = link["name"]
+            if link["stats"] is None:
+                continue
+            net.append(link["name"], proc_dev_columns(link["stats"]))
+        # replaced at once, as other collectors look names up
+        self.link_names = link_names
+        return net
+
     def has_network_accounting(self, iface):
         """Checks if network accounting was enabled on interface"""
-        try:
-            os.stat("/var/lib/vnstat/%s" % iface)
-            return True
-        except:
-            return False
+        return self.vnstat.has(iface)
+
+    def get_accounting(self, iface):
+        """Returns vnstat totals of interface, with hourly, daily and monthly
+        traffic (see vnstat.Accounting), or None"""
+        return self.vnstat.get(iface)
 
     def get_traffic(self, iface, net=None):
         """Get traffic information"""
         device_exists=False
         if not net:
             if not self.net:
-                self.readnet()
+                self.net = self.readnet()
             net = self.net
         if iface in net:
             device_exists=True
-            bytes_in = int(net[iface][0])
-            bytes_out = int(net[iface][8])
+            bytes_in = net.get(iface, "rx_bytes")
+            bytes_out = net.get(iface, "tx_bytes")
         else:
             bytes_in = 0
             bytes_out = 0
         return device_exists, bytes_in, bytes_out
 
+    def get_counters(self, iface, net=None):
+        """Returns {counter: value} with all /proc/net/dev counters of iface"""
+        if not net:
+            if not self.net:
+                self.net = self.readnet()
+            net = self.net
+        return net.counters_dict(iface)
+
+    def get_errors(self, iface, net=None):
+        """Returns (rx errors, rx drops, tx errors, tx drops) of iface"""
+        counters = self.get_counters(iface, net)
+        return tuple([counters.get(name, 0) for name in
+                ["rx_errors", "rx_drops", "tx_errors", "tx_drops"]])
+
+    def snapshot(self, ifaces=None, details=True):
+        """Collects data for all interfaces (or only for ifaces) in a single
+        pass: /proc/net/dev and /proc/net/wireless are read once per call.
+        Without details, only counters are read, and status, addresses and
+        wireless parameters are reused from the previous snapshot, as are
+        the records of interfaces whose counters did not change."""
+        timestamp = time.time()
+        clock = monotonic()
+        net = self.readnet()
+        self.net = net
+        if ifaces is None:
+            ifaces = net.keys()
+        previous = {}
+        if not details and self.last_snapshot is not None:
+            previous = self.last_snapshot.ifaces
+        # interfaces which need a full update
+        detailed = [iface for iface in ifaces if iface not in previous]
+        wifi_stats = {}
+        addresses = {}
+        if detailed:
+            wifi_stats = self.wireless_stats()
+            addresses = self.get_addresses(detailed)
+        data = {}
+        for iface in ifaces:
+            counters = tuple([int(x) for x in net.get(iface) or ()])
+            if iface in previous:
+                record = previous[iface]
+                if record.counters != counters:
+                    record = record._replace(exists=bool(counters),
+                            bytes_in=counters and counters[RX_BYTES] or 0,
+                            bytes_out=counters and counters[TX_BYTES] or 0,
+                            counters=counters)
+                data[iface] = record
+                continue
+            device_exists, bytes_in, bytes_out = self.get_traffic(iface, net)
+            status = self.get_status(iface)
+            ip, mac = addresses[iface]
+            if self.has_wireless(iface):
+                info = self.wifi_get_info(iface)
+                data[iface] = InterfaceSnapshot(iface, device_exists, status, ip, mac,
+                        bytes_in, bytes_out, counters,
+                        True, wifi_stats.get(iface, 0), info["max_quality"],
+                        info["essid"], info["mode"], info["bitrate"], info["ap"],
+                        info["signal"], info["noise"])
+            else:
+                data[iface] = InterfaceSnapshot(iface, device_exists, status, ip, mac,
+                        bytes_in, bytes_out, counters,
+                        False, 0, 0, None, None, None, None, None, None)
+        snapshot = Snapshot(timestamp, clock, data)
+        self.last_snapshot = snapshot
+        self.rates.update(snapshot)
+        self.history.update(clock, self.rates)
+        return snapshot
+
+    def get_rate(self, iface, column=0, smoothed=False):
+        """Returns per-second rate of a /proc/net/dev column (received bytes
+        by default), optionally EWMA-smoothed"""
+        return self.rates.rate(iface, column, smoothed)
+
+    def get_history(self, iface, counter="rx_bytes", window=60):
+        """Returns (min, max, avg) rate of an interface counter over the last
+        window seconds, or None if there is no history yet"""
+        return self.history.stats(iface, counter, window)
+
     def format_size(self, size, opt=""):
         """Pretty-Formats size"""
         # convert to float
@@ -255,9 +517,14 @@ class Monitor:
 
     def get_dns(self):
         """Returns list of DNS servers"""
+        return self.cache.get(("dns", None), self.read_dns,
+                token=file_token(self.path(self.RESOLV_CONF)))
+
+    def read_dns(self):
+        """Reads DNS servers from RESOLV_CONF"""
         servers = []
         try:
-            with open("/etc/resolv.conf") as fd:
+            with open(self.path(self.RESOLV_CONF)) as fd:
                 data = fd.readlines()
             for l in data:
                 l = l.strip()
@@ -272,16 +539,20 @@ class Monitor:
 
     def get_routes(self):
         """Read network routes"""
+        ttl, token = self.cache_validity("routes", "routes")
+        return self.cache.get(("routes", None), self.read_routes, ttl, token)
+
+    def read_routes(self):
+        """Reads network routes, with rtnetlink or from /proc/net/route"""
+        if self.netlink:
+            try:
+                return self.netlink_routes()
+            except:
+                traceback.print_exc()
         routes = []
         default_routes = []
         try:
-            with open("/proc/net/route") as fd:
-                data = fd.readlines()[1:]
-            for l in data:
-                l = l.strip()
-                if not l:
-                    continue
-                params = l.split()
+            for params in parse_table(self.proc.read(self.path("/proc/net/route"))):
                 iface = params[0]
                 dst = int(params[1], 16)
                 gw = int(params[2], 16)
@@ -296,95 +567,266 @@ class Monitor:
             pass
         return routes, default_routes
 
-    def get_connections(self, proto="tcp"):
-        """Reads active connections"""
-        connections=[]
+    def netlink_routes(self):
+        """Reads IPv4 routes with rtnetlink, in /proc/net/route format"""
+        routes = []
+        default_routes = []
+        for route in self.netlink.routes(socket.AF_INET):
+            if route["oif"] not in self.link_names:
+                self.netlink_readnet()
+            iface = self.link_names.get(route["oif"], "*")
+            # /proc/net/route prints addresses as native integers
+            dst = 0
+            if route["dst"]:
+                dst = struct.unpack("=I", route["dst"])[0]
+            gw = 0
+            if route["gateway"]:
+                gw = struct.unpack("=I", route["gateway"])[0]
+            mask = struct.unpack("=I", struct.pack(">I",
+                    (0xffffffff << (32 - route["dst_len"])) & 0xffffffff))[0]
+            metric = route["priority"]
+            routes.append((iface, dst, mask, gw, metric))
+            if dst == 0 and mask == 0:
+                default_routes.append((socket.inet_ntoa(struct.pack("I", gw)), iface))
+        return routes, default_routes
+
+    def get_route_table(self):
+        """Returns a RouteTable with IPv4 and IPv6 routes"""
+        ttl, token = self.cache_validity("routes", "routes")
+        return self.cache.get(("route_table", None), self.read_route_table, ttl, token)
+
+    def read_route_table(self):
+        """Reads routes, building a new RouteTable only if they changed"""
+        routes = self.read_route_list()
+        if self.route_table is None or routes != self.route_table.routes:
+            self.route_table = RouteTable(routes)
+        return self.route_table
+
+    def read_route_list(self):
+        """Reads IPv4 and IPv6 routes, with rtnetlink or from /proc/net/route
+        and /proc/net/ipv6_route, into a list of Routes"""
+        if self.netlink:
+            try:
+                return self.netlink_route_list()
+            except:
+                traceback.print_exc()
+        routes = []
+        try:
+            routes.extend(parse_route(self.proc.read(self.path("/proc/net/route"))))
+        except:
+            traceback.print_exc()
         try:
-            with open("/proc/net/%s" % proto) as fd:
-                data = fd.readlines()[1:]
+            routes.extend(parse_ipv6_route(self.proc.read(self.path("/proc/net/ipv6_route"))))
+        except IOError:
+            # no IPv6 support
+            pass
+        return routes
+
+    def netlink_route_list(self):
+        """Reads main table routes with rtnetlink into a list of Routes"""
+        routes = []
+        for family in (socket.AF_INET, socket.AF_INET6):
+            for route in self.netlink.routes(family):
+                if route["type"] != RTN_UNICAST:
+                    continue
+                if route["oif"] not in self.link_names:
+                    self.netlink_readnet()
+                network = gateway = 0
+                if route["dst"]:
+                    network = packed_to_int(family, route["dst"])
+                if route["gateway"]:
+                    gateway = packed_to_int(family, route["gateway"])
+                routes.append(Route(family, network, route["dst_len"], gateway,
+                    route["priority"], self.link_names.get(route["oif"], "*")))
+        return routes
+
+    def get_interface_routes(self, iface):
+        """Returns routes through an interface"""
+        return self.get_route_table().interface_routes(iface)
+
+    def get_egress(self, table):
+        """Returns egress interfaces of connections in a ConnectionTable, as
+        a list parallel to its rows"""
+        return self.get_route_table().egress(table)
+
+    def get_kernel_stats(self, names=None):
+        """Samples kernel statistics files (see kstats.STATS_FILES, all by
+        default). Returns {name: CounterSample}, with deltas against the
+        previous call; files missing on this system are skipped."""
+        if names is None:
+            names = STATS_FILES.keys()
+        clock = monotonic()
+        samples = {}
+        for name in names:
+            try:
+                data = self.proc.read(self.path(STATS_FILES[name][0]))
+            except IOError:
+                continue
+            try:
+                samples[name] = self.kstats.update(name, data, clock)
+            except:
+                traceback.print_exc()
+        return samples
+
+    def get_neighbors(self):
+        """Returns list of neighbor (ARP and, with rtnetlink, NDP) table
+        entries"""
+        if self.netlink:
+            try:
+                return self.netlink_neighbors()
+            except:
+                traceback.print_exc()
+        try:
+            return parse_arp(self.proc.read(self.path("/proc/net/arp")))
+        except:
+            traceback.print_exc()
+            return []
+
+    def netlink_neighbors(self):
+        """Reads neighbor tables with rtnetlink"""
+        neighbors = []
+        for entry in self.netlink.neighbors():
+            if entry["address"] is None:
+                continue
+            if entry["index"] not in self.link_names:
+                self.netlink_readnet()
+            neighbors.append(Neighbor(entry["address"], entry["mac"] or "00:00:00:00:00:00",
+                nud_state(entry["state"]), self.link_names.get(entry["index"], "*")))
+        return neighbors
+
+    def get_interface_neighbors(self, iface):
+        """Returns neighbors known on an interface"""
+        return [neighbor for neighbor in self.get_neighbors() if neighbor.iface == iface]
+
+    def get_forwarding(self):
+        """Returns {"ipv4": bool, "ipv6": bool}, telling if ip forwarding
+        is enabled (None when unknown)"""
+        result = {}
+        for family, path in FORWARDING_FILES.items():
+            try:
+                with open(self.path(path)) as fd:
+                    result[family] = fd.read().strip() != "0"
+            except IOError:
+                result[family] = None
+        return result
+
+    def get_connection_table(self, proto="tcp", states=None, ports=None):
+        """Reads active connections into a ConnectionTable. When states (list
+        of tcp states) or ports (local or remote) are given, only matching
+        connections are returned; with the netlink backend the filtering
+        is done by kernel."""
+        # IPv6 tables share states with IPv4 ones
+        netstats = self.netstats.get(proto.rstrip("6"))
+        if self.sockdiag and proto in SOCK_DIAG_PROTOCOLS:
+            try:
+                return self.sockdiag.connections(proto, states, ports or (),
+                        ports or (), state_names=netstats)
+            except:
+                traceback.print_exc()
+        try:
+            data = self.proc.read(self.path("/proc/net/%s" % proto))
         except:
             # unable to read connections
             traceback.print_exc()
-            return connections
+            return ConnectionTable(proto)
+        table = parse_connections(data, proto, netstats)
+        if states is None and ports is None:
+            return table
+        return table.subset([i for i in range(len(table))
+                if (states is None or table.state[i] in states)
+                and (ports is None or table.local_port[i] in ports
+                    or table.remote_port[i] in ports)])
 
-        if proto in self.netstats:
-            netstats = self.netstats[proto]
-        else:
-            netstats = None
-        # parse connections
-        for l in data:
-            fields = l.strip().split()
-            loc=fields[1]
-            rem=fields[2]
-            status=fields[3]
-            loc_a,loc_p = loc.split(":")
-            rem_a,rem_p = rem.split(":")
-            loc_addr = socket.inet_ntoa(struct.pack('I', int(loc_a, 16)))
-            loc_port = (int(loc_p, 16))
-            rem_addr = socket.inet_ntoa(struct.pack('I', int(rem_a, 16)))
-            rem_port = (int(rem_p, 16))
-            # parse status
-            status = int(status, 16)
-            status_s = _("Unknown")
-            if netstats:
-                if status < len(netstats):
-                    status_s = netstats[status]
-            connections.append((loc_addr, loc_port, rem_addr, rem_port, status_s))
-        return connections
+    def get_connections(self, proto="tcp"):
+        """Reads active connections"""
+        return list(self.get_connection_table(proto))
+
+    def iter_connections(self, protos=CONNECTION_PROTOS):
+        """Iterates over connections of all protocols and address families"""
+        for proto in protos:
+            for connection in self.get_connection_table(proto):
+                yield connection
+
+    def watch_links(self, log_uptime=False):
+        """Subscribes to rtnetlink notifications about links and addresses.
+        When log_uptime is set, link state changes are appended to LOGFILE,
+        replacing the ifup.d/ifdown.d scripts."""
+        try:
+            self.watcher = LinkWatcher()
+        except:
+            traceback.print_exc()
+            self.watcher = None
+            return False
+        self.log_uptime = log_uptime
+        self.link_state = {}
+        for link in self.watcher.links.values():
+            self.link_state[link["name"]] = link["operstate"]
+        return True
+
+    def process_events(self):
+        """Processes pending link notifications, returns list of
+        (event, iface, data) tuples"""
+        if not self.watcher:
+            return []
+        try:
+            events = self.watcher.events()
+        except:
+            traceback.print_exc()
+            return []
+        for event, iface, data in events:
+            if event in (EVENT_ADDED, EVENT_REMOVED, EVENT_UP, EVENT_DOWN,
+                    EVENT_STATE_CHANGED):
+                # wireless parameters and addresses of iface may change
+                self.cache.invalidate(arg=iface)
+                self.cache.bump("addresses")
+                self.cache.bump("routes")
+            elif event in (EVENT_ADDRESS_ADDED, EVENT_ADDRESS_REMOVED):
+                self.cache.bump("addresses")
+                self.cache.bump("routes")
+            elif event == EVENT_ROUTE_CHANGED:
+                self.cache.bump("routes")
+            if event == EVENT_REMOVED:
+                self.link_state.pop(iface, None)
+                with self.snapshot_lock:
+                    self.rates.remove(iface)
+                    self.history.remove(iface)
+            elif event in (EVENT_ADDED, EVENT_UP, EVENT_DOWN, EVENT_STATE_CHANGED):
+                self.link_state[iface] = data["operstate"]
+            if event == EVENT_UP:
+                self.log_uptime_event(iface, "UP")
+            elif event == EVENT_DOWN:
+                self.log_uptime_event(iface, "DOWN")
+        return events
+
+    def log_uptime_event(self, iface, status):
+        """Records interface going UP or DOWN"""
+        secs = int(time.time())
+        if self.log_uptime:
+            try:
+                with open(self.path(self.LOGFILE), "a") as fd:
+                    fd.write("%s:%s:%d\n" % (iface, status, secs))
+                # the event is read back with the log
+                self.uptime_log.update()
+                return
+            except:
+                traceback.print_exc()
+        self.uptime_log.add(iface, status, secs)
 
     def load_uptime_log(self):
-        """Loads network uptime log, handled by /etc/sysconfig/network-scripts/if{up,down}.d/netprofile*"""
-        self.uptime_log = {}
-        if not os.access(self.LOGFILE, os.R_OK):
-            # no log file
-            return
-        with open(self.LOGFILE) as fd:
-            data = fd.readlines()
-
-        for l in data:
-            dev, status, secs = l.strip().split(":")
-            secs = int(secs)
-            if dev not in self.uptime_log:
-                self.uptime_log[dev] = {"uptime": None, "log": []}
-            self.uptime_log[dev]["log"].append((secs, status))
-
-        # now reload the last uptime data
-        for i in self.uptime_log:
-            self.calc_uptime(i)
-
-    def calc_uptime(self, iface):
-        """Calculates uptime data for an interface"""
-        if iface not in self.uptime_log:
-            self.uptime_log[iface]["uptime"] = -1
-            return
-        # ok, interface is there, calculate last uptime status
-        last_up=0
-        last_down=0
-        for s, status in self.uptime_log[iface]["log"]:
-            if status == "UP":
-                last_up = s
-            elif status == "DOWN":
-                last_down = s
-
-        # now get the uptime
-        # is the device up and running?
-        if not last_up:
-            self.uptime_log[iface]["uptime"] = -1
-            return
-
-        # was the interface disconnected?
-        if last_down > last_up:
-            self.uptime_log[iface]["uptime"] = 0
-            return
-
-        # ok, we are up and running, lets get the uptime
-        self.uptime_log[iface]["uptime"] = last_up
+        """Loads network uptime log, handled by /etc/sysconfig/network-scripts/if{up,down}.d/netprofile*.
+        Only lines appended since the previous call are read."""
+        self.uptime_log.update()
+
+    def get_availability(self, iface, window=3600):
+        """Returns link flaps and downtime of an interface over the last
+        window seconds (see UptimeLog.availability)"""
+        self.uptime_log.update(force=False)
+        return self.uptime_log.availability(iface, window)
 
     def get_uptime(self, iface):
         """Determines interface uptime"""
-        if iface not in self.uptime_log:
-            return _("Unknown")
-        uptime = self.uptime_log[iface]["uptime"]
+        self.uptime_log.update(force=False)
+        uptime = self.uptime_log.uptime(iface)
         if uptime < 0:
             return _("Unknown")
         elif uptime == 0:
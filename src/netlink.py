@@ -0,0 +1,448 @@
+#!/usr/bin/python
+"""net_monitor: rtnetlink backend"""
+
+import os
+import errno
+import socket
+import struct
+import threading
+
+# netlink protocols
+NETLINK_ROUTE = 0
+
+# message types
+NLMSG_NOOP = 1
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+RTM_NEWROUTE = 24
+RTM_DELROUTE = 25
+RTM_GETROUTE = 26
+RTM_NEWNEIGH = 28
+RTM_GETNEIGH = 30
+
+# message flags
+NLM_F_REQUEST = 0x01
+NLM_F_MULTI = 0x02
+NLM_F_DUMP = 0x300
+
+# multicast groups
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+RTMGRP_IPV6_IFADDR = 0x100
+RTMGRP_IPV6_ROUTE = 0x400
+
+# link flags
+IFF_UP = 0x1
+IFF_RUNNING = 0x40
+
+# link attributes
+IFLA_ADDRESS = 1
+IFLA_IFNAME = 3
+IFLA_MTU = 4
+IFLA_OPERSTATE = 16
+IFLA_STATS64 = 23
+
+# address attributes
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_LABEL = 3
+IFA_F_SECONDARY = 0x01
+
+# route attributes
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_PRIORITY = 6
+RTA_TABLE = 15
+RT_TABLE_MAIN = 254
+
+# neighbor attributes
+NDA_DST = 1
+NDA_LLADDR = 2
+
+# operational states, as in /sys/class/net/*/operstate
+operstates = ["unknown", "notpresent", "down", "lowerlayerdown",
+              "testing", "dormant", "up"]
+
+# message structures
+nlmsghdr = struct.Struct("=LHHLL")
+rtattr = struct.Struct("=HH")
+ifinfomsg = struct.Struct("=BxHiII")
+ifaddrmsg = struct.Struct("=BBBBi")
+rtmsg = struct.Struct("=BBBBBBBBI")
+ndmsg = struct.Struct("=BxxxiHBB")
+
+# struct rtnl_link_stats64: only the fields present since 2.6.35 are used
+STATS64_FIELDS = ["rx_packets", "tx_packets", "rx_bytes", "tx_bytes",
+        "rx_errors", "tx_errors", "rx_dropped", "tx_dropped",
+        "multicast", "collisions",
+        "rx_length_errors", "rx_over_errors", "rx_crc_errors",
+        "rx_frame_errors", "rx_fifo_errors", "rx_missed_errors",
+        "tx_aborted_errors", "tx_carrier_errors", "tx_fifo_errors",
+        "tx_heartbeat_errors", "tx_window_errors",
+        "rx_compressed", "tx_compressed"]
+link_stats64 = struct.Struct("=%dQ" % len(STATS64_FIELDS))
+
+# link events
+EVENT_ADDED = "added"
+EVENT_REMOVED = "removed"
+EVENT_UP = "up"
+EVENT_DOWN = "down"
+# operstate changed, the link staying up or down (e.g. down to dormant)
+EVENT_STATE_CHANGED = "state_changed"
+EVENT_ADDRESS_ADDED = "address_added"
+EVENT_ADDRESS_REMOVED = "address_removed"
+EVENT_ROUTE_CHANGED = "route_changed"
+
+class NetlinkError(Exception):
+    """Error returned by kernel in a netlink message"""
+    def __init__(self, code):
+        Exception.__init__(self, code, os.strerror(code))
+        self.errno = code
+
+def align(length):
+    """Aligns length to 4 bytes, as NLMSG_ALIGN and RTA_ALIGN do"""
+    return (length + 3) & ~3
+
+def parse_messages(data):
+    """Splits a netlink buffer into (type, flags, seq, payload) tuples"""
+    pos = 0
+    end = len(data)
+    while pos + nlmsghdr.size <= end:
+        length, msg_type, flags, seq, pid = nlmsghdr.unpack_from(data, pos)
+        if length < nlmsghdr.size or pos + length > end:
+            # malformed or truncated message
+            break
+        payload = data[pos + nlmsghdr.size:pos + length]
+        if msg_type == NLMSG_ERROR:
+            code = -struct.unpack_from("=i", payload)[0]
+            if code:
+                raise NetlinkError(code)
+        yield msg_type, flags, seq, payload
+        pos += align(length)
+
+def parse_attrs(data, pos):
+    """Parses route attributes starting at pos into {type: value}"""
+    attrs = {}
+    end = len(data)
+    while pos + rtattr.size <= end:
+        length, attr_type = rtattr.unpack_from(data, pos)
+        if length < rtattr.size:
+            break
+        # strip NLA_F_NESTED and NLA_F_NET_BYTEORDER flags
+        attrs[attr_type & 0x3fff] = data[pos + rtattr.size:pos + length]
+        pos += align(length)
+    return attrs
+
+def format_mac(value):
+    """Formats hardware address"""
+    return ":".join(["%02x" % c for c in bytearray(value)])
+
+def format_address(family, value):
+    """Formats IPv4 or IPv6 address"""
+    if family == socket.AF_INET:
+        return socket.inet_ntoa(value)
+    return socket.inet_ntop(family, value)
+
+def cstring(value):
+    """Strips trailing zeros from netlink strings"""
+    return value.split("\0", 1)[0]
+
+def parse_link(payload):
+    """Parses RTM_NEWLINK message payload into a dict"""
+    family, dev_type, index, flags, change = ifinfomsg.unpack_from(payload)
+    attrs = parse_attrs(payload, ifinfomsg.size)
+    link = {"index": index,
+            "flags": flags,
+            "name": cstring(attrs.get(IFLA_IFNAME, "")),
+            "mac": None,
+            "mtu": 0,
+            "operstate": "unknown",
+            "stats": None,
+            }
+    if IFLA_ADDRESS in attrs:
+        link["mac"] = format_mac(attrs[IFLA_ADDRESS])
+    if IFLA_MTU in attrs:
+        link["mtu"] = struct.unpack("=I", attrs[IFLA_MTU])[0]
+    if IFLA_OPERSTATE in attrs:
+        state = bytearray(attrs[IFLA_OPERSTATE])[0]
+        if state < len(operstates):
+            link["operstate"] = operstates[state]
+    if IFLA_STATS64 in attrs and len(attrs[IFLA_STATS64]) >= link_stats64.size:
+        link["stats"] = link_stats64.unpack_from(attrs[IFLA_STATS64])
+    return link
+
+def parse_addr(payload):
+    """Parses RTM_NEWADDR message payload into a dict"""
+    family, prefixlen, flags, scope, index = ifaddrmsg.unpack_from(payload)
+    attrs = parse_attrs(payload, ifaddrmsg.size)
+    # for point-to-point links IFA_ADDRESS is the peer address
+    value = attrs.get(IFA_LOCAL, attrs.get(IFA_ADDRESS))
+    return {"index": index,
+            "family": family,
+            "prefixlen": prefixlen,
+            "flags": flags,
+            "scope": scope,
+            "address": value and format_address(family, value),
+            "label": cstring(attrs.get(IFA_LABEL, "")),
+            }
+
+def parse_route(payload):
+    """Parses RTM_NEWROUTE message payload into a dict"""
+    (family, dst_len, src_len, tos, table, protocol, scope, rtm_type,
+            flags) = rtmsg.unpack_from(payload)
+    attrs = parse_attrs(payload, rtmsg.size)
+    if RTA_TABLE in attrs:
+        table = struct.unpack("=I", attrs[RTA_TABLE])[0]
+    route = {"family": family,
+             "dst_len": dst_len,
+             "table": table,
+             "type": rtm_type,
+             "dst": attrs.get(RTA_DST),
+             "gateway": attrs.get(RTA_GATEWAY),
+             "oif": 0,
+             "priority": 0,
+             }
+    if RTA_OIF in attrs:
+        route["oif"] = struct.unpack("=i", attrs[RTA_OIF])[0]
+    if RTA_PRIORITY in attrs:
+        route["priority"] = struct.unpack("=I", attrs[RTA_PRIORITY])[0]
+    return route
+
+def parse_neigh(payload):
+    """Parses RTM_NEWNEIGH message payload into a dict"""
+    family, index, state, flags, ntype = ndmsg.unpack_from(payload)
+    attrs = parse_attrs(payload, ndmsg.size)
+    return {"index": index,
+            "family": family,
+            "state": state,
+            "flags": flags,
+            "address": NDA_DST in attrs and format_address(family, attrs[NDA_DST]) or None,
+            "mac": NDA_LLADDR in attrs and format_mac(attrs[NDA_LLADDR]) or None,
+            }
+
+def link_is_up(link):
+    """Checks if link is operational. Virtual devices, such as loopback,
+    do not report operstate, so their flags are checked instead."""
+    if link["operstate"] == "unknown":
+        return link["flags"] & (IFF_UP | IFF_RUNNING) == IFF_UP | IFF_RUNNING
+    return link["operstate"] == "up"
+
+def proc_dev_columns(stats):
+    """Converts rtnl_link_stats64 values into /proc/net/dev columns, the
+    same way the kernel does in dev_seq_printf_stats()"""
+    s = dict(zip(STATS64_FIELDS, stats))
+    return [s["rx_bytes"], s["rx_packets"], s["rx_errors"],
+            s["rx_dropped"] + s["rx_missed_errors"],
+            s["rx_fifo_errors"],
+            s["rx_length_errors"] + s["rx_over_errors"] +
+                s["rx_crc_errors"] + s["rx_frame_errors"],
+            s["rx_compressed"], s["multicast"],
+            s["tx_bytes"], s["tx_packets"], s["tx_errors"], s["tx_dropped"],
+            s["tx_fifo_errors"], s["collisions"],
+            s["tx_carrier_errors"] + s["tx_aborted_errors"] +
+                s["tx_window_errors"] + s["tx_heartbeat_errors"],
+            s["tx_compressed"]]
+
+
+class NetlinkSocket:
+    """Netlink socket performing dump requests"""
+
+    # receive buffer size
+    BUFSIZE = 65536
+
+    def __init__(self, protocol=NETLINK_ROUTE, groups=0):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, protocol)
+        self.sock.bind((0, groups))
+        self.seq = 0
+        # held for a whole request, so threads sharing the socket do not
+        # receive each other's replies
+        self.lock = threading.Lock()
+
+    def close(self):
+        self.sock.close()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def setblocking(self, flag):
+        self.sock.setblocking(flag)
+
+    def receive(self):
+        """Receives a single datagram"""
+        return self.sock.recv(self.BUFSIZE)
+
+    def request(self, msg_type, payload, flags=NLM_F_REQUEST | NLM_F_DUMP):
+        """Sends a request and returns payloads of all replies"""
+        with self.lock:
+            self.seq += 1
+            seq = self.seq
+            self.sock.send(nlmsghdr.pack(nlmsghdr.size + len(payload), msg_type,
+                    flags, seq, 0) + payload)
+            replies = []
+            while True:
+                data = self.sock.recv(self.BUFSIZE)
+                for reply_type, reply_flags, reply_seq, reply in parse_messages(data):
+                    if reply_seq != seq:
+                        # stale message from previous request
+                        continue
+                    if reply_type == NLMSG_DONE:
+                        return replies
+                    if reply_type == NLMSG_ERROR:
+                        # acknowledgement
+                        return replies
+                    replies.append((reply_type, reply))
+                    if not reply_flags & NLM_F_MULTI:
+                        return replies
+
+
+class RtnetlinkBackend:
+    """Reads interfaces, addresses and routes with rtnetlink dumps"""
+
+    def __init__(self):
+        self.nl = NetlinkSocket(NETLINK_ROUTE)
+
+    def close(self):
+        self.nl.close()
+
+    def links(self):
+        """Returns {index: link} for all interfaces"""
+        links = {}
+        for msg_type, payload in self.nl.request(RTM_GETLINK,
+                ifinfomsg.pack(socket.AF_UNSPEC, 0, 0, 0, 0)):
+            if msg_type == RTM_NEWLINK:
+                link = parse_link(payload)
+                links[link["index"]] = link
+        return links
+
+    def addresses(self, family=socket.AF_UNSPEC):
+        """Returns list of addresses for all interfaces"""
+        return [parse_addr(payload) for msg_type, payload in
+                self.nl.request(RTM_GETADDR, ifaddrmsg.pack(family, 0, 0, 0, 0))
+                if msg_type == RTM_NEWADDR]
+
+    def routes(self, family=socket.AF_INET, table=RT_TABLE_MAIN):
+        """Returns list of routes from a routing table"""
+        routes = []
+        for msg_type, payload in self.nl.request(RTM_GETROUTE,
+                rtmsg.pack(family, 0, 0, 0, 0, 0, 0, 0, 0)):
+            if msg_type != RTM_NEWROUTE:
+                continue
+            route = parse_route(payload)
+            if table is None or route["table"] == table:
+                routes.append(route)
+        return routes
+
+    def neighbors(self, family=socket.AF_UNSPEC):
+        """Returns list of neighbor table entries"""
+        return [parse_neigh(payload) for msg_type, payload in
+                self.nl.request(RTM_GETNEIGH, ndmsg.pack(family, 0, 0, 0, 0))
+                if msg_type == RTM_NEWNEIGH]
+
+
+class LinkWatcher:
+    """Receives rtnetlink notifications about links, addresses and routes,
+    and converts them into (event, iface, data) tuples"""
+
+    def __init__(self, groups=RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR |
+            RTMGRP_IPV4_ROUTE | RTMGRP_IPV6_ROUTE):
+        # subscribe before dumping current state, so no change is lost
+        self.nl = NetlinkSocket(NETLINK_ROUTE, groups)
+        self.nl.setblocking(False)
+        self.links = {}
+        self.resync()
+
+    def close(self):
+        self.nl.close()
+
+    def fileno(self):
+        return self.nl.fileno()
+
+    def resync(self):
+        """Reloads all links, returns events for the changes found"""
+        backend = RtnetlinkBackend()
+        try:
+            links = backend.links()
+        finally:
+            backend.close()
+        events = []
+        for index, link in self.links.items():
+            if index not in links:
+                events.append((EVENT_REMOVED, link["name"], link))
+        for link in links.values():
+            events.extend(self.update_link(link))
+        self.links = links
+        # route notifications may have been lost as well
+        events.append((EVENT_ROUTE_CHANGED, None, None))
+        return events
+
+    def update_link(self, link):
+        """Compares link with its last known state"""
+        index = link["index"]
+        old = self.links.get(index)
+        self.links[index] = link
+        if old is None:
+            return [(EVENT_ADDED, link["name"], link)]
+        events = []
+        if old["name"] != link["name"]:
+            # renamed interfaces are reported as new ones
+            events.append((EVENT_REMOVED, old["name"], old))
+            events.append((EVENT_ADDED, link["name"], link))
+        elif link_is_up(old) != link_is_up(link):
+            if link_is_up(link):
+                events.append((EVENT_UP, link["name"], link))
+            else:
+                events.append((EVENT_DOWN, link["name"], link))
+        elif old["operstate"] != link["operstate"]:
+            events.append((EVENT_STATE_CHANGED, link["name"], link))
+        return events
+
+    def process(self, data):
+        """Converts notifications from a datagram into events"""
+        events = []
+        for msg_type, flags, seq, payload in parse_messages(data):
+            if msg_type == RTM_NEWLINK:
+                events.extend(self.update_link(parse_link(payload)))
+            elif msg_type == RTM_DELLINK:
+                link = parse_link(payload)
+                old = self.links.pop(link["index"], link)
+                events.append((EVENT_REMOVED, old["name"], old))
+            elif msg_type in (RTM_NEWADDR, RTM_DELADDR):
+                addr = parse_addr(payload)
+                link = self.links.get(addr["index"])
+                if link is None:
+                    continue
+                if msg_type == RTM_NEWADDR:
+                    events.append((EVENT_ADDRESS_ADDED, link["name"], addr))
+                else:
+                    events.append((EVENT_ADDRESS_REMOVED, link["name"], addr))
+            elif msg_type in (RTM_NEWROUTE, RTM_DELROUTE):
+                route = parse_route(payload)
+                link = self.links.get(route.get("oif"))
+                events.append((EVENT_ROUTE_CHANGED, link and link["name"], route))
+        return events
+
+    def events(self):
+        """Returns all pending events, without blocking"""
+        events = []
+        while True:
+            try:
+                data = self.nl.receive()
+            except socket.error as e:
+                if e.errno == errno.ENOBUFS:
+                    # notifications were lost, reload everything
+                    events.extend(self.resync())
+                    continue
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            events.extend(self.process(data))
+        return events
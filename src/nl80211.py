@@ -0,0 +1,174 @@
+#!/usr/bin/python
+"""net_monitor: nl80211 (generic netlink) backend for wireless station
+statistics"""
+
+import errno
+import struct
+
+from net_monitor.netlink import NetlinkSocket, NetlinkError, parse_attrs, \
+        format_mac, cstring, rtattr, align, NLM_F_REQUEST
+
+NETLINK_GENERIC = 16
+
+# generic netlink controller
+GENL_ID_CTRL = 0x10
+CTRL_CMD_GETFAMILY = 3
+CTRL_ATTR_FAMILY_ID = 1
+CTRL_ATTR_FAMILY_NAME = 2
+
+# nl80211 commands
+NL80211_CMD_GET_INTERFACE = 5
+NL80211_CMD_GET_STATION = 17
+
+# nl80211 attributes
+NL80211_ATTR_IFINDEX = 3
+NL80211_ATTR_IFNAME = 4
+NL80211_ATTR_MAC = 6
+NL80211_ATTR_STA_INFO = 21
+
+# station info attributes
+NL80211_STA_INFO_INACTIVE_TIME = 1
+NL80211_STA_INFO_RX_BYTES = 2
+NL80211_STA_INFO_TX_BYTES = 3
+NL80211_STA_INFO_SIGNAL = 7
+NL80211_STA_INFO_TX_BITRATE = 8
+NL80211_STA_INFO_RX_PACKETS = 9
+NL80211_STA_INFO_TX_PACKETS = 10
+NL80211_STA_INFO_TX_RETRIES = 11
+NL80211_STA_INFO_TX_FAILED = 12
+NL80211_STA_INFO_SIGNAL_AVG = 13
+NL80211_STA_INFO_RX_BITRATE = 14
+NL80211_STA_INFO_CONNECTED_TIME = 16
+NL80211_STA_INFO_BEACON_LOSS = 18
+NL80211_STA_INFO_RX_BYTES64 = 23
+NL80211_STA_INFO_TX_BYTES64 = 24
+
+# rate info attributes
+NL80211_RATE_INFO_BITRATE = 1
+NL80211_RATE_INFO_MCS = 2
+NL80211_RATE_INFO_BITRATE32 = 5
+NL80211_RATE_INFO_VHT_MCS = 6
+NL80211_RATE_INFO_HE_MCS = 13
+
+# struct genlmsghdr
+genlmsghdr = struct.Struct("=BBH")
+
+# (attribute, key, format) of unsigned station counters: 64 bits counters
+# replace 32 bits ones when present
+STATION_COUNTERS = [(NL80211_STA_INFO_INACTIVE_TIME, "inactive_time", "=I"),
+                    (NL80211_STA_INFO_CONNECTED_TIME, "connected_time", "=I"),
+                    (NL80211_STA_INFO_RX_BYTES, "rx_bytes", "=I"),
+                    (NL80211_STA_INFO_TX_BYTES, "tx_bytes", "=I"),
+                    (NL80211_STA_INFO_RX_BYTES64, "rx_bytes", "=Q"),
+                    (NL80211_STA_INFO_TX_BYTES64, "tx_bytes", "=Q"),
+                    (NL80211_STA_INFO_RX_PACKETS, "rx_packets", "=I"),
+                    (NL80211_STA_INFO_TX_PACKETS, "tx_packets", "=I"),
+                    (NL80211_STA_INFO_TX_RETRIES, "tx_retries", "=I"),
+                    (NL80211_STA_INFO_TX_FAILED, "tx_failed", "=I"),
+                    (NL80211_STA_INFO_BEACON_LOSS, "beacon_loss", "=I"),
+                    ]
+
+def pack_attr(attr_type, value):
+    """Packs a netlink attribute"""
+    data = rtattr.pack(rtattr.size + len(value), attr_type) + value
+    return data + "\0" * (align(len(data)) - len(data))
+
+def parse_rate(data):
+    """Parses nested rate info into (bitrate in bits per second, mcs)"""
+    attrs = parse_attrs(data, 0)
+    bitrate = None
+    # rates are reported in units of 100 kbit/s
+    if NL80211_RATE_INFO_BITRATE32 in attrs:
+        bitrate = struct.unpack("=I", attrs[NL80211_RATE_INFO_BITRATE32])[0] * 100000
+    elif NL80211_RATE_INFO_BITRATE in attrs:
+        bitrate = struct.unpack("=H", attrs[NL80211_RATE_INFO_BITRATE])[0] * 100000
+    mcs = None
+    for attr in (NL80211_RATE_INFO_MCS, NL80211_RATE_INFO_VHT_MCS, NL80211_RATE_INFO_HE_MCS):
+        if attr in attrs:
+            mcs = struct.unpack("=B", attrs[attr][:1])[0]
+            break
+    return bitrate, mcs
+
+def parse_station(payload):
+    """Parses NL80211_CMD_NEW_STATION message payload into a dict"""
+    attrs = parse_attrs(payload, genlmsghdr.size)
+    station = {"ifindex": 0,
+               "mac": None,
+               "signal": None,
+               "signal_avg": None,
+               "tx_bitrate": None,
+               "tx_mcs": None,
+               "rx_bitrate": None,
+               "rx_mcs": None,
+               }
+    if NL80211_ATTR_IFINDEX in attrs:
+        station["ifindex"] = struct.unpack("=I", attrs[NL80211_ATTR_IFINDEX])[0]
+    if NL80211_ATTR_MAC in attrs:
+        station["mac"] = format_mac(attrs[NL80211_ATTR_MAC])
+    info = parse_attrs(attrs.get(NL80211_ATTR_STA_INFO, ""), 0)
+    for attr, key, fmt in STATION_COUNTERS:
+        if attr in info:
+            station[key] = struct.unpack(fmt, info[attr])[0]
+        elif key not in station:
+            station[key] = 0
+    # signal levels are signed dBm
+    if NL80211_STA_INFO_SIGNAL in info:
+        station["signal"] = struct.unpack("=b", info[NL80211_STA_INFO_SIGNAL][:1])[0]
+    if NL80211_STA_INFO_SIGNAL_AVG in info:
+        station["signal_avg"] = struct.unpack("=b", info[NL80211_STA_INFO_SIGNAL_AVG][:1])[0]
+    if NL80211_STA_INFO_TX_BITRATE in info:
+        station["tx_bitrate"], station["tx_mcs"] = parse_rate(info[NL80211_STA_INFO_TX_BITRATE])
+    if NL80211_STA_INFO_RX_BITRATE in info:
+        station["rx_bitrate"], station["rx_mcs"] = parse_rate(info[NL80211_STA_INFO_RX_BITRATE])
+    return station
+
+
+class Nl80211Backend:
+    """Reads wireless interfaces and their stations with nl80211 dumps"""
+
+    def __init__(self):
+        self.nl = NetlinkSocket(NETLINK_GENERIC)
+        self.family = self.resolve("nl80211")
+
+    def close(self):
+        self.nl.close()
+
+    def resolve(self, name):
+        """Returns id of a generic netlink family"""
+        for msg_type, payload in self.nl.request(GENL_ID_CTRL,
+                genlmsghdr.pack(CTRL_CMD_GETFAMILY, 1, 0) +
+                pack_attr(CTRL_ATTR_FAMILY_NAME, name + "\0"), NLM_F_REQUEST):
+            attrs = parse_attrs(payload, genlmsghdr.size)
+            if CTRL_ATTR_FAMILY_ID in attrs:
+                return struct.unpack("=H", attrs[CTRL_ATTR_FAMILY_ID])[0]
+        raise NetlinkError(errno.ENOENT)
+
+    def interfaces(self):
+        """Returns {ifindex: name} of wireless interfaces"""
+        ifaces = {}
+        for msg_type, payload in self.nl.request(self.family,
+                genlmsghdr.pack(NL80211_CMD_GET_INTERFACE, 0, 0)):
+            attrs = parse_attrs(payload, genlmsghdr.size)
+            if NL80211_ATTR_IFINDEX in attrs and NL80211_ATTR_IFNAME in attrs:
+                ifindex = struct.unpack("=I", attrs[NL80211_ATTR_IFINDEX])[0]
+                ifaces[ifindex] = cstring(attrs[NL80211_ATTR_IFNAME])
+        return ifaces
+
+    def stations(self, ifindex):
+        """Returns list of stations known to a wireless interface: for a
+        client, the access point it is associated with"""
+        return [parse_station(payload) for msg_type, payload in
+                self.nl.request(self.family,
+                    genlmsghdr.pack(NL80211_CMD_GET_STATION, 0, 0) +
+                    pack_attr(NL80211_ATTR_IFINDEX, struct.pack("=I", ifindex)))]
+
+    def all_stations(self):
+        """Returns {iface: [stations]} for all wireless interfaces"""
+        result = {}
+        for ifindex, name in self.interfaces().items():
+            try:
+                result[name] = self.stations(ifindex)
+            except NetlinkError:
+                # interface is down or went away
+                result[name] = []
+        return result
@@ -0,0 +1,217 @@
+#!/usr/bin/python
+"""net_monitor: persistent readers for /proc files"""
+
+import io
+import array
+import threading
+
+# array typecode for 64-bit counters: array does not support "Q" on
+# python 2, but "L" is 64-bit wide on LP64 platforms
+if array.array("L").itemsize >= 8:
+    COUNTER_TYPECODE = "L"
+else:
+    COUNTER_TYPECODE = "d"
+
+# /proc/net/dev columns
+DEV_COLUMNS = ["rx_bytes", "rx_packets", "rx_errors", "rx_drops", "rx_fifo",
+               "rx_frame", "rx_compressed", "multicast",
+               "tx_bytes", "tx_packets", "tx_errors", "tx_drops", "tx_fifo",
+               "collisions", "tx_carrier", "tx_compressed"]
+DEV_COUNTERS = len(DEV_COLUMNS)
+DEV_INDEX = dict([(name, column) for column, name in enumerate(DEV_COLUMNS)])
+
+class ProcFile:
+    """A /proc file which is kept open between reads. Every read seeks back
+    to the beginning of the file and fills a reusable buffer, so no
+    open()/close() happens on each poll. data() copies the contents into a
+    string once per read, which parsers walk by offsets rather than
+    splitting it into a list of lines."""
+
+    # initial buffer size, grown as needed
+    BUFSIZE = 16384
+
+    def __init__(self, path, bufsize=BUFSIZE):
+        self.path = path
+        self.fd = None
+        self.buffer = bytearray(bufsize)
+        # held while the buffer is filled and copied
+        self.lock = threading.Lock()
+
+    def open(self):
+        """Opens the file, if it is not opened yet"""
+        if not self.fd:
+            self.fd = io.FileIO(self.path, "r")
+        return self.fd
+
+    def close(self):
+        """Closes file descriptor"""
+        if self.fd:
+            self.fd.close()
+            self.fd = None
+
+    def read(self):
+        """Reads whole file contents into internal buffer, returns its length"""
+        fd = self.open()
+        try:
+            fd.seek(0)
+            length = 0
+            while True:
+                view = memoryview(self.buffer)[length:]
+                count = fd.readinto(view)
+                # release the view, so the buffer can be resized
+                del view
+                if not count:
+                    break
+                length += count
+                if length == len(self.buffer):
+                    # buffer is full, grow it
+                    self.buffer.extend(bytearray(len(self.buffer)))
+        except (IOError, OSError):
+            # file became invalid, reopen it on next read
+            self.close()
+            raise
+        return length
+
+    def data(self):
+        """Reads file and returns its contents as a string (a copy of the
+        buffer, which may be filled again by another thread)"""
+        with self.lock:
+            length = self.read()
+            return memoryview(self.buffer)[:length].tobytes()
+
+
+class ProcReader:
+    """Keeps /proc files opened across polls"""
+
+    def __init__(self):
+        self.files = {}
+
+    def get(self, path):
+        """Returns ProcFile for path"""
+        if path not in self.files:
+            self.files[path] = ProcFile(path)
+        return self.files[path]
+
+    def read(self, path):
+        """Returns contents of a file"""
+        return self.get(path).data()
+
+    def close(self):
+        """Closes all opened files"""
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+
+def skip_lines(data, count):
+    """Returns the offset after count lines of data"""
+    pos = 0
+    for i in range(count):
+        pos = data.find("\n", pos) + 1
+        if not pos:
+            return len(data)
+    return pos
+
+class DevCounters:
+    """Counters of all interfaces, stored as a single array with a row of
+    DEV_COUNTERS integers per interface. Behaves as a read-only
+    {iface: row} mapping; single counters are read with get() without
+    building the row."""
+
+    def __init__(self, names=(), counters=None):
+        self.names = list(names)
+        self.rows = dict([(name, row) for row, name in enumerate(self.names)])
+        if counters is None:
+            counters = array.array(COUNTER_TYPECODE)
+        self.counters = counters
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, iface):
+        return iface in self.rows
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __getitem__(self, iface):
+        pos = self.rows[iface] * DEV_COUNTERS
+        return self.counters[pos:pos + DEV_COUNTERS]
+
+    def __nonzero__(self):
+        return bool(self.names)
+
+    def keys(self):
+        return list(self.names)
+
+    def items(self):
+        return [(iface, self[iface]) for iface in self.names]
+
+    def get(self, iface, column=None, default=0):
+        """Returns a counter (by column number or name) of iface, or the
+        whole row if column is None"""
+        if iface not in self.rows:
+            if column is None:
+                return None
+            return default
+        if column is None:
+            return self[iface]
+        if not isinstance(column, int):
+            column = DEV_INDEX[column]
+        return int(self.counters[self.rows[iface] * DEV_COUNTERS + column])
+
+    def counters_dict(self, iface):
+        """Returns {counter name: value} for iface"""
+        row = self.get(iface)
+        if row is None:
+            return {}
+        return dict(zip(DEV_COLUMNS, [int(x) for x in row]))
+
+    def append(self, iface, values):
+        """Adds a row of counters"""
+        self.rows[iface] = len(self.names)
+        self.names.append(iface)
+        self.counters.extend(values)
+
+
+def parse_dev(data):
+    """Parses contents of /proc/net/dev into DevCounters"""
+    # interface names are separated from values by ':', which may not be
+    # followed by a space for large counters
+    fields = data[skip_lines(data, 2):].replace(":", " ").split()
+    width = DEV_COUNTERS + 1
+    del fields[len(fields) - len(fields) % width:]
+    names = fields[::width]
+    del fields[::width]
+    return DevCounters(names, array.array(COUNTER_TYPECODE, map(int, fields)))
+
+def parse_wireless(data):
+    """Parses contents of /proc/net/wireless: {iface: link}"""
+    stats = {}
+    pos = skip_lines(data, 2)
+    end = len(data)
+    while pos < end:
+        eol = data.find("\n", pos)
+        if eol < 0:
+            eol = end
+        sep = data.find(":", pos, eol)
+        if sep > 0:
+            iface = data[pos:sep].strip()
+            params = data[sep + 1:eol].split()
+            stats[iface] = int(params[1].replace(".", ""))
+        pos = eol + 1
+    return stats
+
+def parse_table(data, skip=1):
+    """Parses a whitespace-separated table with a header (such as
+    /proc/net/route), returning rows of fields"""
+    pos = skip_lines(data, skip)
+    end = len(data)
+    while pos < end:
+        eol = data.find("\n", pos)
+        if eol < 0:
+            eol = end
+        fields = data[pos:eol].split()
+        if fields:
+            yield fields
+        pos = eol + 1
@@ -0,0 +1,211 @@
+#!/usr/bin/python
+"""net_monitor: counter rates computation"""
+
+import math
+import time
+import array
+import ctypes
+import ctypes.util
+
+from net_monitor.procfs import DEV_COUNTERS as COUNTERS, DEV_INDEX, COUNTER_TYPECODE
+
+# columns of commonly used counters
+RX_BYTES = DEV_INDEX["rx_bytes"]
+RX_PACKETS = DEV_INDEX["rx_packets"]
+TX_BYTES = DEV_INDEX["tx_bytes"]
+TX_PACKETS = DEV_INDEX["tx_packets"]
+
+# default EWMA time constant, in seconds
+EWMA_TAU = 5.0
+
+# width of counters which wrap around: on 32-bit platforms, most drivers
+# keep their counters in an unsigned long; elsewhere counters are 64-bit,
+# and never wrap in practice (None)
+WRAP_WIDTH = ctypes.sizeof(ctypes.c_ulong) == 4 and 32 or None
+
+class timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+CLOCK_MONOTONIC = 1
+
+def _clock_gettime():
+    """Finds clock_gettime(), which is in librt on older glibc"""
+    for name in ["c", "rt"]:
+        path = ctypes.util.find_library(name)
+        if not path:
+            continue
+        try:
+            func = ctypes.CDLL(path, use_errno=True).clock_gettime
+        except (OSError, AttributeError):
+            continue
+        func.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        return func
+    return None
+
+if hasattr(time, "monotonic"):
+    monotonic = time.monotonic
+else:
+    _gettime = _clock_gettime()
+    _ts = timespec()
+
+    def monotonic():
+        """Returns seconds from CLOCK_MONOTONIC, which is not affected by
+        system clock changes"""
+        if _gettime is None or _gettime(CLOCK_MONOTONIC, ctypes.byref(_ts)):
+            return time.time()
+        return _ts.tv_sec + _ts.tv_nsec * 1e-9
+
+
+class CounterRates:
+    """Rates of the counters of a single interface. Values are kept in
+    preallocated arrays, indexed by /proc/net/dev column: raw counters and
+    totals as integers, rates as doubles. With width 32, counters going
+    back are taken as wraps when possible; otherwise (and once a value does
+    not fit in 32 bits) any decrease is a reset."""
+
+    def __init__(self, tau=EWMA_TAU, width=WRAP_WIDTH):
+        self.tau = tau
+        self.last = array.array(COUNTER_TYPECODE, [0]) * COUNTERS
+        self.rates = array.array("d", [0.0]) * COUNTERS
+        self.smoothed = array.array("d", [0.0]) * COUNTERS
+        self.totals = array.array(COUNTER_TYPECODE, [0]) * COUNTERS
+        self.clock = None
+        self.width = width
+        # number of detected counter resets (interface recreated)
+        self.resets = 0
+        self.valid = False
+
+    def delta(self, column, value):
+        """Returns increase of a counter, handling wraps, or None on reset"""
+        diff = value - self.last[column]
+        if diff >= 0:
+            return diff
+        if self.width == 32 and self.last[column] >= 2**31 and value < 2**31:
+            # 32-bit counter wrapped around
+            return diff + 2**32
+        return None
+
+    def update(self, clock, counters):
+        """Adds a sample taken at clock (monotonic seconds)"""
+        if len(counters) < COUNTERS:
+            return
+        if self.width == 32 and max(counters) >= 2**32:
+            self.width = 64
+        if self.clock is None or clock <= self.clock:
+            self.baseline(clock, counters)
+            return
+        elapsed = clock - self.clock
+        deltas = [self.delta(column, counters[column]) for column in range(COUNTERS)]
+        if None in deltas:
+            # counters went back: interface was recreated
+            self.resets += 1
+            self.baseline(clock, counters)
+            return
+        alpha = 1.0 - math.exp(-elapsed / self.tau)
+        rates = self.rates
+        smoothed = self.smoothed
+        for column in range(COUNTERS):
+            rate = deltas[column] / elapsed
+            if self.valid:
+                smoothed[column] += alpha * (rate - smoothed[column])
+            else:
+                smoothed[column] = rate
+            rates[column] = rate
+            self.totals[column] += deltas[column]
+            self.last[column] = counters[column]
+        self.clock = clock
+        self.valid = True
+
+    def baseline(self, clock, counters):
+        """Restarts rate computation from counters"""
+        for column in range(COUNTERS):
+            self.last[column] = counters[column]
+            self.rates[column] = 0.0
+        self.clock = clock
+        self.valid = False
+
+
+class RateEngine:
+    """Rates of all interfaces, updated from snapshots. Rates are also copied
+    to tables with a row per interface (in the order of names), from which
+    column() reads a counter of all interfaces at once."""
+
+    def __init__(self, tau=EWMA_TAU, width=WRAP_WIDTH):
+        self.tau = tau
+        # width of counters, see CounterRates
+        self.width = width
+        self.ifaces = {}
+        # increased when interfaces are added or removed
+        self.version = 0
+        # interfaces by row, and row of each interface
+        self.names = []
+        self.rows = {}
+        # rates and smoothed rates of names[row] at row * COUNTERS, and
+        # whether they are valid, by row
+        self.table = array.array("d")
+        self.smoothed_table = array.array("d")
+        self.valid = []
+
+    def update(self, snapshot):
+        """Adds samples from a Snapshot"""
+        for iface, data in snapshot.ifaces.items():
+            if not data.exists:
+                continue
+            rates = self.ifaces.get(iface)
+            if rates is None:
+                rates = self.ifaces[iface] = CounterRates(self.tau, self.width)
+                self.rows[iface] = len(self.names)
+                self.names.append(iface)
+                self.table.extend(rates.rates)
+                self.smoothed_table.extend(rates.smoothed)
+                self.valid.append(False)
+                self.version += 1
+            rates.update(snapshot.clock, data.counters)
+            row = self.rows[iface]
+            start = row * COUNTERS
+            self.table[start:start + COUNTERS] = rates.rates
+            self.smoothed_table[start:start + COUNTERS] = rates.smoothed
+            self.valid[row] = rates.valid
+
+    def remove(self, iface):
+        if self.ifaces.pop(iface, None) is None:
+            return
+        # the last row moves to the row of the removed interface
+        row = self.rows.pop(iface)
+        last = self.names.pop()
+        valid = self.valid.pop()
+        for table in (self.table, self.smoothed_table):
+            if last != iface:
+                table[row * COUNTERS:(row + 1) * COUNTERS] = table[-COUNTERS:]
+            del table[-COUNTERS:]
+        if last != iface:
+            self.names[row] = last
+            self.rows[last] = row
+            self.valid[row] = valid
+        self.version += 1
+
+    def column(self, column, smoothed=False):
+        """Returns (smoothed) rates of a counter as a list indexed by row"""
+        if smoothed:
+            return self.smoothed_table[column::COUNTERS].tolist()
+        return self.table[column::COUNTERS].tolist()
+
+    def get(self, iface):
+        """Returns CounterRates of an interface, or None"""
+        return self.ifaces.get(iface)
+
+    def rate(self, iface, column=RX_BYTES, smoothed=False):
+        """Returns per-second rate of a counter"""
+        rates = self.ifaces.get(iface)
+        if rates is None or not rates.valid:
+            return 0.0
+        if smoothed:
+            return rates.smoothed[column]
+        return rates.rates[column]
+
+    def total(self, iface, column=RX_BYTES):
+        """Returns counter increase since monitoring started"""
+        rates = self.ifaces.get(iface)
+        if rates is None:
+            return 0
+        return int(rates.totals[column])
@@ -0,0 +1,380 @@
+#!/usr/bin/python
+"""net_monitor: binary recording and replay of monitoring sessions.
+
+A recording is an append-only file made of records. Each record has a
+header with the payload length, record type and timestamp, and the payload
+length is repeated after the payload, so the file can be walked backwards
+from its end as well.
+
+Records are grouped in segments. A segment starts with a names record
+(interface ids used in the segment) and ends with an index record, which
+holds the segment position, time range and the offset of the previous index
+record. A reader finds the last index record walking back from the end of
+the file, and follows the chain of index records to seek to a time range
+without reading the data records.
+"""
+
+import os
+import mmap
+import struct
+import threading
+from collections import namedtuple
+
+from net_monitor.procfs import DEV_COUNTERS
+from net_monitor.connections import CONNECTION_PROTOS
+
+MAGIC = "NMREC\0"
+VERSION = 1
+
+RECORD_NAMES = 1
+RECORD_SNAPSHOT = 2
+RECORD_CONNECTIONS = 3
+RECORD_INDEX = 4
+
+# number of data records in a segment
+INDEX_INTERVAL = 1000
+
+file_header = struct.Struct("=6sH")
+# payload length, record type, timestamp
+record_header = struct.Struct("=IBd")
+record_trailer = struct.Struct("=I")
+# interface id, name length
+name_entry = struct.Struct("=HB")
+# interface id, flags, wireless link, counters
+iface_entry = struct.Struct("=HBi%dQ" % DEV_COUNTERS)
+# protocol, state, number of connections
+state_entry = struct.Struct("=BBI")
+# previous index offset, segment offset, first and last timestamps, records
+index_entry = struct.Struct("=QQddI")
+count_entry = struct.Struct("=H")
+
+FLAG_EXISTS = 1
+FLAG_WIRELESS = 2
+
+RECORD_OVERHEAD = record_header.size + record_trailer.size
+
+RecordedInterface = namedtuple("RecordedInterface", "name exists wireless link counters")
+RecordedSnapshot = namedtuple("RecordedSnapshot", "timestamp ifaces")
+RecordedConnections = namedtuple("RecordedConnections", "timestamp states")
+Segment = namedtuple("Segment", "start stop first last count")
+
+
+class RecordingError(Exception):
+    """Raised for files which are not valid recordings"""
+    pass
+
+
+def encode_names(names):
+    """Encodes {id: name}"""
+    data = [count_entry.pack(len(names))]
+    for iface_id, name in sorted(names.items()):
+        data.append(name_entry.pack(iface_id, len(name)) + name)
+    return "".join(data)
+
+def decode_names(data, pos, names):
+    """Decodes names record at pos into names"""
+    count = count_entry.unpack_from(data, pos)[0]
+    pos += count_entry.size
+    for i in range(count):
+        iface_id, length = name_entry.unpack_from(data, pos)
+        pos += name_entry.size
+        names[iface_id] = data[pos:pos + length]
+        pos += length
+
+def decode_snapshot(data, pos, timestamp, names):
+    """Decodes snapshot record at pos"""
+    count = count_entry.unpack_from(data, pos)[0]
+    pos += count_entry.size
+    ifaces = {}
+    for i in range(count):
+        values = iface_entry.unpack_from(data, pos)
+        pos += iface_entry.size
+        name = names.get(values[0], str(values[0]))
+        ifaces[name] = RecordedInterface(name, bool(values[1] & FLAG_EXISTS),
+                bool(values[1] & FLAG_WIRELESS), values[2], values[3:])
+    return RecordedSnapshot(timestamp, ifaces)
+
+def decode_connections(data, pos, timestamp):
+    """Decodes connections record at pos"""
+    count = count_entry.unpack_from(data, pos)[0]
+    pos += count_entry.size
+    states = {}
+    for i in range(count):
+        proto, state, value = state_entry.unpack_from(data, pos)
+        pos += state_entry.size
+        states[(CONNECTION_PROTOS[proto], state)] = value
+    return RecordedConnections(timestamp, states)
+
+def read_record(data, pos, end):
+    """Returns (type, timestamp, payload offset, payload length) of a valid
+    record at pos, or None"""
+    if pos + RECORD_OVERHEAD > end:
+        return None
+    length, record_type, timestamp = record_header.unpack_from(data, pos)
+    stop = pos + record_header.size + length
+    if stop + record_trailer.size > end or \
+            record_trailer.unpack_from(data, stop)[0] != length:
+        return None
+    return record_type, timestamp, pos + record_header.size, length
+
+def previous_record(data, pos):
+    """Returns offset of the record ending at pos, or None"""
+    if pos < file_header.size + RECORD_OVERHEAD:
+        return None
+    length = record_trailer.unpack_from(data, pos - record_trailer.size)[0]
+    start = pos - RECORD_OVERHEAD - length
+    if start < file_header.size or \
+            record_header.unpack_from(data, start)[0] != length:
+        return None
+    return start
+
+def scan(data, pos, end):
+    """Reads records forward from pos, returns (end of last valid record,
+    offset of last index record or None)"""
+    last_index = None
+    while True:
+        record = read_record(data, pos, end)
+        if record is None:
+            return pos, last_index
+        if record[0] == RECORD_INDEX:
+            last_index = pos
+        pos = record[2] + record[3] + record_trailer.size
+
+def find_last_index(data, end):
+    """Returns (end of valid data, offset of last index record or None),
+    walking back from end. A damaged tail (such as a partially written
+    record) makes it fall back to a forward scan."""
+    pos = end
+    while pos > file_header.size:
+        start = previous_record(data, pos)
+        if start is None or read_record(data, start, pos) is None:
+            return scan(data, file_header.size, end)
+        if record_header.unpack_from(data, start)[1] == RECORD_INDEX:
+            return end, start
+        pos = start
+    return end, None
+
+def segment_range(data, start, stop):
+    """Returns (first timestamp, last timestamp, count) of data records
+    between start and stop"""
+    first = last = None
+    count = 0
+    pos = start
+    while pos < stop:
+        record_type, timestamp, payload, length = read_record(data, pos, stop)
+        if record_type in (RECORD_SNAPSHOT, RECORD_CONNECTIONS):
+            if first is None:
+                first = timestamp
+            last = timestamp
+            count += 1
+        pos = payload + length + record_trailer.size
+    return first, last, count
+
+
+class Recorder:
+    """Appends snapshots and connection summaries to a recording. An
+    existing recording is continued: a damaged tail is truncated and the
+    records after its last index are indexed first."""
+
+    def __init__(self, path, index_interval=INDEX_INTERVAL):
+        self.path = path
+        self.index_interval = index_interval
+        self.lock = threading.Lock()
+        # interface name -> id
+        self.ids = {}
+        self.prev_index = 0
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self.fd = open(path, "r+b")
+            self.recover()
+        else:
+            self.fd = open(path, "wb")
+            self.fd.write(file_header.pack(MAGIC, VERSION))
+        self.start_segment()
+
+    def recover(self):
+        """Prepares an existing recording for appending"""
+        data = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version = file_header.unpack_from(data, 0)
+            if magic != MAGIC:
+                raise RecordingError("%s is not a recording" % self.path)
+            end, last_index = find_last_index(data, len(data))
+            start = file_header.size
+            if last_index is not None:
+                self.prev_index = last_index
+                start = last_index + record_header.size + index_entry.size + \
+                        record_trailer.size
+            first, last, count = segment_range(data, start, end)
+        finally:
+            data.close()
+        self.fd.truncate(end)
+        self.fd.seek(end)
+        if count:
+            # index records written before an unclean shutdown
+            self.segment_start = start
+            self.first = first
+            self.last = last
+            self.count = count
+            self.write_index()
+
+    def close(self):
+        with self.lock:
+            if self.count:
+                self.write_index()
+            self.fd.close()
+
+    def flush(self):
+        with self.lock:
+            self.fd.flush()
+
+    def write_record(self, record_type, timestamp, payload):
+        """Appends a record, returns its offset"""
+        pos = self.fd.tell()
+        self.fd.write(record_header.pack(len(payload), record_type, timestamp) +
+                payload + record_trailer.pack(len(payload)))
+        return pos
+
+    def start_segment(self):
+        """Starts a new segment, with all known names"""
+        self.segment_start = self.fd.tell()
+        self.first = None
+        self.last = None
+        self.count = 0
+        names = dict([(iface_id, name) for name, iface_id in self.ids.items()])
+        self.write_record(RECORD_NAMES, 0, encode_names(names))
+
+    def write_index(self):
+        """Ends the current segment"""
+        index = self.write_record(RECORD_INDEX, self.last,
+                index_entry.pack(self.prev_index, self.segment_start, self.first,
+                    self.last, self.count))
+        self.prev_index = index
+
+    def add_data(self, record_type, timestamp, payload):
+        """Appends a data record, ending the segment when it is full"""
+        self.write_record(record_type, timestamp, payload)
+        if self.first is None:
+            self.first = timestamp
+        self.last = timestamp
+        self.count += 1
+        if self.count >= self.index_interval:
+            self.write_index()
+            self.start_segment()
+
+    def iface_id(self, name):
+        """Returns id of an interface, recording new names"""
+        if name not in self.ids:
+            self.ids[name] = len(self.ids)
+            self.write_record(RECORD_NAMES, 0, encode_names({self.ids[name]: name}))
+        return self.ids[name]
+
+    def write_snapshot(self, snapshot):
+        """Records counters and wireless link of a Monitor snapshot"""
+        zeros = (0,) * DEV_COUNTERS
+        with self.lock:
+            data = [count_entry.pack(len(snapshot.ifaces))]
+            for name, iface in sorted(snapshot.ifaces.items()):
+                flags = 0
+                if iface.exists:
+                    flags |= FLAG_EXISTS
+                if iface.wireless:
+                    flags |= FLAG_WIRELESS
+                counters = iface.counters or zeros
+                data.append(iface_entry.pack(self.iface_id(name), flags,
+                    int(iface.link), *counters))
+            self.add_data(RECORD_SNAPSHOT, snapshot.timestamp, "".join(data))
+
+    def write_connections(self, timestamp, states):
+        """Records {(proto, state): connections} (as kept by
+        ConnectionAggregator.by_state)"""
+        with self.lock:
+            data = [count_entry.pack(len(states))]
+            for (proto, state), count in sorted(states.items()):
+                data.append(state_entry.pack(CONNECTION_PROTOS.index(proto),
+                    state, count))
+            self.add_data(RECORD_CONNECTIONS, timestamp, "".join(data))
+
+
+class Replay:
+    """Reads a recording through mmap"""
+
+    def __init__(self, path):
+        self.fd = open(path, "rb")
+        if os.fstat(self.fd.fileno()).st_size < file_header.size:
+            raise RecordingError("%s is not a recording" % path)
+        self.data = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = file_header.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise RecordingError("%s is not a recording" % path)
+        self.end, last_index = find_last_index(self.data, len(self.data))
+        self.segments = self.load_segments(last_index)
+
+    def close(self):
+        self.data.close()
+        self.fd.close()
+
+    def load_segments(self, last_index):
+        """Returns segments, following the chain of index records"""
+        segments = []
+        tail = file_header.size
+        if last_index is not None:
+            tail = last_index + record_header.size + index_entry.size + \
+                    record_trailer.size
+        # records after the last index
+        first, last, count = segment_range(self.data, tail, self.end)
+        if count:
+            segments.append(Segment(tail, self.end, first, last, count))
+        index = last_index
+        while index is not None:
+            prev, start, first, last, count = index_entry.unpack_from(self.data,
+                    index + record_header.size)
+            segments.append(Segment(start, index, first, last, count))
+            if not prev:
+                break
+            index = prev
+        segments.reverse()
+        return segments
+
+    def time_range(self):
+        """Returns (first, last) recorded timestamps, or None"""
+        if not self.segments:
+            return None
+        return self.segments[0].first, self.segments[-1].last
+
+    def __len__(self):
+        return sum([segment.count for segment in self.segments])
+
+    def records(self, start=None, end=None, types=(RECORD_SNAPSHOT, RECORD_CONNECTIONS)):
+        """Iterates over RecordedSnapshot and RecordedConnections recorded
+        between start and end"""
+        data = self.data
+        for segment in self.segments:
+            if start is not None and segment.last < start:
+                continue
+            if end is not None and segment.first > end:
+                continue
+            names = {}
+            pos = segment.start
+            while pos < segment.stop:
+                record_type, timestamp, payload, length = read_record(data, pos,
+                        segment.stop)
+                pos = payload + length + record_trailer.size
+                if record_type == RECORD_NAMES:
+                    decode_names(data, payload, names)
+                    continue
+                if record_type not in types or \
+                        (start is not None and timestamp < start) or \
+                        (end is not None and timestamp > end):
+                    continue
+                if record_type == RECORD_SNAPSHOT:
+                    yield decode_snapshot(data, payload, timestamp, names)
+                elif record_type == RECORD_CONNECTIONS:
+                    yield decode_connections(data, payload, timestamp)
+
+    def snapshots(self, start=None, end=None):
+        """Iterates over RecordedSnapshot between start and end"""
+        return self.records(start, end, (RECORD_SNAPSHOT,))
+
+    def connections(self, start=None, end=None):
+        """Iterates over RecordedConnections between start and end"""
+        return self.records(start, end, (RECORD_CONNECTIONS,))
@@ -0,0 +1,172 @@
+#!/usr/bin/python
+"""net_monitor: routing table with longest-prefix-match lookups"""
+
+import socket
+import struct
+from collections import namedtuple
+
+# unicast route type, in rtnetlink messages
+RTN_UNICAST = 1
+
+# route flags, as in include/uapi/linux/route.h and ipv6_route.h
+RTF_UP = 0x0001
+RTF_REJECT = 0x0200
+RTF_LOCAL = 0x80000000
+
+# address size in bits
+ADDRESS_BITS = {socket.AF_INET: 32, socket.AF_INET6: 128}
+
+def prefix_mask(family, prefixlen):
+    """Returns network mask of a prefix, as an integer"""
+    bits = ADDRESS_BITS[family]
+    return ((1 << prefixlen) - 1) << (bits - prefixlen)
+
+def address_to_int(family, address):
+    """Converts an address string into an integer"""
+    return packed_to_int(family, socket.inet_pton(family, address))
+
+def packed_to_int(family, packed):
+    """Converts a packed address into an integer"""
+    if family == socket.AF_INET:
+        return struct.unpack(">I", packed)[0]
+    high, low = struct.unpack(">QQ", packed)
+    return (high << 64) | low
+
+def int_to_address(family, value):
+    """Converts an integer into an address string"""
+    if family == socket.AF_INET:
+        return socket.inet_ntoa(struct.pack(">I", value))
+    return socket.inet_ntop(family, struct.pack(">QQ", value >> 64,
+            value & 0xffffffffffffffff))
+
+
+class Route(namedtuple("Route", "family network prefixlen gateway metric iface")):
+    """A route: network and gateway are integers in network byte order
+    (gateway is 0 for directly connected networks)"""
+    __slots__ = ()
+
+    def destination(self):
+        """Formats destination as address/prefix"""
+        return "%s/%d" % (int_to_address(self.family, self.network), self.prefixlen)
+
+    def gateway_address(self):
+        """Formats gateway address, or returns None"""
+        if not self.gateway:
+            return None
+        return int_to_address(self.family, self.gateway)
+
+    def is_default(self):
+        return self.prefixlen == 0
+
+
+def parse_route(data):
+    """Parses /proc/net/route into a list of Routes"""
+    routes = []
+    for line in data.splitlines()[1:]:
+        fields = line.split()
+        if len(fields) < 8 or not int(fields[3], 16) & RTF_UP:
+            continue
+        # addresses are printed as native integers
+        network, gateway, mask = [socket.ntohl(int(fields[i], 16)) for i in (1, 2, 7)]
+        routes.append(Route(socket.AF_INET, network, bin(mask).count("1"),
+                gateway, int(fields[6], 16), fields[0]))
+    return routes
+
+def parse_ipv6_route(data):
+    """Parses /proc/net/ipv6_route into a list of Routes, skipping local
+    and unreachable destinations"""
+    routes = []
+    for line in data.splitlines():
+        fields = line.split()
+        if len(fields) < 10:
+            continue
+        flags = int(fields[8], 16)
+        if not flags & RTF_UP or flags & (RTF_REJECT | RTF_LOCAL):
+            continue
+        routes.append(Route(socket.AF_INET6, int(fields[0], 16), int(fields[1], 16),
+                int(fields[4], 16), int(fields[5], 16), fields[9]))
+    return routes
+
+
+class RouteTable:
+    """Routes indexed for longest-prefix-match lookups. Each address family
+    has a hash table of networks per prefix length, probed from the longest
+    prefix to the shortest, so a lookup costs at most one dict access per
+    distinct prefix length in use."""
+
+    def __init__(self, routes=()):
+        self.routes = list(routes)
+        # family -> [(mask, {network: route})], longest prefixes first
+        self.tables = {}
+        # iface -> [routes]
+        self.ifaces = {}
+        prefixes = {}
+        for route in self.routes:
+            self.ifaces.setdefault(route.iface, []).append(route)
+            networks = prefixes.setdefault((route.family, route.prefixlen), {})
+            current = networks.get(route.network)
+            # the route with the lowest metric wins
+            if current is None or route.metric < current.metric:
+                networks[route.network] = route
+        for (family, prefixlen), networks in sorted(prefixes.items(), reverse=True):
+            self.tables.setdefault(family, []).append(
+                    (prefix_mask(family, prefixlen), networks))
+
+    def __len__(self):
+        return len(self.routes)
+
+    def lookup(self, address, family=socket.AF_INET):
+        """Returns the Route serving an address (a string, or an integer in
+        network byte order), or None"""
+        if isinstance(address, basestring):
+            address = address_to_int(family, address)
+        for mask, networks in self.tables.get(family, ()):
+            route = networks.get(address & mask)
+            if route is not None:
+                return route
+        return None
+
+    def interface_routes(self, iface):
+        """Returns routes through an interface"""
+        return self.ifaces.get(iface, [])
+
+    def default_routes(self, family=None):
+        """Returns default routes, optionally of a single family"""
+        return [route for route in self.routes if route.is_default()
+                and (family is None or route.family == family)]
+
+    def egress(self, table):
+        """Returns egress interfaces of remote addresses of a
+        ConnectionTable, as a list parallel to its rows (None for
+        unroutable addresses)"""
+        family = table.family
+        lookup = self.lookup
+        column = table.remote_addr
+        # connections share remote addresses, each is looked up once
+        seen = {}
+        result = []
+        if table.addr_words == 1:
+            ntohl = socket.ntohl
+            for addr in column:
+                if not addr:
+                    # unconnected socket
+                    result.append(None)
+                    continue
+                if addr not in seen:
+                    route = lookup(ntohl(addr), family)
+                    seen[addr] = route and route.iface
+                result.append(seen[addr])
+        else:
+            for i in range(0, len(column), 4):
+                words = tuple(column[i:i + 4])
+                if not any(words):
+                    result.append(None)
+                    continue
+                if words not in seen:
+                    value = 0
+                    for word in words:
+                        value = (value << 32) | socket.ntohl(word)
+                    route = lookup(value, family)
+                    seen[words] = route and route.iface
+                result.append(seen[words])
+        return result
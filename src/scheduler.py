@@ -0,0 +1,273 @@
+#!/usr/bin/python
+"""net_monitor: collection scheduler with per-collector intervals"""
+
+import sys
+import heapq
+import random
+import threading
+import traceback
+import Queue
+
+from net_monitor.rates import monotonic
+from net_monitor.connections import CONNECTION_PROTOS
+
+# default collector intervals, in seconds
+COLLECTOR_INTERVALS = {"counters": 1.0,
+                       "interfaces": 5.0,
+                       "routes": 10.0,
+                       "dns": 30.0,
+                       "connections": 10.0,
+                       "vnstat": 60.0,
+                       "stations": 1.0,
+                       "kernel": 1.0,
+                       "neighbors": 10.0,
+                       }
+
+# intervals are randomly changed by up to this fraction, so collectors
+# with the same interval do not run in lockstep
+JITTER = 0.1
+
+# number of worker threads running collectors
+WORKERS = 4
+
+class Task:
+    """A collector: a function called every interval seconds, and its
+    latest result"""
+
+    def __init__(self, name, func, interval, jitter=JITTER, lock=None):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        # collectors sharing a lock never run at the same time
+        self.lock = lock
+        self.value = None
+        # monotonic time of last successful run
+        self.timestamp = None
+        # increased on every successful run
+        self.generation = 0
+        self.error = None
+        self.running = False
+        # runs skipped because previous one was still running
+        self.skipped = 0
+        # sequence number of the scheduled run
+        self.seq = None
+        self.callbacks = []
+
+    def next_due(self, now):
+        """Returns when the next run is due"""
+        return now + self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+
+class Scheduler:
+    """Runs collectors in a pool of worker threads, each on its own
+    schedule. A dispatcher thread keeps the due times in a heap and hands
+    due collectors to workers; slow collectors only delay themselves, as a
+    run is skipped while the previous one is still going on."""
+
+    def __init__(self, workers=WORKERS):
+        self.workers = workers
+        self.tasks = {}
+        # (due time, seq, task name)
+        self.queue = []
+        self.seq = 0
+        self.cond = threading.Condition()
+        self.jobs = Queue.Queue()
+        self.threads = []
+        self.running = False
+
+    def add(self, name, func, interval, jitter=JITTER, lock=None):
+        """Adds a collector. Its first run happens after a short random
+        delay, so collectors added together do not start in lockstep."""
+        task = Task(name, func, interval, jitter, lock)
+        with self.cond:
+            self.tasks[name] = task
+            self.push(task, monotonic() + random.uniform(0, min(interval, 1.0) * jitter))
+            self.cond.notify_all()
+        return task
+
+    def remove(self, name):
+        with self.cond:
+            self.tasks.pop(name, None)
+
+    def push(self, task, due):
+        """Schedules a run of task (with cond held)"""
+        self.seq += 1
+        task.seq = self.seq
+        heapq.heappush(self.queue, (due, self.seq, task.name))
+
+    def set_interval(self, name, interval):
+        """Changes interval of a collector, rescheduling it"""
+        with self.cond:
+            task = self.tasks[name]
+            task.interval = interval
+            if not task.running:
+                self.push(task, task.next_due(monotonic()))
+                self.cond.notify_all()
+
+    def trigger(self, name):
+        """Runs a collector as soon as possible"""
+        with self.cond:
+            task = self.tasks[name]
+            if not task.running:
+                self.push(task, monotonic())
+                self.cond.notify_all()
+
+    def connect(self, name, callback):
+        """Calls callback(name, value) from a worker thread after every
+        successful run of a collector, holding the collector's lock"""
+        self.tasks[name].callbacks.append(callback)
+
+    def start(self):
+        """Starts dispatcher and worker threads"""
+        if self.running:
+            return
+        self.running = True
+        self.threads = [threading.Thread(target=self.dispatch)]
+        for i in range(self.workers):
+            self.threads.append(threading.Thread(target=self.work))
+        for thread in self.threads:
+            thread.setDaemon(True)
+            thread.start()
+
+    def stop(self):
+        """Stops all threads, waiting for running collectors"""
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        for i in range(self.workers):
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def dispatch(self):
+        """Dispatcher thread: hands due collectors to workers"""
+        with self.cond:
+            while self.running:
+                if not self.queue:
+                    self.cond.wait()
+                    continue
+                now = monotonic()
+                due, seq, name = self.queue[0]
+                if due > now:
+                    self.cond.wait(due - now)
+                    continue
+                heapq.heappop(self.queue)
+                task = self.tasks.get(name)
+                if task is None or task.seq != seq:
+                    # removed or rescheduled
+                    continue
+                if task.running:
+                    task.skipped += 1
+                    self.push(task, task.next_due(now))
+                    continue
+                task.running = True
+                self.jobs.put(task)
+
+    def work(self):
+        """Worker thread"""
+        while True:
+            task = self.jobs.get()
+            if task is None:
+                return
+            self.run(task)
+
+    def run(self, task):
+        """Runs a collector and schedules its next run. Callbacks are
+        called with the collector's lock still held, as they usually read
+        the state the collector updated."""
+        value = None
+        error = None
+        if task.lock:
+            task.lock.acquire()
+        try:
+            try:
+                value = task.func()
+            except:
+                traceback.print_exc()
+                error = sys.exc_info()[1]
+            now = monotonic()
+            with self.cond:
+                task.running = False
+                task.error = error
+                if error is None:
+                    task.value = value
+                    task.timestamp = now
+                    task.generation += 1
+                if self.tasks.get(task.name) is task:
+                    self.push(task, task.next_due(now))
+                self.cond.notify_all()
+            if error is None:
+                for callback in task.callbacks:
+                    try:
+                        callback(task.name, value)
+                    except:
+                        traceback.print_exc()
+        finally:
+            if task.lock:
+                task.lock.release()
+
+    def latest(self, name):
+        """Returns latest value of a collector (None before its first run)"""
+        return self.tasks[name].value
+
+    def generation(self, name):
+        return self.tasks[name].generation
+
+    def wait(self, name, generation=0, timeout=None):
+        """Waits until the collector produces a value newer than generation
+        (or timeout seconds pass), returns (value, generation)"""
+        task = self.tasks[name]
+        deadline = None
+        if timeout is not None:
+            deadline = monotonic() + timeout
+        with self.cond:
+            while task.generation <= generation:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        break
+                self.cond.wait(remaining)
+            return task.value, task.generation
+
+
+def monitor_collectors(scheduler, monitor, intervals=COLLECTOR_INTERVALS,
+        aggregator=None):
+    """Adds collectors for a Monitor: counters (a snapshot reusing interface
+    details), interfaces (full snapshot with status, addresses and wireless
+    parameters), routes, dns, connections (updating aggregator, if given)
+    vnstat (accounting data of interfaces with vnstat enabled), stations
+    (nl80211 station statistics of wireless interfaces), kernel (snmp,
+    netstat, sockstat and neighbor cache counters) and neighbors. Only the
+    snapshot collectors share a lock (monitor.snapshot_lock), as both feed
+    rates and history; netlink sockets, /proc files, caches and the uptime
+    log have locks of their own, so a slow connection scan does not delay
+    counters."""
+    collectors = {"counters": lambda: monitor.snapshot(details=False),
+                  "interfaces": lambda: monitor.snapshot(),
+                  "routes": monitor.get_routes,
+                  "dns": monitor.get_dns,
+                  "vnstat": lambda: dict([(iface, monitor.get_accounting(iface))
+                      for iface in monitor.net if monitor.has_network_accounting(iface)]),
+                  "stations": monitor.get_stations,
+                  "kernel": monitor.get_kernel_stats,
+                  "neighbors": monitor.get_neighbors,
+                  }
+    if aggregator is not None:
+        def update_connections():
+            aggregator.update()
+            return aggregator
+        collectors["connections"] = update_connections
+    else:
+        collectors["connections"] = lambda: dict([(proto,
+            monitor.get_connection_table(proto)) for proto in CONNECTION_PROTOS])
+    for name, func in collectors.items():
+        if name not in intervals:
+            continue
+        lock = None
+        if name in ("counters", "interfaces"):
+            lock = monitor.snapshot_lock
+        scheduler.add(name, func, intervals[name], lock=lock)
+    return scheduler
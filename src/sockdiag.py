@@ -0,0 +1,167 @@
+#!/usr/bin/python
+"""net_monitor: sock_diag (inet_diag) backend for socket enumeration"""
+
+import socket
+import struct
+import array
+
+from net_monitor.netlink import NetlinkSocket, parse_attrs
+from net_monitor.connections import ConnectionTable, TCP_INFO_FIELDS
+
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+
+# request attributes
+INET_DIAG_REQ_BYTECODE = 1
+
+# reply attributes (and extensions to request)
+INET_DIAG_INFO = 2
+
+# bytecode operations
+INET_DIAG_BC_JMP = 1
+INET_DIAG_BC_S_GE = 2
+INET_DIAG_BC_S_LE = 3
+INET_DIAG_BC_D_GE = 4
+INET_DIAG_BC_D_LE = 5
+
+# all tcp states
+ALL_STATES = 0xfff
+
+# protocols supported by inet_diag
+PROTOCOLS = {"tcp": (socket.AF_INET, socket.IPPROTO_TCP),
+             "tcp6": (socket.AF_INET6, socket.IPPROTO_TCP),
+             "udp": (socket.AF_INET, socket.IPPROTO_UDP),
+             "udp6": (socket.AF_INET6, socket.IPPROTO_UDP),
+             }
+
+# struct inet_diag_req_v2, with an empty inet_diag_sockid
+inet_diag_req_v2 = struct.Struct("=BBBxI48x")
+# struct inet_diag_msg
+inet_diag_msg = struct.Struct("=BBBBHH16s16sI8sIIIII")
+# struct inet_diag_bc_op
+inet_diag_bc_op = struct.Struct("=BBH")
+# struct nlattr
+nlattr = struct.Struct("=HH")
+# struct tcp_info, up to tcpi_bytes_received (linux 4.1)
+tcp_info = struct.Struct("=8B24I4Q")
+# offsets of fields in tcp_info.unpack() result
+TCP_INFO_OFFSETS = {"retransmits": 2,
+                    "lost": 8 + 6,
+                    "rtt": 8 + 15,
+                    "rttvar": 8 + 16,
+                    "snd_cwnd": 8 + 18,
+                    "total_retrans": 8 + 23,
+                    "bytes_acked": 8 + 24 + 2,
+                    "bytes_received": 8 + 24 + 3,
+                    }
+
+def states_mask(states):
+    """Converts list of tcp states into idiag_states bitmask"""
+    if states is None:
+        return ALL_STATES
+    mask = 0
+    for state in states:
+        mask |= 1 << state
+    return mask
+
+def port_filter(local_ports=(), remote_ports=()):
+    """Builds inet_diag bytecode accepting sockets with any of local_ports
+    or remote_ports. Each port is matched by a >= and <= comparison; a JMP
+    after every match (except the last one) skips to the end, accepting
+    the socket."""
+    conditions = [(INET_DIAG_BC_S_GE, INET_DIAG_BC_S_LE, port) for port in local_ports] + \
+                 [(INET_DIAG_BC_D_GE, INET_DIAG_BC_D_LE, port) for port in remote_ports]
+    if not conditions:
+        return None
+    block = 2 * 2 * inet_diag_bc_op.size
+    jmp = inet_diag_bc_op.size
+    length = len(conditions) * (block + jmp) - jmp
+    code = []
+    for i, (ge, le, port) in enumerate(conditions):
+        offset = i * (block + jmp)
+        last = i == len(conditions) - 1
+        if last:
+            # jumping 4 bytes past the end rejects the socket
+            fail_ge = length - offset + 4
+            fail_le = length - offset - 8 + 4
+        else:
+            fail_ge = block + jmp
+            fail_le = block + jmp - 8
+        code.append(inet_diag_bc_op.pack(ge, 8, fail_ge))
+        code.append(inet_diag_bc_op.pack(0, 0, port))
+        code.append(inet_diag_bc_op.pack(le, 8, fail_le))
+        code.append(inet_diag_bc_op.pack(0, 0, port))
+        if not last:
+            code.append(inet_diag_bc_op.pack(INET_DIAG_BC_JMP, 4,
+                    length - offset - block))
+    return "".join(code)
+
+def build_request(family, protocol, states=None, local_ports=(), remote_ports=(),
+        info=True):
+    """Builds SOCK_DIAG_BY_FAMILY request payload"""
+    ext = 0
+    if info and protocol == socket.IPPROTO_TCP:
+        ext |= 1 << (INET_DIAG_INFO - 1)
+    payload = inet_diag_req_v2.pack(family, protocol, ext, states_mask(states))
+    bytecode = port_filter(local_ports, remote_ports)
+    if bytecode:
+        payload += nlattr.pack(nlattr.size + len(bytecode),
+                INET_DIAG_REQ_BYTECODE) + bytecode
+    return payload
+
+def parse_diag_msg(payload, table, words):
+    """Appends an inet_diag_msg to table"""
+    (family, state, timer, retrans, sport, dport, src, dst, iface, cookie,
+            expires, rqueue, wqueue, uid, inode) = inet_diag_msg.unpack_from(payload)
+    # addresses are kept in the same layout as the /proc tables
+    table.local_addr.extend(struct.unpack_from("=%dI" % words, src))
+    table.remote_addr.extend(struct.unpack_from("=%dI" % words, dst))
+    table.local_port.append(socket.ntohs(sport))
+    table.remote_port.append(socket.ntohs(dport))
+    table.state.append(state)
+    table.tx_queue.append(wqueue)
+    table.rx_queue.append(rqueue)
+    table.uid.append(uid)
+    table.inode.append(inode)
+    if table.tcp_info is None:
+        return
+    attrs = parse_attrs(payload, inet_diag_msg.size)
+    data = attrs.get(INET_DIAG_INFO, "")
+    if len(data) < tcp_info.size:
+        # older kernels: pad missing fields with zeros
+        data = data + "\0" * (tcp_info.size - len(data))
+    values = tcp_info.unpack_from(data)
+    for name, typecode in TCP_INFO_FIELDS:
+        table.tcp_info[name].append(values[TCP_INFO_OFFSETS[name]])
+
+def parse_diag_dump(messages, proto, state_names=None, info=True):
+    """Converts SOCK_DIAG_BY_FAMILY replies into a ConnectionTable"""
+    table = ConnectionTable(proto, state_names)
+    if info and PROTOCOLS[proto][1] == socket.IPPROTO_TCP:
+        table.tcp_info = {}
+        for name, typecode in TCP_INFO_FIELDS:
+            table.tcp_info[name] = array.array(typecode)
+    for msg_type, payload in messages:
+        if msg_type == SOCK_DIAG_BY_FAMILY:
+            parse_diag_msg(payload, table, table.addr_words)
+    return table
+
+
+class SockDiag:
+    """Enumerates sockets with NETLINK_SOCK_DIAG, filtering in kernel"""
+
+    def __init__(self):
+        self.nl = NetlinkSocket(NETLINK_SOCK_DIAG)
+
+    def close(self):
+        self.nl.close()
+
+    def connections(self, proto="tcp", states=None, local_ports=(),
+            remote_ports=(), info=True, state_names=None):
+        """Returns ConnectionTable with sockets of proto in states (a list
+        of tcp states, or None for all), on any of local or remote ports"""
+        family, protocol = PROTOCOLS[proto]
+        replies = self.nl.request(SOCK_DIAG_BY_FAMILY,
+                build_request(family, protocol, states, local_ports,
+                    remote_ports, info))
+        return parse_diag_dump(replies, proto, state_names, info)
@@ -0,0 +1,166 @@
+#!/usr/bin/python
+"""net_monitor: incremental network uptime log reader"""
+
+import os
+import time
+import threading
+from collections import deque
+
+from net_monitor.rates import monotonic
+
+# events kept per device, for availability statistics
+HISTORY_SIZE = 1000
+
+# minimum time between checks for new log lines, in seconds
+CHECK_INTERVAL = 1.0
+
+# log is read in chunks of this size
+CHUNK_SIZE = 1024 * 1024
+
+class DeviceUptime:
+    """Latest state and a bounded event history of a device"""
+
+    def __init__(self, history=HISTORY_SIZE):
+        self.last_up = 0
+        self.last_down = 0
+        # (secs, status), oldest first
+        self.events = deque(maxlen=history)
+
+    def add(self, secs, status):
+        if status == "UP":
+            self.last_up = secs
+        elif status == "DOWN":
+            self.last_down = secs
+        self.events.append((secs, status))
+
+    def uptime(self):
+        """Returns time the device went up, 0 if it is down and -1 if
+        unknown"""
+        if not self.last_up:
+            return -1
+        if self.last_down > self.last_up:
+            return 0
+        return self.last_up
+
+    def availability(self, window=3600, now=None):
+        """Returns (number of flaps, downtime in seconds) over the last window
+        seconds. Only events kept in history are accounted."""
+        if now is None:
+            now = time.time()
+        start = now - window
+        down_since = None
+        flaps = 0
+        downtime = 0
+        for secs, status in self.events:
+            if secs < start:
+                # state at the beginning of window
+                if status == "DOWN":
+                    down_since = start
+                else:
+                    down_since = None
+                continue
+            if status == "DOWN" and down_since is None:
+                down_since = secs
+                flaps += 1
+            elif status == "UP" and down_since is not None:
+                downtime += secs - down_since
+                down_since = None
+        if down_since is not None:
+            downtime += now - down_since
+        return flaps, downtime
+
+
+class UptimeLog:
+    """Network uptime log, read incrementally: each update() reads only the
+    lines appended since the previous one. A rotated (replaced or
+    truncated) log is read again from its beginning, keeping known states."""
+
+    def __init__(self, path, history=HISTORY_SIZE):
+        self.path = path
+        self.history = history
+        self.devices = {}
+        self.inode = None
+        self.offset = 0
+        # incomplete last line
+        self.partial = ""
+        self.checked = None
+        # increased on every recorded event
+        self.version = 0
+        # held while the log is read or an event recorded
+        self.lock = threading.RLock()
+
+    def __contains__(self, dev):
+        return dev in self.devices
+
+    def get(self, dev):
+        """Returns DeviceUptime of dev, or None"""
+        return self.devices.get(dev)
+
+    def add(self, dev, status, secs):
+        """Records device going UP or DOWN"""
+        with self.lock:
+            if dev not in self.devices:
+                self.devices[dev] = DeviceUptime(self.history)
+            self.devices[dev].add(secs, status)
+            self.version += 1
+
+    def parse(self, line):
+        """Parses a 'dev:STATUS:secs' line"""
+        try:
+            dev, status, secs = line.strip().split(":")
+            secs = int(secs)
+        except ValueError:
+            return
+        self.add(dev, status, secs)
+
+    def update(self, force=True):
+        """Reads new lines from the log. Unless forced, the log is checked
+        at most once every CHECK_INTERVAL. Returns True if lines were read."""
+        with self.lock:
+            now = monotonic()
+            if not force and self.checked is not None and now - self.checked < CHECK_INTERVAL:
+                return False
+            self.checked = now
+            try:
+                st = os.stat(self.path)
+            except OSError:
+                # no log file
+                return False
+            if st.st_ino != self.inode or st.st_size < self.offset:
+                # log was rotated
+                self.inode = st.st_ino
+                self.offset = 0
+                self.partial = ""
+            if st.st_size == self.offset:
+                return False
+            with open(self.path) as fd:
+                fd.seek(self.offset)
+                while True:
+                    data = fd.read(CHUNK_SIZE)
+                    if not data:
+                        break
+                    self.offset += len(data)
+                    lines = (self.partial + data).split("\n")
+                    self.partial = lines.pop()
+                    for line in lines:
+                        self.parse(line)
+            return True
+
+    def uptime(self, dev):
+        """Returns time dev went up, 0 if it is down and -1 if unknown"""
+        if dev not in self.devices:
+            return -1
+        return self.devices[dev].uptime()
+
+    def availability(self, dev, window=3600, now=None):
+        """Returns {flaps, flaps_per_hour, downtime, availability} of dev
+        over the last window seconds, or None for unknown devices"""
+        if dev not in self.devices:
+            return None
+        with self.lock:
+            flaps, downtime = self.devices[dev].availability(window, now)
+        return {"flaps": flaps,
+                "flaps_per_hour": flaps * 3600.0 / window,
+                "downtime": downtime,
+                "availability": 100.0 * (window - min(downtime, window)) / window,
+                }
@@ -0,0 +1,180 @@
+#!/usr/bin/python
+"""net_monitor: vnstat database reader.
+
+Supports the sqlite database of vnstat 2.x (vnstat.db) and the binary
+per-interface files of vnstat 1.x. Data is read lazily, when an interface
+is requested, and cached until the database file changes.
+"""
+
+import os
+import re
+import time
+import struct
+import traceback
+from collections import namedtuple
+
+try:
+    import sqlite3
+except ImportError:
+    # python built without sqlite: only legacy databases are supported
+    sqlite3 = None
+
+from net_monitor.cache import file_token
+
+VNSTAT_DIR = "/var/lib/vnstat"
+VNSTAT_DB = "vnstat.db"
+
+# vnstat 1.x database version
+LEGACY_VERSION = 3
+
+# struct DATA of vnstat 1.x (native layout): version, interface, nick,
+# active, totalrx, totaltx, currx, curtx, totalrxk, totaltxk, lastupdated,
+# created, day[30], month[12], top10[10], hour[24], btime
+LEGACY_DAYS = 30
+LEGACY_MONTHS = 12
+LEGACY_TOP = 10
+LEGACY_HOURS = 24
+legacy_data = struct.Struct("@i32s32siQQQQiill" + "lQQiii" * (LEGACY_DAYS +
+        LEGACY_MONTHS + LEGACY_TOP) + "lQQ" * LEGACY_HOURS + "Q")
+
+MIB = 1024 * 1024
+KIB = 1024
+
+# traffic of a period: start time (unix time), received and sent bytes
+Traffic = namedtuple("Traffic", "date rx tx")
+
+class Accounting(namedtuple("Accounting",
+        "name created updated rx tx hours days months")):
+    """Traffic totals of an interface, with hourly, daily and monthly
+    Traffic lists (oldest first)"""
+    __slots__ = ()
+
+
+def parse_date(text):
+    """Converts a vnstat 2.x date ('YYYY-MM-DD[ HH:MM[:SS]]', local time)
+    into unix time"""
+    fields = [int(x) for x in re.findall(r"\d+", text)][:6]
+    fields += [1, 1, 0, 0, 0][len(fields) - 1:]
+    return int(time.mktime(tuple(fields[:6]) + (0, 0, -1)))
+
+def parse_legacy(data):
+    """Parses a vnstat 1.x database file into Accounting"""
+    if len(data) < legacy_data.size:
+        return None
+    values = legacy_data.unpack_from(data)
+    if values[0] != LEGACY_VERSION:
+        return None
+    (version, name, nick, active, totalrx, totaltx, currx, curtx, totalrxk,
+            totaltxk, updated, created) = values[:12]
+    pos = 12
+    periods = []
+    for count in [LEGACY_DAYS, LEGACY_MONTHS, LEGACY_TOP]:
+        entries = []
+        for i in range(count):
+            date, rx, tx, rxk, txk, used = values[pos:pos + 6]
+            pos += 6
+            if used:
+                entries.append(Traffic(date, rx * MIB + rxk * KIB, tx * MIB + txk * KIB))
+        entries.sort()
+        periods.append(entries)
+    days, months, top = periods
+    hours = []
+    for i in range(LEGACY_HOURS):
+        date, rx, tx = values[pos:pos + 3]
+        pos += 3
+        if date:
+            hours.append(Traffic(date, rx * KIB, tx * KIB))
+    hours.sort()
+    return Accounting(name.rstrip("\0"), created, updated,
+            totalrx * MIB + totalrxk * KIB, totaltx * MIB + totaltxk * KIB,
+            hours, days, months)
+
+
+class VnstatReader:
+    """Reads vnstat databases from a directory"""
+
+    def __init__(self, path=VNSTAT_DIR):
+        self.path = path
+        self.db = os.path.join(path, VNSTAT_DB)
+        # (file, iface) -> (token, data)
+        self.cache = {}
+
+    def cached(self, path, iface, func):
+        """Returns func() result, cached until path changes"""
+        token = file_token(path)
+        if path == self.db:
+            # changes may be pending in the write-ahead log
+            token = (token, file_token(path + "-wal"))
+        key = (path, iface)
+        if key in self.cache and self.cache[key][0] == token:
+            return self.cache[key][1]
+        data = None
+        if token is not None:
+            try:
+                data = func()
+            except:
+                traceback.print_exc()
+        self.cache[key] = (token, data)
+        return data
+
+    def has_db(self):
+        return sqlite3 is not None and os.path.exists(self.db)
+
+    def connect(self):
+        return sqlite3.connect(self.db)
+
+    def db_interfaces(self):
+        """Returns interfaces in vnstat.db"""
+        conn = self.connect()
+        try:
+            return [row[0] for row in conn.execute("SELECT name FROM interface")]
+        finally:
+            conn.close()
+
+    def db_accounting(self, iface):
+        """Reads data of iface from vnstat.db"""
+        conn = self.connect()
+        try:
+            row = conn.execute("SELECT id, created, updated, rxtotal, txtotal "
+                    "FROM interface WHERE name = ?", (iface,)).fetchone()
+            if row is None:
+                return None
+            iface_id, created, updated, rx, tx = row
+            periods = []
+            for table in ["hour", "day", "month"]:
+                periods.append([Traffic(parse_date(row[0]), row[1], row[2]) for row in
+                    conn.execute("SELECT date, rx, tx FROM %s WHERE interface = ? "
+                        "ORDER BY date" % table, (iface_id,))])
+        finally:
+            conn.close()
+        hours, days, months = periods
+        return Accounting(iface, parse_date(created), parse_date(updated), rx, tx,
+                hours, days, months)
+
+    def legacy_accounting(self, iface):
+        """Reads a vnstat 1.x database file"""
+        with open(os.path.join(self.path, iface), "rb") as fd:
+            return parse_legacy(fd.read())
+
+    def interfaces(self):
+        """Returns interfaces with network accounting"""
+        if self.has_db():
+            return self.cached(self.db, None, self.db_interfaces) or []
+        try:
+            return [name for name in os.listdir(self.path)
+                    if not name.startswith(".") and not name.endswith(".db")]
+        except OSError:
+            return []
+
+    def has(self, iface):
+        """Checks if network accounting is enabled for iface"""
+        if self.has_db():
+            return iface in self.interfaces()
+        return os.path.exists(os.path.join(self.path, iface))
+
+    def get(self, iface):
+        """Returns Accounting of iface, or None"""
+        if self.has_db():
+            return self.cached(self.db, iface, lambda: self.db_accounting(iface))
+        return self.cached(os.path.join(self.path, iface), iface,
+                lambda: self.legacy_accounting(iface))
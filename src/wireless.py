@@ -0,0 +1,172 @@
+#!/usr/bin/python
+"""net_monitor: wireless extensions queries.
+
+Parameters of wireless interfaces are read with SIOCGIW* ioctls, issued
+from Python on a single socket with preallocated request buffers.
+"""
+
+import fcntl
+import socket
+import struct
+import threading
+from array import array
+
+# wireless extensions ioctls
+SIOCGIWMODE = 0x8B07    # get operation mode
+SIOCGIWRANGE = 0x8B0B   # get range of parameters
+SIOCGIWSTATS = 0x8B0F   # get wireless statistics
+SIOCGIWAP = 0x8B15      # get access point address
+SIOCGIWESSID = 0x8B1B   # get essid
+SIOCGIWRATE = 0x8B21    # get default bit rate
+
+IFNAMSIZ = 16
+IW_ESSID_MAX_SIZE = 32
+
+# struct iwreq: interface name followed by a 16 bytes union
+IWREQ_SIZE = 32
+# struct iw_point, used by requests returning variable length data
+iw_point = struct.Struct("@PHH")
+
+# struct iw_range is 568 bytes on current kernels, and grows at its end
+IW_RANGE_SIZE = 1024
+# offsets of max_qual and we_version_compiled in struct iw_range (WE-16+)
+IW_RANGE_MAX_QUAL = 44
+IW_RANGE_WE_VERSION = 280
+# offset of max_qual in struct iw15_range (WE-9 to WE-15)
+IW15_RANGE_MAX_QUAL = 148
+# older drivers return shorter ranges
+IW15_RANGE_MIN_SIZE = 300
+
+# struct iw_statistics: status, then qual, level, noise, updated
+IW_STATS_SIZE = 32
+iw_quality = struct.Struct("=xxBBBB")
+IW_QUAL_DBM = 0x08
+IW_QUAL_LEVEL_INVALID = 0x20
+IW_QUAL_NOISE_INVALID = 0x40
+
+# wireless modes
+MODES = ['Auto', 'Ad-Hoc', 'Managed', 'Master', 'Repeat', 'Second', 'Monitor']
+
+# parameters returned by WirelessQuery.query()
+WIRELESS_PARAMETERS = ["max_quality", "ap", "essid", "mode", "bitrate", "signal", "noise"]
+
+def format_ap(address):
+    """Formats an access point address, as iwconfig does"""
+    if address == "\0" * 6:
+        return "Not-Associated"
+    elif address == "\xff" * 6:
+        return "Invalid"
+    elif address == "\x44" * 6:
+        # reported by Orinoco/PrismII chipsets
+        return "None"
+    return ":".join(["%02X" % ord(x) for x in address])
+
+def dbm(value):
+    """Converts a level in dBm, stored in an unsigned byte"""
+    if value >= 64:
+        return value - 0x100
+    return value
+
+
+class WirelessQuery:
+    """Queries wireless parameters of interfaces. Failed or unsupported
+    queries return None."""
+
+    def __init__(self, sock=None):
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock = sock
+        # request and data buffers, reused by all queries
+        self.req = array('c', '\0' * IWREQ_SIZE)
+        self.range = array('c', '\0' * IW_RANGE_SIZE)
+        self.essid_buf = array('c', '\0' * (IW_ESSID_MAX_SIZE + 1))
+        self.stats_buf = array('c', '\0' * IW_STATS_SIZE)
+        # held by query(), as the buffers are shared
+        self.lock = threading.Lock()
+
+    def ioctl(self, iface, request, buf=None, flags=0):
+        """Runs a request on iface, filling self.req. When buf is given, it
+        receives the request data. Returns True on success."""
+        req = self.req
+        struct.pack_into("16s16x", req, 0, iface[:IFNAMSIZ - 1])
+        if buf is not None:
+            addr, length = buf.buffer_info()
+            iw_point.pack_into(req, IFNAMSIZ, addr, length, flags)
+        try:
+            fcntl.ioctl(self.sock.fileno(), request, req, True)
+        except IOError:
+            return False
+        return True
+
+    def data_length(self):
+        """Returns length of data returned by the last request"""
+        return iw_point.unpack_from(self.req, IFNAMSIZ)[1]
+
+    def max_quality(self, iface):
+        """Returns maximum link quality"""
+        buf = self.range
+        struct.pack_into("%dx" % IW_RANGE_SIZE, buf, 0)
+        if not self.ioctl(iface, SIOCGIWRANGE, buf):
+            return None
+        if self.data_length() >= IW15_RANGE_MIN_SIZE and \
+                ord(buf[IW_RANGE_WE_VERSION]) > 15:
+            return ord(buf[IW_RANGE_MAX_QUAL])
+        return ord(buf[IW15_RANGE_MAX_QUAL])
+
+    def ap(self, iface):
+        """Returns access point address"""
+        if not self.ioctl(iface, SIOCGIWAP):
+            return None
+        # struct sockaddr: family, then address
+        return format_ap(self.req[IFNAMSIZ + 2:IFNAMSIZ + 8].tostring())
+
+    def essid(self, iface):
+        """Returns network essid"""
+        buf = self.essid_buf
+        struct.pack_into("%dx" % len(buf), buf, 0)
+        if not self.ioctl(iface, SIOCGIWESSID, buf):
+            return None
+        return buf.tostring()[:self.data_length()].strip('\0')
+
+    def mode(self, iface):
+        """Returns operation mode"""
+        if not self.ioctl(iface, SIOCGIWMODE):
+            return None
+        mode = struct.unpack_from("I", self.req, IFNAMSIZ)[0]
+        if mode >= len(MODES):
+            return None
+        return MODES[mode]
+
+    def bitrate(self, iface):
+        """Returns bit rate, in bits per second"""
+        # Note: KILO is not 2^10 in wireless tools world
+        if not self.ioctl(iface, SIOCGIWRATE):
+            return None
+        return struct.unpack_from("i", self.req, IFNAMSIZ)[0]
+
+    def levels(self, iface):
+        """Returns (signal, noise) levels, in dBm when the driver reports
+        them so"""
+        if not self.ioctl(iface, SIOCGIWSTATS, self.stats_buf, flags=1):
+            return None, None
+        qual, level, noise, updated = iw_quality.unpack_from(self.stats_buf)
+        if updated & IW_QUAL_DBM:
+            level, noise = dbm(level), dbm(noise)
+        if updated & IW_QUAL_LEVEL_INVALID:
+            level = None
+        if updated & IW_QUAL_NOISE_INVALID:
+            noise = None
+        return level, noise
+
+    def query(self, iface, parameters=WIRELESS_PARAMETERS):
+        """Returns {parameter: value} of interface parameters (see
+        WIRELESS_PARAMETERS), in a single pass"""
+        result = {}
+        with self.lock:
+            for name in parameters:
+                if name in ("signal", "noise"):
+                    if "signal" not in result:
+                        result["signal"], result["noise"] = self.levels(iface)
+                else:
+                    result[name] = getattr(self, name)(iface)
+        return result
@@ -0,0 +1,170 @@
+#!/usr/bin/python
+"""Records netlink dumps of this host into tests/fixtures. Each dump is
+requested on a fresh socket, so it replies to sequence number 1.
+
+The sock_diag dump is taken with a port filter over a listening socket
+on 127.0.0.1:47100 and a connection to it from port 47101, after 1000
+bytes were sent to the listener and 500 bytes back.
+
+The nl80211 station dump is synthesized, as hosts recording fixtures seldom
+have a wireless interface: attributes are laid out as nl80211_send_station()
+does, for a VHT access point with 64-bit byte counters and an older 802.11g
+one reporting legacy rates only.
+
+Usage: record_fixtures.py
+"""
+
+import os
+import struct
+import socket
+
+from net_monitor import netlink
+from net_monitor.netlink import NetlinkSocket, NetlinkError
+from net_monitor.sockdiag import (NETLINK_SOCK_DIAG, SOCK_DIAG_BY_FAMILY,
+        build_request)
+from net_monitor import nl80211
+from net_monitor.nl80211 import pack_attr, genlmsghdr
+
+from replay import FIXTURES, pack_datagrams
+
+LISTEN_PORT = 47100
+CLIENT_PORT = 47101
+
+# family id of nl80211 (allocated at runtime), and interface of the
+# synthesized station dump
+NL80211_FAMILY = 0x1c
+STATION_IFINDEX = 3
+NL80211_CMD_NEW_STATION = 19
+NL80211_ATTR_GENERATION = 46
+NL80211_RATE_INFO_VHT_NSS = 7
+NLA_F_NESTED = 0x8000
+
+class RecordingSock:
+    """Socket wrapper keeping what was sent and received"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.datagrams = []
+
+    def send(self, data):
+        self.datagrams.append(data)
+        return self.sock.send(data)
+
+    def recv(self, size):
+        data = self.sock.recv(size)
+        self.datagrams.append(data)
+        return data
+
+def record(name, protocol, msg_type, payload, flags=netlink.NLM_F_REQUEST | netlink.NLM_F_DUMP):
+    nl = NetlinkSocket(protocol)
+    nl.sock = RecordingSock(nl.sock)
+    try:
+        nl.request(msg_type, payload, flags)
+    except NetlinkError:
+        pass
+    with open(os.path.join(FIXTURES, name), "wb") as fd:
+        fd.write(pack_datagrams(nl.sock.datagrams))
+    nl.sock.sock.close()
+
+def station_message(mac, info):
+    """NL80211_CMD_NEW_STATION message of a dump"""
+    payload = (genlmsghdr.pack(NL80211_CMD_NEW_STATION, 1, 0) +
+            pack_attr(nl80211.NL80211_ATTR_IFINDEX, struct.pack("=I", STATION_IFINDEX)) +
+            pack_attr(nl80211.NL80211_ATTR_MAC, mac) +
+            pack_attr(NL80211_ATTR_GENERATION, struct.pack("=I", 7)) +
+            pack_attr(nl80211.NL80211_ATTR_STA_INFO, "".join(info)))
+    return netlink.nlmsghdr.pack(netlink.nlmsghdr.size + len(payload), NL80211_FAMILY,
+            netlink.NLM_F_MULTI, 1, 0) + payload
+
+def station_dump():
+    """Returns datagrams of a synthesized NL80211_CMD_GET_STATION dump"""
+    u8 = lambda attr, value: pack_attr(attr, struct.pack("=B", value & 0xff))
+    u16 = lambda attr, value: pack_attr(attr, struct.pack("=H", value))
+    u32 = lambda attr, value: pack_attr(attr, struct.pack("=I", value & 0xffffffff))
+    u64 = lambda attr, value: pack_attr(attr, struct.pack("=Q", value))
+    payload = (genlmsghdr.pack(nl80211.NL80211_CMD_GET_STATION, 0, 0) +
+            pack_attr(nl80211.NL80211_ATTR_IFINDEX, struct.pack("=I", STATION_IFINDEX)))
+    request = netlink.nlmsghdr.pack(netlink.nlmsghdr.size + len(payload), NL80211_FAMILY,
+            netlink.NLM_F_REQUEST | netlink.NLM_F_DUMP, 1, 0) + payload
+    # 32-bit byte counters are sent truncated next to the 64-bit ones
+    vht = station_message("\x02\x00\x00\x00\x01\x01", [
+            u32(nl80211.NL80211_STA_INFO_CONNECTED_TIME, 3600),
+            u32(nl80211.NL80211_STA_INFO_INACTIVE_TIME, 40),
+            u32(nl80211.NL80211_STA_INFO_RX_BYTES, 5 * 2**30 + 123),
+            u64(nl80211.NL80211_STA_INFO_RX_BYTES64, 5 * 2**30 + 123),
+            u32(nl80211.NL80211_STA_INFO_TX_BYTES, 2**31 + 77),
+            u64(nl80211.NL80211_STA_INFO_TX_BYTES64, 2**31 + 77),
+            u32(nl80211.NL80211_STA_INFO_BEACON_LOSS, 3),
+            u8(nl80211.NL80211_STA_INFO_SIGNAL, -52),
+            u8(nl80211.NL80211_STA_INFO_SIGNAL_AVG, -54),
+            pack_attr(nl80211.NL80211_STA_INFO_TX_BITRATE,
+                u16(nl80211.NL80211_RATE_INFO_BITRATE, 8667) +
+                u32(nl80211.NL80211_RATE_INFO_BITRATE32, 8667) +
+                u8(nl80211.NL80211_RATE_INFO_VHT_MCS, 9) +
+                u8(NL80211_RATE_INFO_VHT_NSS, 2)),
+            pack_attr(nl80211.NL80211_STA_INFO_RX_BITRATE | NLA_F_NESTED,
+                u16(nl80211.NL80211_RATE_INFO_BITRATE, 6500) +
+                u32(nl80211.NL80211_RATE_INFO_BITRATE32, 6500) +
+                u8(nl80211.NL80211_RATE_INFO_MCS, 7)),
+            u32(nl80211.NL80211_STA_INFO_RX_PACKETS, 4000000),
+            u32(nl80211.NL80211_STA_INFO_TX_PACKETS, 1500000),
+            u32(nl80211.NL80211_STA_INFO_TX_RETRIES, 2000),
+            u32(nl80211.NL80211_STA_INFO_TX_FAILED, 12),
+            ])
+    legacy = station_message("\x02\x00\x00\x00\x01\x02", [
+            u32(nl80211.NL80211_STA_INFO_INACTIVE_TIME, 1000),
+            u32(nl80211.NL80211_STA_INFO_RX_BYTES, 1000),
+            u32(nl80211.NL80211_STA_INFO_TX_BYTES, 2000),
+            u8(nl80211.NL80211_STA_INFO_SIGNAL, -80),
+            pack_attr(nl80211.NL80211_STA_INFO_TX_BITRATE,
+                u16(nl80211.NL80211_RATE_INFO_BITRATE, 540)),
+            u32(nl80211.NL80211_STA_INFO_RX_PACKETS, 10),
+            u32(nl80211.NL80211_STA_INFO_TX_PACKETS, 20),
+            ])
+    done = netlink.nlmsghdr.pack(netlink.nlmsghdr.size + 4, netlink.NLMSG_DONE,
+            netlink.NLM_F_MULTI, 1, 0) + struct.pack("=i", 0)
+    return [request, vht + legacy, done]
+
+def connection():
+    """Returns (listener, client, server) sockets, after a short exchange"""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", LISTEN_PORT))
+    listener.listen(1)
+    client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    client.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    client.bind(("127.0.0.1", CLIENT_PORT))
+    client.connect(("127.0.0.1", LISTEN_PORT))
+    server, addr = listener.accept()
+    client.sendall("x" * 1000)
+    received = 0
+    while received < 1000:
+        received += len(server.recv(1000))
+    server.sendall("y" * 500)
+    received = 0
+    while received < 500:
+        received += len(client.recv(500))
+    return listener, client, server
+
+def main():
+    record("rtm_getlink.bin", netlink.NETLINK_ROUTE, netlink.RTM_GETLINK,
+            netlink.ifinfomsg.pack(socket.AF_UNSPEC, 0, 0, 0, 0))
+    record("rtm_getaddr.bin", netlink.NETLINK_ROUTE, netlink.RTM_GETADDR,
+            netlink.ifaddrmsg.pack(socket.AF_UNSPEC, 0, 0, 0, 0))
+    record("rtm_getroute.bin", netlink.NETLINK_ROUTE, netlink.RTM_GETROUTE,
+            netlink.rtmsg.pack(socket.AF_INET, 0, 0, 0, 0, 0, 0, 0, 0))
+    # not a dump: the kernel replies with ENODEV
+    record("rtm_getlink_enodev.bin", netlink.NETLINK_ROUTE, netlink.RTM_GETLINK,
+            netlink.ifinfomsg.pack(socket.AF_UNSPEC, 0, 0x7fff, 0, 0),
+            netlink.NLM_F_REQUEST)
+    sockets = connection()
+    record("sock_diag_tcp.bin", NETLINK_SOCK_DIAG, SOCK_DIAG_BY_FAMILY,
+            build_request(socket.AF_INET, socket.IPPROTO_TCP, None,
+                [LISTEN_PORT, CLIENT_PORT]))
+    for sock in sockets:
+        sock.close()
+    with open(os.path.join(FIXTURES, "nl80211_get_station.bin"), "wb") as fd:
+        fd.write(pack_datagrams(station_dump()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Replays recorded netlink datagrams in place of a kernel socket.
+
+Fixtures are written by record_fixtures.py: the request sent, followed by
+every datagram received in reply, each prefixed by its length."""
+
+import os
+import struct
+import threading
+
+from net_monitor.netlink import NetlinkSocket
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+length = struct.Struct("=I")
+
+def pack_datagrams(datagrams):
+    """Joins datagrams into a fixture"""
+    return "".join([length.pack(len(data)) + data for data in datagrams])
+
+def load(name):
+    """Returns (request, [datagram]) of a fixture"""
+    with open(os.path.join(FIXTURES, name), "rb") as fd:
+        data = fd.read()
+    datagrams = []
+    pos = 0
+    while pos < len(data):
+        size = length.unpack_from(data, pos)[0]
+        pos += length.size
+        datagrams.append(data[pos:pos + size])
+        pos += size
+    return datagrams[0], datagrams[1:]
+
+
+class ReplaySock:
+    """Socket returning canned datagrams, and keeping what was sent"""
+
+    def __init__(self, datagrams):
+        self.datagrams = list(datagrams)
+        self.sent = []
+
+    def send(self, data):
+        self.sent.append(data)
+        return len(data)
+
+    def recv(self, size):
+        if not self.datagrams:
+            raise AssertionError("read past the recorded replies")
+        return self.datagrams.pop(0)[:size]
+
+    def close(self):
+        pass
+
+
+class ReplaySocket(NetlinkSocket):
+    """NetlinkSocket replaying datagrams; seq starts over as on a fresh
+    socket, so recorded replies to the first request match it"""
+
+    def __init__(self, datagrams):
+        self.sock = ReplaySock(datagrams)
+        self.seq = 0
+        self.lock = threading.Lock()
@@ -0,0 +1,112 @@
+"""Tests of incremental connection aggregation"""
+
+import random
+import unittest
+
+from net_monitor.aggregate import CountIndex, ConnectionAggregator
+from net_monitor.connections import ConnectionTable, TCP_ESTABLISHED, TCP_LISTEN
+
+def make_table(connections):
+    """ConnectionTable of tcp [(local port, remote addr, remote port, state,
+    inode)]"""
+    table = ConnectionTable("tcp")
+    for local_port, remote_addr, remote_port, state, inode in connections:
+        table.local_addr.append(0x0100007f)
+        table.local_port.append(local_port)
+        table.remote_addr.append(remote_addr)
+        table.remote_port.append(remote_port)
+        table.state.append(state)
+        table.inode.append(inode)
+    return table
+
+
+class Processes:
+    """Stand-in for ProcessMap: every socket is owned by process 100"""
+
+    def lookup(self, inodes):
+        return dict([(inode, 100) for inode in inodes])
+
+    def forget(self, inodes):
+        pass
+
+
+class CountIndexTest(unittest.TestCase):
+
+    def test_top(self):
+        index = CountIndex()
+        index.add("a", 3)
+        index.add("b", 5)
+        index.add("c", 3)
+        self.assertEqual(index.top(), [("b", 5), ("a", 3), ("c", 3)])
+        index.add("b", -4)
+        index.add("a", -1)
+        index.add("a", 1)
+        self.assertEqual(index.top(2), [("a", 3), ("c", 3)])
+        index.add("c", -3)
+        self.assertEqual(index.top(), [("a", 3), ("b", 1)])
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.get("c"), 0)
+
+    def test_random(self):
+        random.seed(1)
+        index = CountIndex()
+        counts = {}
+        for i in range(20000):
+            key = random.randrange(200)
+            delta = random.choice([1, 1, -1, 2, -3])
+            index.add(key, delta)
+            counts[key] = max(counts.get(key, 0) + delta, 0)
+            if i % 97 == 0:
+                expected = sorted([(-value, key) for key, value in counts.items() if value])
+                self.assertEqual(index.top(15), [(key, -value) for value, key in expected[:15]])
+        # outdated entries do not pile up
+        self.assertTrue(len(index.heap) <= 2 * len(index) + 64)
+
+
+class ConnectionAggregatorTest(unittest.TestCase):
+
+    def aggregator(self):
+        aggregator = ConnectionAggregator(None, ["tcp"], processes=False)
+        aggregator.processes = Processes()
+        return aggregator
+
+    def test_listening_ports(self):
+        aggregator = self.aggregator()
+        connections = [(80, 0, 0, TCP_LISTEN, 1),
+                       (22, 0, 0, TCP_LISTEN, 2),
+                       (80, 10, 5001, TCP_ESTABLISHED, 3),
+                       (80, 11, 5002, TCP_ESTABLISHED, 4),
+                       (22, 10, 5003, TCP_ESTABLISHED, 5),
+                       # outgoing connection
+                       (40000, 12, 443, TCP_ESTABLISHED, 6)]
+        aggregator.update({"tcp": make_table(connections)})
+        self.assertEqual(aggregator.top_listening_ports(),
+                [(("tcp", 80), 2), (("tcp", 22), 1)])
+        self.assertEqual(aggregator.top_local_ports(),
+                [(("tcp", 80), 2), (("tcp", 22), 1), (("tcp", 40000), 1)])
+        self.assertEqual(aggregator.top_processes(), [(100, 4)])
+        # port 22 stops listening, its connection stays
+        aggregator.update({"tcp": make_table(connections[:1] + connections[2:])})
+        self.assertEqual(aggregator.top_listening_ports(), [(("tcp", 80), 2)])
+        self.assertEqual(aggregator.top_local_ports()[1], (("tcp", 22), 1))
+        # and listens again
+        aggregator.update({"tcp": make_table(connections)})
+        self.assertEqual(aggregator.top_listening_ports(),
+                [(("tcp", 80), 2), (("tcp", 22), 1)])
+
+    def test_pids(self):
+        aggregator = self.aggregator()
+        connections = [(80, 0, 0, TCP_LISTEN, 1),
+                       (80, 10, 5001, TCP_ESTABLISHED, 2)]
+        aggregator.update({"tcp": make_table(connections)})
+        self.assertEqual(sorted(aggregator.pids.keys()), [1, 2])
+        # closed sockets are forgotten, listening ones included
+        aggregator.update({"tcp": make_table([])})
+        self.assertEqual(aggregator.pids, {})
+        self.assertEqual(aggregator.top_processes(), [])
+        self.assertEqual(aggregator.top_listening_ports(), [])
+        self.assertEqual(aggregator.state_counts(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,296 @@
+"""Tests of rule parsing and of bulk alert evaluation"""
+
+import math
+import random
+import unittest
+
+from net_monitor.alerts import AlertEngine, AnomalyDetector, parse_rule, \
+        EVENT_FIRING, EVENT_RESOLVED
+from net_monitor.rates import RateEngine, CounterRates, COUNTERS
+from net_monitor.monitor import Snapshot, InterfaceSnapshot
+from net_monitor.procfs import DEV_INDEX, COUNTER_TYPECODE
+
+RULES = ["tx_busy rate:tx_bytes > 1100 clear 1000",
+         "tx_idle rate:tx_bytes < 900 clear 950 for 2",
+         "rx_busy rate:rx_bytes eth1* > 2200 for 3",
+         "rx_smoothed smoothed:rx_bytes > 2100 clear 2000",
+         "errors error_rate > 0.01 clear 0.001",
+         ]
+
+
+class Monitor:
+    """Stand-in for the Monitor parts used by AlertEngine: interfaces come
+    and go, with noisy counter rates"""
+
+    def __init__(self):
+        self.rates = RateEngine()
+        self.counters = {}
+        self.clock = 0.0
+
+    def snapshot(self, ifaces):
+        self.clock += 1.0
+        for iface in self.counters.keys():
+            if iface not in ifaces:
+                del self.counters[iface]
+                self.rates.remove(iface)
+        data = {}
+        for iface in ifaces:
+            counters = self.counters.setdefault(iface, [0] * COUNTERS)
+            counters[DEV_INDEX["rx_bytes"]] += int(random.gauss(2000, 150))
+            counters[DEV_INDEX["tx_bytes"]] += int(random.gauss(1000, 75))
+            counters[DEV_INDEX["rx_packets"]] += 100
+            counters[DEV_INDEX["tx_packets"]] += 50
+            if random.random() < 0.05:
+                counters[DEV_INDEX["rx_errors"]] += random.randint(1, 3)
+            data[iface] = InterfaceSnapshot(iface, True, "up", None, None, 0, 0,
+                    list(counters), False, 0, None, None, None, None, None, None, None)
+        snapshot = Snapshot(self.clock, self.clock, data)
+        self.rates.update(snapshot)
+        return snapshot
+
+
+class Reference:
+    """Rules evaluated one by one, as documented"""
+
+    def __init__(self, rules):
+        self.rules = rules
+        # (rule index, iface) -> [count, active]
+        self.states = {}
+
+    def value(self, rule, rates):
+        if rule.metric == "rate":
+            return rates.rates[rule.arg]
+        elif rule.metric == "smoothed":
+            return rates.smoothed[rule.arg]
+        values = rates.rates
+        packets = values[DEV_INDEX["rx_packets"]] + values[DEV_INDEX["tx_packets"]]
+        if not packets:
+            return 0.0
+        return (values[DEV_INDEX["rx_errors"]] + values[DEV_INDEX["tx_errors"]]) / packets
+
+    def update(self, monitor, snapshot):
+        events = []
+        ifaces = monitor.rates.ifaces
+        for (i, iface), state in self.states.items():
+            if iface not in ifaces:
+                if state[1]:
+                    events.append((EVENT_RESOLVED, self.rules[i].name, iface, None))
+                del self.states[(i, iface)]
+        for i, rule in enumerate(self.rules):
+            for iface, rates in ifaces.items():
+                if not rule.matches(iface):
+                    continue
+                state = self.states.setdefault((i, iface), [0, False])
+                value = self.value(rule, rates)
+                x = rule.sign * value
+                if state[1]:
+                    if x <= rule.clear:
+                        state[:] = [0, False]
+                        events.append((EVENT_RESOLVED, rule.name, iface, value))
+                elif x > rule.trigger:
+                    state[0] += 1
+                    if state[0] >= rule.samples:
+                        state[1] = True
+                        events.append((EVENT_FIRING, rule.name, iface, value))
+                else:
+                    state[0] = 0
+        return events
+
+
+class ReferenceDetector:
+    """Anomaly detection computing the z-score of every sample"""
+
+    def __init__(self, detector):
+        self.detector = detector
+        # iface -> [samples, [mean], [variance], [active]]
+        self.states = {}
+        self.clock = None
+
+    def update(self, rates, clock):
+        detector = self.detector
+        events = []
+        for iface in self.states.keys():
+            if iface not in rates.ifaces:
+                for name, active in zip(detector.names, self.states.pop(iface)[3]):
+                    if active:
+                        events.append((EVENT_RESOLVED, name, iface))
+        count = len(detector.columns)
+        for iface in rates.ifaces:
+            if iface not in self.states and detector.matches(iface):
+                self.states[iface] = [0, [0.0] * count, [0.0] * count, [False] * count]
+        if self.clock is None:
+            self.clock = clock
+            return events
+        alpha = 1.0 - math.exp(-(clock - self.clock) / detector.tau)
+        self.clock = clock
+        for iface, state in self.states.items():
+            counter_rates = rates.ifaces[iface]
+            if not counter_rates.valid:
+                continue
+            samples, means, variances, active = state
+            weight = max(alpha, 1.0 / (samples + 1))
+            for i, column in enumerate(detector.columns):
+                diff = counter_rates.rates[column] - means[i]
+                if samples >= detector.warmup:
+                    z = abs(diff) / math.sqrt(max(variances[i], detector.min_variance))
+                    if active[i]:
+                        if z < detector.clear:
+                            active[i] = False
+                            events.append((EVENT_RESOLVED, detector.names[i], iface))
+                    elif z > detector.threshold:
+                        active[i] = True
+                        events.append((EVENT_FIRING, detector.names[i], iface))
+                means[i] += weight * diff
+                variances[i] = (1.0 - weight) * (variances[i] + diff * weight * diff)
+            state[0] = samples + 1
+        return events
+
+
+def interfaces(tick):
+    """Interfaces present at a tick: some are removed and added back"""
+    names = ["eth%d" % i for i in range(20)] + ["wlan0"]
+    if tick % 15 >= 10:
+        names.remove("eth3")
+        names.remove("eth12")
+    if tick >= 30:
+        names.append("eth20")
+    return names
+
+
+class ParseRuleTest(unittest.TestCase):
+
+    def error(self, line):
+        try:
+            parse_rule(line)
+        except ValueError, e:
+            return str(e)
+        self.fail("no error on %r" % line)
+
+    def test_rule(self):
+        rule = parse_rule("tx_busy rate:tx_bytes eth* > 1000 clear 800 for 3")
+        self.assertEqual((rule.name, rule.metric, rule.arg, rule.iface),
+                ("tx_busy", "rate", DEV_INDEX["tx_bytes"], "eth*"))
+        self.assertEqual((rule.trigger, rule.clear, rule.samples), (1000, 800, 3))
+        rule = parse_rule("weak quality < 20")
+        self.assertEqual((rule.sign, rule.trigger, rule.iface), (-1, -20, "*"))
+
+    def test_errors(self):
+        self.assertEqual(self.error("x quality"), "invalid rule 'x quality': missing threshold")
+        self.assertEqual(self.error("x quality eth0"),
+                "invalid rule 'x quality eth0': missing threshold")
+        self.assertEqual(self.error("x"), "invalid rule 'x': missing metric")
+        self.assertEqual(self.error("x foo > 1"), "invalid rule 'x foo > 1': unknown metric: foo")
+        for line in ["x quality = 5", "x quality > 5 clear", "x quality > 5 every 2",
+                     "x quality > five", "x rate:foo > 5"]:
+            self.assertTrue(self.error(line).startswith("invalid rule '%s'" % line), line)
+
+
+class AlertEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(1)
+
+    def test_rules(self):
+        monitor = Monitor()
+        rules = [parse_rule(rule) for rule in RULES]
+        engine = AlertEngine(rules)
+        reference = Reference(rules)
+        changes = 0
+        for tick in range(60):
+            snapshot = monitor.snapshot(interfaces(tick))
+            events = engine.update(monitor, snapshot)
+            expected = reference.update(monitor, snapshot)
+            self.assertEqual(sorted([alert[:4] for alert in events]), sorted(expected), tick)
+            changes += len(events)
+        self.assertTrue(changes > 50, changes)
+        firing = [(alert.name, alert.iface) for alert in engine.active()]
+        self.assertEqual(sorted(firing), sorted([(rules[i].name, iface)
+                for (i, iface), state in reference.states.items() if state[1]]))
+
+    def test_anomalies(self):
+        monitor = Monitor()
+        detector = AnomalyDetector(tau=20.0, threshold=1.5, clear=1.0, warmup=5,
+                min_deviation=10.0, iface="eth1*")
+        engine = AlertEngine([], [detector])
+        reference = ReferenceDetector(detector)
+        changes = 0
+        for tick in range(60):
+            snapshot = monitor.snapshot(interfaces(tick))
+            events = engine.update(monitor, snapshot)
+            expected = reference.update(monitor.rates, snapshot.clock)
+            self.assertEqual(sorted([alert[:3] for alert in events]), sorted(expected), tick)
+            changes += len(events)
+        self.assertTrue(changes > 20, changes)
+
+    def test_unknown_quality(self):
+        monitor = Monitor()
+        engine = AlertEngine([parse_rule("weak quality < 20")])
+        for tick in range(3):
+            snapshot = monitor.snapshot(["wlan0", "wlan1"])
+            ifaces = snapshot.ifaces
+            # maximum quality of wlan0 could not be queried
+            ifaces["wlan0"] = ifaces["wlan0"]._replace(wireless=True, link=5,
+                    max_quality="Unknown")
+            ifaces["wlan1"] = ifaces["wlan1"]._replace(wireless=True, link=7, max_quality=70)
+            engine.update(monitor, snapshot)
+        self.assertEqual([(alert.name, alert.iface) for alert in engine.active()],
+                [("weak", "wlan1")])
+
+
+class RateEngineTest(unittest.TestCase):
+
+    def test_tables(self):
+        random.seed(2)
+        monitor = Monitor()
+        for tick in range(40):
+            monitor.snapshot(interfaces(tick))
+            rates = monitor.rates
+            self.assertEqual(sorted(rates.names), sorted(rates.ifaces))
+            for column in range(COUNTERS):
+                self.assertEqual(rates.column(column),
+                        [rates.ifaces[iface].rates[column] for iface in rates.names])
+                self.assertEqual(rates.column(column, smoothed=True),
+                        [rates.ifaces[iface].smoothed[column] for iface in rates.names])
+            self.assertEqual(rates.valid, [rates.ifaces[iface].valid for iface in rates.names])
+
+
+class CounterRatesTest(unittest.TestCase):
+
+    def sample(self, rates, clock, value):
+        counters = [0] * COUNTERS
+        counters[DEV_INDEX["rx_bytes"]] = value
+        rates.update(clock, counters)
+        return rates.rates[DEV_INDEX["rx_bytes"]]
+
+    def test_reset(self):
+        # a recreated interface whose counter restarts below 2**31
+        rates = CounterRates(width=None)
+        self.sample(rates, 1.0, 3 * 2**30)
+        self.assertEqual(self.sample(rates, 2.0, 3 * 2**30 + 100), 100.0)
+        self.sample(rates, 3.0, 500)
+        self.assertEqual((rates.resets, rates.valid), (1, False))
+        self.assertEqual(self.sample(rates, 4.0, 600), 100.0)
+        self.assertEqual(rates.totals[DEV_INDEX["rx_bytes"]], 200)
+
+    def test_wrap(self):
+        rates = CounterRates(width=32)
+        self.sample(rates, 1.0, 2**32 - 100)
+        self.assertEqual(self.sample(rates, 2.0, 50), 150.0)
+        self.assertEqual(rates.resets, 0)
+        # larger values show counters are 64-bit after all
+        self.sample(rates, 3.0, 2**32 + 50)
+        self.sample(rates, 4.0, 50)
+        self.assertEqual(rates.resets, 1)
+
+    def test_precision(self):
+        if COUNTER_TYPECODE != "L":
+            self.skipTest("no 64-bit integer arrays")
+        rates = CounterRates()
+        self.sample(rates, 1.0, 2**60)
+        self.assertEqual(self.sample(rates, 2.0, 2**60 + 3), 3.0)
+        self.assertEqual(rates.last[DEV_INDEX["rx_bytes"]], 2**60 + 3)
+        self.assertEqual(rates.totals[DEV_INDEX["rx_bytes"]], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
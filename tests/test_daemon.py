@@ -0,0 +1,171 @@
+"""Tests of daemon request handling"""
+
+import os
+import sys
+import stat
+import socket
+import tempfile
+import threading
+import unittest
+from StringIO import StringIO
+
+from net_monitor.daemon import Daemon, DaemonClient, MAX_REQUEST, SOCKET_MODE
+
+
+class Monitor:
+    """Stand-in for the Monitor parts used by Daemon"""
+
+    last_snapshot = None
+
+    def watch_links(self):
+        return False
+
+
+class Collector:
+    """Stand-in for Collector; fails on the "dns" topic"""
+
+    interval = 1.0
+
+    def __init__(self):
+        self.monitor = Monitor()
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def data(self, topics):
+        if "dns" in topics:
+            raise IOError("collector failed")
+        return {"time": None, "data": dict([(topic, []) for topic in topics])}
+
+
+class Client:
+    """Stand-in for ClientConnection, keeping replies"""
+
+    def __init__(self):
+        self.replies = []
+        self.topics = None
+        self.interval = None
+
+    def send(self, message):
+        self.replies.append(message)
+
+    def subscribe(self, topics, interval, now):
+        self.topics = topics
+        self.interval = interval
+
+
+class HandleTest(unittest.TestCase):
+
+    def handle(self, request):
+        client = Client()
+        Daemon(Collector(), path=None).handle(client, request, 0.0)
+        return client
+
+    def error(self, request):
+        replies = self.handle(request).replies
+        self.assertEqual(len(replies), 1, request)
+        return replies[0].get("error")
+
+    def test_get(self):
+        replies = self.handle('{"cmd": "get", "topics": ["routes"]}').replies
+        self.assertEqual(replies, [{"time": None, "data": {"routes": []}}])
+
+    def test_invalid(self):
+        for request in ['not json', '[1, 2]', '"get"', '{"cmd": 5}']:
+            self.assertTrue(self.error(request), request)
+
+    def test_topics(self):
+        for topics in ['5', '"routes"', '[[1]]', '[{"a": 1}]', '[null]', 'null']:
+            for cmd in ["get", "subscribe"]:
+                request = '{"cmd": "%s", "topics": %s}' % (cmd, topics)
+                self.assertEqual(self.error(request), "topics must be a list of names",
+                        request)
+        self.assertEqual(self.error('{"cmd": "get", "topics": ["routes", "foo"]}'),
+                "unknown topics: foo")
+
+    def test_interval(self):
+        for interval in ['"nan"', '"inf"', '"-inf"', '0', '-1', '"x"', 'null', '[]']:
+            request = '{"cmd": "subscribe", "topics": ["routes"], "interval": %s}' % interval
+            client = self.handle(request)
+            self.assertEqual(client.replies, [{"error": "invalid interval"}], request)
+            self.assertEqual(client.topics, None)
+        client = self.handle('{"cmd": "subscribe", "topics": ["routes"], "interval": "2.5"}')
+        self.assertEqual(client.replies, [])
+        self.assertEqual(client.interval, 2.5)
+
+
+class RunTest(unittest.TestCase):
+
+    def setUp(self):
+        # failed requests are logged
+        self.stderr = sys.stderr
+        sys.stderr = StringIO()
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "net_monitor.sock")
+        self.daemon = Daemon(Collector(), self.path)
+        self.daemon.listen()
+        self.thread = threading.Thread(target=self.daemon.run)
+        self.thread.start()
+
+    def tearDown(self):
+        self.daemon.stop()
+        # wake the daemon up, unless clients closing did
+        try:
+            client = DaemonClient(self.path)
+            client.send("ping")
+            client.close()
+        except socket.error:
+            # the daemon stopped meanwhile
+            pass
+        self.thread.join(10)
+        os.rmdir(self.dir)
+        sys.stderr = self.stderr
+
+    def test_failed_request(self):
+        good = DaemonClient(self.path)
+        bad = DaemonClient(self.path)
+        self.assertEqual(good.request("ping"), {"pong": True})
+        bad.send("get", topics=["dns"])
+        # the daemon drops the failing client only
+        self.assertRaises((IOError, socket.error), bad.receive)
+        self.assertEqual(good.request("ping"), {"pong": True})
+        self.assertEqual(good.get(["routes"])["data"], {"routes": []})
+        good.close()
+        bad.close()
+        self.assertTrue(self.thread.isAlive())
+        self.assertTrue("collector failed" in sys.stderr.getvalue())
+
+    def test_failed_subscription(self):
+        good = DaemonClient(self.path)
+        bad = DaemonClient(self.path)
+        good.subscribe(["routes"], 0.1)
+        bad.subscribe(["dns"], 0.1)
+        self.assertRaises((IOError, socket.error), bad.receive)
+        self.assertEqual(good.receive()["data"], {"routes": []})
+        good.close()
+        bad.close()
+        self.assertTrue(self.thread.isAlive())
+        self.assertTrue("collector failed" in sys.stderr.getvalue())
+
+    def test_long_request(self):
+        good = DaemonClient(self.path)
+        bad = DaemonClient(self.path)
+        bad.sock.sendall("x" * (MAX_REQUEST + 1))
+        self.assertRaises((IOError, socket.error), bad.receive)
+        self.assertEqual(good.request("ping"), {"pong": True})
+        good.close()
+        bad.close()
+
+    def test_socket_mode(self):
+        client = DaemonClient(self.path)
+        self.assertEqual(client.request("ping"), {"pong": True})
+        client.close()
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), SOCKET_MODE)
+        self.assertEqual(SOCKET_MODE & stat.S_IRWXO, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
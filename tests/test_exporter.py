@@ -0,0 +1,86 @@
+"""Tests of the OpenMetrics exporter"""
+
+import os
+import tempfile
+import unittest
+
+from net_monitor.exporter import MetricsRenderer
+from net_monitor.monitor import Snapshot, InterfaceSnapshot
+from net_monitor.procfs import DEV_COUNTERS
+from net_monitor.uptime import UptimeLog
+
+
+class Monitor:
+    """Stand-in for the Monitor parts used by MetricsRenderer"""
+
+    def __init__(self, log):
+        self.uptime_log = UptimeLog(log)
+        iface = InterfaceSnapshot("eth0", True, "up", None, None, 0, 0,
+                range(DEV_COUNTERS), False, 0, None, None, None, None, None, None, None)
+        self.last_snapshot = Snapshot(1000.0, 1.0, {"eth0": iface})
+
+
+class Scheduler:
+    """Stand-in for Scheduler: generation of every collector is bumped by
+    tick()"""
+
+    def __init__(self):
+        self.generations = 0
+
+    def tick(self):
+        self.generations += 1
+
+    def generation(self, name):
+        return self.generations
+
+    def latest(self, name):
+        return None
+
+
+class Collector:
+
+    def __init__(self, log):
+        self.monitor = Monitor(log)
+        self.scheduler = Scheduler()
+
+
+class MetricsRendererTest(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.log = tempfile.mkstemp()
+        os.close(fd)
+        self.collector = Collector(self.log)
+        self.renderer = MetricsRenderer(self.collector)
+
+    def tearDown(self):
+        os.unlink(self.log)
+
+    def sample(self, name):
+        for line in self.renderer.render().split("\n"):
+            if line.startswith(name + "{"):
+                return line.split(" ")[1]
+
+    def test_counters(self):
+        self.assertEqual(self.sample("net_monitor_interface_rx_bytes_total"), "0")
+        self.assertEqual(self.sample("net_monitor_interface_tx_bytes_total"), "8")
+        self.assertEqual(self.sample("net_monitor_interface_up"), "1")
+        self.assertTrue(self.renderer.render().endswith("# EOF\n"))
+
+    def test_uptime(self):
+        self.assertEqual(self.sample("net_monitor_interface_up_since_seconds"), "0")
+        with open(self.log, "a") as fd:
+            fd.write("eth0:UP:1500\n")
+        # as if CHECK_INTERVAL had passed since the last check
+        self.collector.monitor.uptime_log.checked = None
+        self.collector.scheduler.tick()
+        # the log is read by the exporter itself
+        self.assertEqual(self.sample("net_monitor_interface_up_since_seconds"), "1500")
+        with open(self.log, "a") as fd:
+            fd.write("eth0:DOWN:1600\n")
+        self.collector.monitor.uptime_log.checked = None
+        self.collector.scheduler.tick()
+        self.assertEqual(self.sample("net_monitor_interface_up_since_seconds"), "0")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+"""Tests of fleet polling, with the stand-in peers of bench_fleet.py"""
+
+import os
+import sys
+import signal
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        os.pardir, "benchmarks"))
+from bench_fleet import start_peers
+
+from net_monitor.fleet import Fleet
+
+# stand-in peers: 19 and 39 are dead, 49 never replies
+PEERS = 50
+DEAD = [19, 39]
+SILENT = [49]
+
+# reply delay of peers, and poll timeout, in seconds
+DELAY = 0.001
+TIMEOUT = 0.5
+
+
+class FleetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pid, self.specs = start_peers(PEERS, DELAY)
+        self.fleet = Fleet(self.specs, timeout=TIMEOUT)
+
+    def tearDown(self):
+        self.fleet.close()
+        self.stop_peers()
+
+    def stop_peers(self):
+        os.kill(self.pid, signal.SIGTERM)
+        os.waitpid(self.pid, 0)
+
+    def peer(self, i):
+        return self.fleet.peers[i]
+
+    def test_poll(self):
+        live = PEERS - len(DEAD) - len(SILENT)
+        self.assertEqual(self.fleet.poll(), live)
+        for i in DEAD + SILENT:
+            self.assertEqual(self.peer(i).failures, 1, i)
+            self.assertEqual(self.peer(i).sock, None, i)
+        self.assertEqual(self.peer(SILENT[0]).error, "timeout")
+        for i in DEAD:
+            self.assertTrue(self.peer(i).error, i)
+        self.assertEqual(self.peer(0).error, None)
+        self.assertTrue(self.peer(0).reused)
+        # failed peers are not retried before their delay
+        self.assertEqual(self.fleet.poll(), live)
+        for i in DEAD + SILENT:
+            self.assertEqual(self.peer(i).failures, 1, i)
+
+    def test_restart(self):
+        live = PEERS - len(DEAD) - len(SILENT)
+        self.assertEqual(self.fleet.poll(), live)
+        # connections of the previous poll are closed by the restart
+        self.stop_peers()
+        ports = [int(spec.rsplit(":", 1)[1]) for spec in self.specs]
+        self.pid, specs = start_peers(PEERS, DELAY, ports)
+        self.assertEqual(self.fleet.poll(), live)
+        for i in range(PEERS):
+            if i not in DEAD + SILENT:
+                self.assertEqual((self.peer(i).failures, self.peer(i).error), (0, None), i)
+
+    def test_view(self):
+        self.fleet.poll()
+        view = self.fleet.view()
+        live = [i for i in range(PEERS) if i not in DEAD + SILENT]
+        self.assertEqual(sorted(view.down), sorted([self.specs[i] for i in DEAD + SILENT]))
+        self.assertEqual(sorted(view.hosts), sorted([self.specs[i] for i in live]))
+        # a peer i has lo, eth0, eth1 and wlan0 at 1000 * (i + 0..3) bytes
+        # per second received, and half of it sent; loopback is not counted
+        for i in live:
+            self.assertEqual(view.hosts[self.specs[i]], [1000.0 * (3 * i + 6), 500.0 * (3 * i + 6)])
+            self.assertEqual(view.host_groups[self.specs[i]]["loopback"],
+                    [1000.0 * i, 500.0 * i])
+            self.assertEqual(view.established[self.specs[i]], i % 97)
+        self.assertEqual(view.groups["ethernet"], [sum([1000.0 * (2 * i + 3) for i in live]),
+                sum([500.0 * (2 * i + 3) for i in live])])
+        self.assertEqual(view.groups["wireless"],
+                [sum([1000.0 * (i + 3) for i in live]), sum([500.0 * (i + 3) for i in live])])
+        self.assertEqual(view.total(), [sum([1000.0 * (3 * i + 6) for i in live]),
+                sum([500.0 * (3 * i + 6) for i in live])])
+        self.assertEqual(view.top_throughput(3), [(self.specs[i], 1000.0 * (3 * i + 6),
+                500.0 * (3 * i + 6)) for i in [48, 47, 46]])
+        self.assertEqual(view.top_established(2), [(self.specs[48], 48), (self.specs[47], 47)])
+
+
+if __name__ == "__main__":
+    unittest.main()
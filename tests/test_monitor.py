@@ -0,0 +1,61 @@
+"""Tests of Monitor snapshots, on a /proc tree written by the tests"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from net_monitor.monitor import Monitor
+from net_monitor.procfs import DEV_INDEX
+
+DEV_HEADER = """\
+Inter-|   Receive                                                |  Transmit
+ face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls carrier compressed
+"""
+
+WIRELESS_HEADER = """\
+Inter-| sta-|   Quality        |   Discarded packets               | Missed | WE
+ face | tus | link level noise |  nwid  crypt   frag  retry   misc | beacon | 22
+"""
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root, "proc", "net"))
+        with open(os.path.join(self.root, "proc", "net", "wireless"), "w") as fd:
+            fd.write(WIRELESS_HEADER)
+        self.monitor = Monitor(root=self.root)
+
+    def tearDown(self):
+        self.monitor.proc.close()
+        shutil.rmtree(self.root)
+
+    def write_dev(self, counters):
+        with open(os.path.join(self.root, "proc", "net", "dev"), "w") as fd:
+            fd.write(DEV_HEADER)
+            for iface, base in counters:
+                fd.write("%6s: %s\n" % (iface, " ".join([str(base + i) for i in range(16)])))
+
+    def test_reuse(self):
+        self.write_dev([("lo", 100), ("eth0", 1000)])
+        first = self.monitor.snapshot()
+        self.write_dev([("lo", 100), ("eth0", 2000)])
+        second = self.monitor.snapshot(details=False)
+        # records of interfaces with unchanged counters are shared
+        self.assertTrue(second.ifaces["lo"] is first.ifaces["lo"])
+        eth0 = second.ifaces["eth0"]
+        self.assertEqual((eth0.exists, eth0.bytes_in, eth0.bytes_out), (True, 2000, 2008))
+        self.assertEqual(eth0.counters, tuple(range(2000, 2016)))
+        self.assertEqual(eth0.counter("tx_packets"), 2000 + DEV_INDEX["tx_packets"])
+        self.assertEqual(eth0.status, first.ifaces["eth0"].status)
+        # interfaces which went away keep their details
+        self.write_dev([("eth0", 2000)])
+        third = self.monitor.snapshot(ifaces=["lo", "eth0"], details=False)
+        self.assertEqual((third.ifaces["lo"].exists, third.ifaces["lo"].counters), (False, ()))
+        self.assertTrue(third.ifaces["eth0"] is eth0)
+
+
+if __name__ == "__main__":
+    unittest.main()
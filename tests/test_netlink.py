@@ -0,0 +1,221 @@
+"""Tests of rtnetlink parsing, on dumps recorded by record_fixtures.py"""
+
+import errno
+import socket
+import struct
+import unittest
+
+from net_monitor import netlink
+from net_monitor.netlink import (parse_messages, parse_link, parse_addr,
+        parse_route, nlmsghdr, NetlinkError, RtnetlinkBackend, LinkWatcher)
+
+import replay
+
+def rewrite(datagram, seq=None, clear_flags=0):
+    """Rewrites seq and clears flags of every message in a datagram"""
+    data = bytearray(datagram)
+    pos = 0
+    while pos + nlmsghdr.size <= len(data):
+        length, msg_type, flags, old_seq, pid = nlmsghdr.unpack_from(str(data), pos)
+        if seq is None:
+            seq = old_seq
+        nlmsghdr.pack_into(data, pos, length, msg_type, flags & ~clear_flags, seq, pid)
+        pos += netlink.align(length)
+    return str(data)
+
+def split(datagrams):
+    """Splits datagrams into a datagram per message"""
+    messages = []
+    for datagram in datagrams:
+        pos = 0
+        while pos < len(datagram):
+            length = netlink.align(nlmsghdr.unpack_from(datagram, pos)[0])
+            messages.append(datagram[pos:pos + length])
+            pos += length
+    return messages
+
+def ack(seq, code=0):
+    """NLMSG_ERROR datagram; an acknowledgement when code is 0"""
+    payload = struct.pack("=i", -code) + nlmsghdr.pack(nlmsghdr.size, 0, 0, seq, 0)
+    return nlmsghdr.pack(nlmsghdr.size + len(payload), netlink.NLMSG_ERROR, 0,
+            seq, 0) + payload
+
+
+class ReplayBackend(RtnetlinkBackend):
+    """RtnetlinkBackend reading recorded datagrams"""
+
+    def __init__(self, datagrams):
+        self.nl = replay.ReplaySocket(datagrams)
+
+
+class ReplayWatcher(LinkWatcher):
+    """LinkWatcher without a socket, knowing links of a recorded dump"""
+
+    def __init__(self, datagrams):
+        self.links = ReplayBackend(datagrams).links()
+
+
+class ParseTest(unittest.TestCase):
+
+    def payloads(self, name, msg_type):
+        request, datagrams = replay.load(name)
+        return [payload for datagram in datagrams
+                for reply_type, flags, seq, payload in parse_messages(datagram)
+                if reply_type == msg_type]
+
+    def test_parse_link(self):
+        links = [parse_link(payload) for payload in
+                self.payloads("rtm_getlink.bin", netlink.RTM_NEWLINK)]
+        self.assertEqual([link["name"] for link in links], ["lo", "ifb0", "ifb1", "eth0"])
+        lo, ifb0, ifb1, eth0 = links
+        self.assertEqual(lo["index"], 1)
+        self.assertEqual(lo["mtu"], 65536)
+        self.assertEqual(lo["mac"], "00:00:00:00:00:00")
+        # loopback does not report operstate
+        self.assertEqual(lo["operstate"], "unknown")
+        self.assertTrue(netlink.link_is_up(lo))
+        self.assertEqual(ifb0["operstate"], "down")
+        self.assertFalse(netlink.link_is_up(ifb0))
+        self.assertEqual(eth0["index"], 4)
+        self.assertEqual(eth0["mtu"], 1400)
+        self.assertEqual(eth0["mac"], "02:fc:00:00:00:01")
+        self.assertEqual(eth0["operstate"], "up")
+        self.assertTrue(netlink.link_is_up(eth0))
+
+    def test_link_stats(self):
+        links = [parse_link(payload) for payload in
+                self.payloads("rtm_getlink.bin", netlink.RTM_NEWLINK)]
+        stats = dict(zip(netlink.STATS64_FIELDS, links[0]["stats"]))
+        self.assertEqual(stats["rx_packets"], 17298)
+        self.assertEqual(stats["rx_bytes"], 88419017)
+        # loopback receives what it sends
+        self.assertEqual(stats["tx_bytes"], stats["rx_bytes"])
+        columns = netlink.proc_dev_columns(links[3]["stats"])
+        # rx bytes and packets, tx bytes and packets of eth0
+        self.assertEqual([columns[0], columns[1], columns[8], columns[9]],
+                [5962, 92, 7965, 92])
+
+    def test_parse_addr(self):
+        addrs = [parse_addr(payload) for payload in
+                self.payloads("rtm_getaddr.bin", netlink.RTM_NEWADDR)]
+        self.assertEqual([(addr["index"], addr["address"], addr["prefixlen"])
+                for addr in addrs],
+                [(1, "127.0.0.1", 8), (4, "192.0.2.2", 24), (1, "::1", 128),
+                 (4, "fd00::2", 64), (4, "fe80::fc:ff:fe00:1", 64)])
+        self.assertEqual(addrs[0]["family"], socket.AF_INET)
+        self.assertEqual(addrs[0]["label"], "lo")
+        self.assertEqual(addrs[1]["label"], "eth0")
+        self.assertEqual(addrs[2]["family"], socket.AF_INET6)
+        # IPv6 addresses have no label
+        self.assertEqual(addrs[2]["label"], "")
+
+    def test_parse_route(self):
+        routes = [parse_route(payload) for payload in
+                self.payloads("rtm_getroute.bin", netlink.RTM_NEWROUTE)]
+        main = [route for route in routes if route["table"] == netlink.RT_TABLE_MAIN]
+        self.assertEqual(len(main), 2)
+        default, subnet = main
+        self.assertEqual(default["dst_len"], 0)
+        self.assertEqual(default["dst"], None)
+        self.assertEqual(default["gateway"], socket.inet_aton("192.0.2.1"))
+        self.assertEqual(default["oif"], 4)
+        self.assertEqual(subnet["dst_len"], 24)
+        self.assertEqual(subnet["dst"], socket.inet_aton("192.0.2.0"))
+        self.assertEqual(subnet["gateway"], None)
+        # the other routes are local ones, from table 255
+        self.assertEqual(set([route["table"] for route in routes]) - set([254]), set([255]))
+
+
+class RequestTest(unittest.TestCase):
+
+    def test_request(self):
+        request, datagrams = replay.load("rtm_getlink.bin")
+        rtnl = ReplayBackend(datagrams)
+        links = rtnl.links()
+        self.assertEqual(rtnl.nl.sock.sent, [request])
+        self.assertEqual(sorted(links.keys()), [1, 2, 3, 4])
+        self.assertEqual(links[4]["name"], "eth0")
+
+    def test_multipart(self):
+        # the recorded dump spans several datagrams; one message per
+        # datagram gives the same result
+        request, datagrams = replay.load("rtm_getlink.bin")
+        self.assertTrue(len(datagrams) > 2)
+        expected = ReplayBackend(datagrams).links()
+        self.assertEqual(ReplayBackend(split(datagrams)).links(), expected)
+
+    def test_done(self):
+        # NLMSG_DONE ends the dump: nothing after it is read
+        request, datagrams = replay.load("rtm_getaddr.bin")
+        rtnl = ReplayBackend(datagrams + ["unread"])
+        self.assertEqual(len(rtnl.addresses()), 5)
+        self.assertEqual(rtnl.nl.sock.datagrams, ["unread"])
+
+    def test_stale(self):
+        # replies to an earlier request are skipped
+        request, datagrams = replay.load("rtm_getroute.bin")
+        stale = [rewrite(datagram, seq=0) for datagram in datagrams]
+        rtnl = ReplayBackend(stale + datagrams)
+        self.assertEqual(len(rtnl.routes()), 2)
+        self.assertEqual(rtnl.nl.sock.datagrams, [])
+
+    def test_error(self):
+        request, datagrams = replay.load("rtm_getlink_enodev.bin")
+        self.assertEqual(len(datagrams), 1)
+        nl = replay.ReplaySocket(datagrams)
+        try:
+            nl.request(netlink.RTM_GETLINK, request[nlmsghdr.size:], netlink.NLM_F_REQUEST)
+        except NetlinkError, e:
+            self.assertEqual(e.errno, errno.ENODEV)
+        else:
+            self.fail("NetlinkError not raised")
+        self.assertEqual(nl.sock.sent, [request])
+
+    def test_ack(self):
+        # an acknowledgement ends the request
+        request, datagrams = replay.load("rtm_getroute.bin")
+        nl = replay.ReplaySocket(split(datagrams)[:2] + [ack(1)])
+        replies = nl.request(netlink.RTM_GETROUTE, request[nlmsghdr.size:])
+        self.assertEqual(len(replies), 2)
+        self.assertEqual(nl.sock.datagrams, [])
+
+    def test_single(self):
+        # a reply without NLM_F_MULTI is the only one
+        request, datagrams = replay.load("rtm_getlink.bin")
+        single = rewrite(split(datagrams)[0], clear_flags=netlink.NLM_F_MULTI)
+        nl = replay.ReplaySocket([single, "unread"])
+        replies = nl.request(netlink.RTM_GETLINK, request[nlmsghdr.size:])
+        self.assertEqual([msg_type for msg_type, payload in replies], [netlink.RTM_NEWLINK])
+        self.assertEqual(nl.sock.datagrams, ["unread"])
+
+    def test_parse_messages(self):
+        request, datagrams = replay.load("rtm_getaddr.bin")
+        messages = list(parse_messages(datagrams[0]))
+        self.assertEqual([(msg_type, flags, seq) for msg_type, flags, seq, payload in messages],
+                [(netlink.RTM_NEWADDR, netlink.NLM_F_MULTI, 1)] * 5)
+        # a truncated message is ignored
+        self.assertEqual(len(list(parse_messages(datagrams[0][:-10]))), 4)
+        self.assertRaises(NetlinkError, list, parse_messages(ack(1, errno.EPERM)))
+
+
+class WatcherTest(unittest.TestCase):
+
+    def test_link_events(self):
+        request, datagrams = replay.load("rtm_getlink.bin")
+        watcher = ReplayWatcher(datagrams)
+        eth0 = watcher.links[4]
+        # notifications about unchanged links are not reported
+        self.assertEqual(watcher.update_link(dict(eth0)), [])
+        events = []
+        for operstate in ["dormant", "lowerlayerdown", "down", "up"]:
+            link = dict(eth0, operstate=operstate)
+            events += [(event, iface, data["operstate"])
+                    for event, iface, data in watcher.update_link(link)]
+        self.assertEqual(events, [(netlink.EVENT_DOWN, "eth0", "dormant"),
+                (netlink.EVENT_STATE_CHANGED, "eth0", "lowerlayerdown"),
+                (netlink.EVENT_STATE_CHANGED, "eth0", "down"),
+                (netlink.EVENT_UP, "eth0", "up")])
+
+
+if __name__ == "__main__":
+    unittest.main()
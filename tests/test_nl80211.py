@@ -0,0 +1,87 @@
+"""Tests of nl80211 station parsing, on a dump synthesized by
+record_fixtures.py"""
+
+import struct
+import unittest
+
+from net_monitor import netlink
+from net_monitor.netlink import parse_messages, nlmsghdr
+from net_monitor.nl80211 import (Nl80211Backend, parse_station, parse_rate, pack_attr,
+        NL80211_RATE_INFO_BITRATE, NL80211_RATE_INFO_BITRATE32, NL80211_RATE_INFO_MCS,
+        NL80211_RATE_INFO_HE_MCS)
+
+import replay
+from record_fixtures import NL80211_FAMILY, STATION_IFINDEX
+
+
+class ReplayBackend(Nl80211Backend):
+    """Nl80211Backend reading recorded datagrams"""
+
+    def __init__(self, datagrams):
+        self.nl = replay.ReplaySocket(datagrams)
+        self.family = NL80211_FAMILY
+
+
+class ParseTest(unittest.TestCase):
+
+    def stations(self):
+        request, datagrams = replay.load("nl80211_get_station.bin")
+        return [parse_station(payload) for datagram in datagrams
+                for msg_type, flags, seq, payload in parse_messages(datagram)
+                if msg_type == NL80211_FAMILY]
+
+    def test_station(self):
+        vht, legacy = self.stations()
+        self.assertEqual((vht["ifindex"], vht["mac"]), (STATION_IFINDEX, "02:00:00:00:01:01"))
+        # 64-bit byte counters replace the truncated 32-bit ones
+        self.assertEqual((vht["rx_bytes"], vht["tx_bytes"]), (5 * 2**30 + 123, 2**31 + 77))
+        self.assertEqual((vht["rx_packets"], vht["tx_packets"]), (4000000, 1500000))
+        self.assertEqual((vht["tx_retries"], vht["tx_failed"], vht["beacon_loss"]),
+                (2000, 12, 3))
+        self.assertEqual((vht["inactive_time"], vht["connected_time"]), (40, 3600))
+        self.assertEqual((vht["signal"], vht["signal_avg"]), (-52, -54))
+        self.assertEqual((vht["tx_bitrate"], vht["tx_mcs"]), (866700000, 9))
+        # nested rx bitrate, flagged with NLA_F_NESTED
+        self.assertEqual((vht["rx_bitrate"], vht["rx_mcs"]), (650000000, 7))
+
+    def test_legacy_station(self):
+        vht, legacy = self.stations()
+        self.assertEqual(legacy["mac"], "02:00:00:00:01:02")
+        self.assertEqual((legacy["rx_bytes"], legacy["tx_bytes"]), (1000, 2000))
+        # missing counters are zero, missing levels and rates None
+        self.assertEqual((legacy["connected_time"], legacy["beacon_loss"]), (0, 0))
+        self.assertEqual((legacy["signal"], legacy["signal_avg"]), (-80, None))
+        self.assertEqual((legacy["tx_bitrate"], legacy["tx_mcs"]), (54000000, None))
+        self.assertEqual((legacy["rx_bitrate"], legacy["rx_mcs"]), (None, None))
+
+    def test_rate(self):
+        u8 = lambda attr, value: pack_attr(attr, struct.pack("=B", value))
+        self.assertEqual(parse_rate(""), (None, None))
+        # rates above 6.5 Gbit/s only fit in BITRATE32
+        self.assertEqual(parse_rate(pack_attr(NL80211_RATE_INFO_BITRATE32,
+                struct.pack("=I", 96075)) + u8(NL80211_RATE_INFO_HE_MCS, 11)),
+                (9607500000, 11))
+        self.assertEqual(parse_rate(pack_attr(NL80211_RATE_INFO_BITRATE,
+                struct.pack("=H", 1500)) + u8(NL80211_RATE_INFO_MCS, 15)), (150000000, 15))
+
+    def test_empty_station(self):
+        station = parse_station(struct.pack("=BBH", 19, 1, 0))
+        self.assertEqual((station["ifindex"], station["mac"], station["rx_bytes"]), (0, None, 0))
+
+
+class RequestTest(unittest.TestCase):
+
+    def test_stations(self):
+        request, datagrams = replay.load("nl80211_get_station.bin")
+        backend = ReplayBackend(datagrams)
+        stations = backend.stations(STATION_IFINDEX)
+        self.assertEqual(backend.nl.sock.sent, [request])
+        self.assertEqual(backend.nl.sock.datagrams, [])
+        self.assertEqual([station["mac"] for station in stations],
+                ["02:00:00:00:01:01", "02:00:00:00:01:02"])
+        self.assertEqual(nlmsghdr.unpack_from(request)[1:3],
+                (NL80211_FAMILY, netlink.NLM_F_REQUEST | netlink.NLM_F_DUMP))
+
+
+if __name__ == "__main__":
+    unittest.main()
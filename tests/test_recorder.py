@@ -0,0 +1,124 @@
+"""Tests of recording and replay of monitoring sessions"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from net_monitor.recorder import Recorder, Replay, RecordingError
+from net_monitor.monitor import Snapshot, InterfaceSnapshot
+from net_monitor.procfs import DEV_COUNTERS
+
+
+def snapshot(tick):
+    """Snapshot of a tick: wlan0 appears at tick 4, eth0 goes away at tick 8"""
+    ifaces = {}
+    names = ["lo", "eth0"]
+    if tick >= 4:
+        names.append("wlan0")
+    for i, name in enumerate(names):
+        counters = tuple([tick * 1000 + i * 100 + column for column in range(DEV_COUNTERS)])
+        if name == "eth0":
+            # counters above 32 bits
+            counters = tuple([value + 2**40 for value in counters])
+        ifaces[name] = InterfaceSnapshot(name, name != "eth0" or tick < 8, "up", None, None,
+                0, 0, counters, name == "wlan0", tick, None, None, None, None, None, None, None)
+    return Snapshot(1000.0 + tick, float(tick), ifaces)
+
+def connections(tick):
+    return {("tcp", 1): tick, ("tcp6", 10): 2, ("udp", 7): tick * 3}
+
+
+class RecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "recording")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def record(self, ticks, close=True):
+        recorder = Recorder(self.path, index_interval=5)
+        for tick in ticks:
+            recorder.write_snapshot(snapshot(tick))
+            recorder.write_connections(1000.5 + tick, connections(tick))
+        if close:
+            recorder.close()
+        else:
+            recorder.flush()
+        return recorder
+
+    def check(self, replay, ticks):
+        snapshots = list(replay.snapshots())
+        self.assertEqual([recorded.timestamp for recorded in snapshots],
+                [1000.0 + tick for tick in ticks])
+        for tick, recorded in zip(ticks, snapshots):
+            expected = snapshot(tick).ifaces
+            self.assertEqual(sorted(recorded.ifaces), sorted(expected))
+            for name, iface in recorded.ifaces.items():
+                self.assertEqual(iface, (name, expected[name].exists, expected[name].wireless,
+                        expected[name].link, expected[name].counters))
+        self.assertEqual([(recorded.timestamp, recorded.states)
+                for recorded in replay.connections()],
+                [(1000.5 + tick, connections(tick)) for tick in ticks])
+
+    def test_round_trip(self):
+        self.record(range(12))
+        replay = Replay(self.path)
+        self.assertEqual(len(replay), 24)
+        self.assertEqual(replay.time_range(), (1000.0, 1011.5))
+        # segments of 5 records, and an incomplete one
+        self.assertEqual([segment.count for segment in replay.segments], [5, 5, 5, 5, 4])
+        self.check(replay, range(12))
+        self.assertEqual([recorded.timestamp for recorded in replay.snapshots(1003.0, 1006.0)],
+                [1003.0, 1004.0, 1005.0, 1006.0])
+        self.assertEqual([recorded.timestamp for recorded in replay.records(1009.2, 1010.5)],
+                [1009.5, 1010.0, 1010.5])
+        replay.close()
+
+    def test_append(self):
+        self.record(range(6))
+        self.record(range(6, 12))
+        replay = Replay(self.path)
+        self.check(replay, range(12))
+        replay.close()
+
+    def test_recovery(self):
+        # not closed, as on a crash: the last records are not indexed, and
+        # the last one is only partially written
+        recorder = self.record(range(8), close=False)
+        size = os.path.getsize(self.path)
+        with open(self.path, "r+b") as fd:
+            fd.truncate(size - 7)
+        replay = Replay(self.path)
+        self.assertEqual(len(replay), 15)
+        self.assertEqual(replay.time_range(), (1000.0, 1007.0))
+        self.assertEqual([recorded.timestamp for recorded in replay.connections()],
+                [1000.5 + tick for tick in range(7)])
+        replay.close()
+        # the damaged tail is dropped when recording resumes
+        self.record(range(8, 12))
+        replay = Replay(self.path)
+        self.assertEqual(len(replay), 23)
+        snapshots = list(replay.snapshots())
+        self.assertEqual([recorded.timestamp for recorded in snapshots],
+                [1000.0 + tick for tick in range(12)])
+        # interface names are recorded again after the recovered records
+        self.assertEqual(sorted(snapshots[-1].ifaces), ["eth0", "lo", "wlan0"])
+        self.assertEqual(snapshots[-1].ifaces["eth0"].counters,
+                snapshot(11).ifaces["eth0"].counters)
+        self.assertEqual([recorded.timestamp for recorded in replay.connections()],
+                [1000.5 + tick for tick in range(12) if tick != 7])
+        replay.close()
+        recorder.fd.close()
+
+    def test_not_recording(self):
+        with open(self.path, "wb") as fd:
+            fd.write("not a recording at all\n")
+        self.assertRaises(RecordingError, Replay, self.path)
+        self.assertRaises(RecordingError, Recorder, self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
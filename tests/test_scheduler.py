@@ -0,0 +1,121 @@
+"""Tests of collectors running concurrently on a shared Monitor"""
+
+import sys
+import time
+import threading
+import unittest
+from StringIO import StringIO
+
+from net_monitor.monitor import Monitor
+from net_monitor.scheduler import Scheduler, monitor_collectors
+from net_monitor.connections import CONNECTION_PROTOS
+
+# collectors run by the tests, all every millisecond
+INTERVALS = dict([(name, 0.001) for name in ["counters", "interfaces", "routes",
+        "neighbors", "kernel", "connections", "dns", "vnstat", "stations"]])
+
+# seconds collectors are left running
+DURATION = 1.0
+
+# seconds Probe takes to read connection tables of all protocols
+SCAN_TIME = 0.3
+
+
+class Probe:
+    """Stand-in for Monitor: snapshots are quick, and are counted while
+    running, reading all connection tables takes SCAN_TIME"""
+
+    def __init__(self):
+        self.snapshot_lock = threading.RLock()
+        self.net = ["eth0"]
+        self.count_lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def snapshot(self, *args, **kwargs):
+        with self.count_lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.0005)
+        with self.count_lock:
+            self.active -= 1
+
+    def collect(self, *args, **kwargs):
+        time.sleep(0.0005)
+
+    get_routes = get_dns = get_stations = get_kernel_stats = get_neighbors = \
+            get_accounting = collect
+
+    def get_connection_table(self, *args, **kwargs):
+        time.sleep(SCAN_TIME / len(CONNECTION_PROTOS))
+
+    def has_network_accounting(self, iface):
+        return True
+
+
+def run(scheduler):
+    """Runs scheduler for DURATION; returns False if it did not stop"""
+    for task in scheduler.tasks.values():
+        task.jitter = 0
+    scheduler.start()
+    time.sleep(DURATION)
+    thread = threading.Thread(target=scheduler.stop)
+    thread.setDaemon(True)
+    thread.start()
+    thread.join(10)
+    return not thread.isAlive()
+
+
+class MonitorCollectorsTest(unittest.TestCase):
+
+    def setUp(self):
+        # missing /proc files are logged
+        self.stderr = sys.stderr
+        sys.stderr = StringIO()
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+
+    def test_slow_collector(self):
+        # connection scans do not delay counters, nor their callbacks
+        probe = Probe()
+        scheduler = monitor_collectors(Scheduler(), probe, INTERVALS)
+        clocks = []
+        scheduler.connect("counters", lambda name, value: clocks.append(time.time()))
+        self.assertTrue(run(scheduler))
+        self.assertTrue(scheduler.generation("connections") > 1)
+        self.assertTrue(len(clocks) > 50, len(clocks))
+        gaps = [b - a for a, b in zip(clocks, clocks[1:])]
+        self.assertTrue(max(gaps) < SCAN_TIME / 2, max(gaps))
+        for task in scheduler.tasks.values():
+            self.assertTrue(task.generation > 0, task.name)
+
+    def test_snapshots(self):
+        # counters and interfaces both update rates, so they take turns
+        probe = Probe()
+        scheduler = monitor_collectors(Scheduler(), probe, INTERVALS)
+        for name in ["counters", "interfaces"]:
+            scheduler.connect(name, lambda name, value: probe.snapshot())
+        self.assertTrue(run(scheduler))
+        self.assertEqual(probe.max_active, 1)
+
+    def test_netlink(self):
+        # requests of concurrent collectors on the shared netlink socket
+        # used to steal each other's replies, and hang
+        monitor = Monitor("netlink")
+        if monitor.netlink is None:
+            self.skipTest("no rtnetlink support")
+        scheduler = monitor_collectors(Scheduler(), monitor, INTERVALS)
+        self.assertTrue(run(scheduler))
+        for name in ["counters", "interfaces", "routes", "neighbors", "connections"]:
+            task = scheduler.tasks[name]
+            self.assertTrue(task.generation > 1, name)
+            self.assertEqual(task.error, None, name)
+        routes, default_routes = scheduler.latest("routes")
+        self.assertEqual(len(routes), len(monitor.get_routes()[0]))
+        snapshot = scheduler.latest("interfaces")
+        self.assertTrue("lo" in snapshot.ifaces)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,203 @@
+"""Tests of sock_diag requests and replies, on a dump recorded by
+record_fixtures.py"""
+
+import socket
+import struct
+import unittest
+
+from net_monitor import sockdiag
+from net_monitor.netlink import align, nlmsghdr
+from net_monitor.sockdiag import (SockDiag, port_filter, build_request,
+        parse_diag_dump, inet_diag_bc_op, tcp_info,
+        INET_DIAG_BC_JMP, INET_DIAG_BC_S_GE, INET_DIAG_BC_S_LE,
+        INET_DIAG_BC_D_GE, INET_DIAG_BC_D_LE)
+from net_monitor.connections import TCP_LISTEN, TCP_ESTABLISHED, TCP_INFO_FIELDS
+
+import replay
+from record_fixtures import LISTEN_PORT, CLIENT_PORT
+
+# fields of struct tcp_info from linux/tcp.h, in order, up to
+# tcpi_bytes_received
+TCP_INFO_LAYOUT = ["state", "ca_state", "retransmits", "probes", "backoff",
+        "options", "wscale", "delivery_rate_app_limited",
+        "rto", "ato", "snd_mss", "rcv_mss",
+        "unacked", "sacked", "lost", "retrans", "fackets",
+        "last_data_sent", "last_ack_sent", "last_data_recv", "last_ack_recv",
+        "pmtu", "rcv_ssthresh", "rtt", "rttvar", "snd_ssthresh", "snd_cwnd",
+        "advmss", "reordering", "rcv_rtt", "rcv_space", "total_retrans",
+        "pacing_rate", "max_pacing_rate", "bytes_acked", "bytes_received"]
+
+def run_bytecode(bytecode, sport, dport):
+    """Runs bytecode on a socket, as inet_diag_bc_run() does"""
+    length = len(bytecode)
+    pos = 0
+    while length > 0:
+        code, yes, no = inet_diag_bc_op.unpack_from(bytecode, pos)
+        if code == INET_DIAG_BC_JMP:
+            matched = False
+        else:
+            port = inet_diag_bc_op.unpack_from(bytecode, pos + 4)[2]
+            matched = {INET_DIAG_BC_S_GE: sport >= port,
+                       INET_DIAG_BC_S_LE: sport <= port,
+                       INET_DIAG_BC_D_GE: dport >= port,
+                       INET_DIAG_BC_D_LE: dport <= port}[code]
+        if matched:
+            length -= yes
+            pos += yes
+        else:
+            length -= no
+            pos += no
+    return length == 0
+
+def valid_jump(bytecode, target):
+    """Checks that a jump lands on an operation, or at the end, as
+    valid_cc() does"""
+    pos = 0
+    while pos < len(bytecode):
+        if pos == target:
+            return True
+        pos += inet_diag_bc_op.unpack_from(bytecode, pos)[1]
+    return False
+
+def audit_bytecode(bytecode):
+    """Checks bytecode as inet_diag_bc_audit() does"""
+    length = len(bytecode)
+    pos = 0
+    while length > 0:
+        code, yes, no = inet_diag_bc_op.unpack_from(bytecode, pos)
+        if code not in (INET_DIAG_BC_JMP, INET_DIAG_BC_S_GE, INET_DIAG_BC_S_LE,
+                INET_DIAG_BC_D_GE, INET_DIAG_BC_D_LE):
+            return False
+        if no < 4 or no > length + 4 or no & 3:
+            return False
+        if no < length and not valid_jump(bytecode, pos + no):
+            return False
+        if code != INET_DIAG_BC_JMP and yes < 8:
+            return False
+        if yes < 4 or yes > length + 4 or yes & 3:
+            return False
+        pos += yes
+        length -= yes
+    return length == 0
+
+
+class ReplayDiag(SockDiag):
+    """SockDiag reading recorded datagrams"""
+
+    def __init__(self, datagrams):
+        self.nl = replay.ReplaySocket(datagrams)
+
+
+class PortFilterTest(unittest.TestCase):
+
+    def test_no_ports(self):
+        self.assertEqual(port_filter(), None)
+
+    def test_single_port(self):
+        op = inet_diag_bc_op.pack
+        # failing either comparison jumps 4 bytes past the end
+        self.assertEqual(port_filter([80]),
+                op(INET_DIAG_BC_S_GE, 8, 20) + op(0, 0, 80) +
+                op(INET_DIAG_BC_S_LE, 8, 12) + op(0, 0, 80))
+        self.assertEqual(port_filter(remote_ports=[443]),
+                op(INET_DIAG_BC_D_GE, 8, 20) + op(0, 0, 443) +
+                op(INET_DIAG_BC_D_LE, 8, 12) + op(0, 0, 443))
+
+    def test_jumps(self):
+        op = inet_diag_bc_op.pack
+        bytecode = port_filter([22], [443])
+        self.assertEqual(len(bytecode), 36)
+        self.assertEqual(bytecode,
+                # failed matches skip the JMP, to the next port
+                op(INET_DIAG_BC_S_GE, 8, 20) + op(0, 0, 22) +
+                op(INET_DIAG_BC_S_LE, 8, 12) + op(0, 0, 22) +
+                # a match jumps to the end
+                op(INET_DIAG_BC_JMP, 4, 20) +
+                op(INET_DIAG_BC_D_GE, 8, 20) + op(0, 0, 443) +
+                op(INET_DIAG_BC_D_LE, 8, 12) + op(0, 0, 443))
+
+    def test_audit(self):
+        for local_ports, remote_ports in [([80], []), ([], [443]), ([22, 80], []),
+                ([22], [443]), ([22, 80, 8080], [443, 993])]:
+            self.assertTrue(audit_bytecode(port_filter(local_ports, remote_ports)),
+                    (local_ports, remote_ports))
+
+    def test_run(self):
+        local_ports = [22, 80, 8080]
+        remote_ports = [443, 993]
+        bytecode = port_filter(local_ports, remote_ports)
+        for sport in [0, 21, 22, 23, 79, 80, 81, 8080, 65535]:
+            for dport in [0, 442, 443, 444, 993, 65535]:
+                self.assertEqual(run_bytecode(bytecode, sport, dport),
+                        sport in local_ports or dport in remote_ports,
+                        (sport, dport))
+
+    def test_request(self):
+        request, datagrams = replay.load("sock_diag_tcp.bin")
+        payload = build_request(socket.AF_INET, socket.IPPROTO_TCP, None,
+                [LISTEN_PORT, CLIENT_PORT])
+        # the kernel accepted this request, so its bytecode passed audit
+        self.assertEqual(request[nlmsghdr.size:], payload)
+        self.assertTrue(audit_bytecode(port_filter([LISTEN_PORT, CLIENT_PORT])))
+
+
+class DecodeTest(unittest.TestCase):
+
+    def connections(self):
+        request, datagrams = replay.load("sock_diag_tcp.bin")
+        diag = ReplayDiag(datagrams)
+        table = diag.connections("tcp", local_ports=[LISTEN_PORT, CLIENT_PORT])
+        self.assertEqual(diag.nl.sock.sent, [request])
+        return table
+
+    def test_sockets(self):
+        table = self.connections()
+        self.assertEqual(list(table.local_port), [LISTEN_PORT, CLIENT_PORT, LISTEN_PORT])
+        self.assertEqual(list(table.remote_port), [0, LISTEN_PORT, CLIENT_PORT])
+        self.assertEqual(list(table.state), [TCP_LISTEN, TCP_ESTABLISHED, TCP_ESTABLISHED])
+        # addresses are kept in /proc layout
+        loopback = struct.unpack("=I", socket.inet_aton("127.0.0.1"))[0]
+        self.assertEqual(list(table.local_addr), [loopback] * 3)
+        self.assertEqual(list(table.remote_addr), [0, loopback, loopback])
+
+    def test_tcp_info(self):
+        info = self.connections().tcp_info
+        self.assertEqual(sorted(info.keys()), sorted([name for name, typecode in TCP_INFO_FIELDS]))
+        # listener, client, server
+        self.assertEqual(list(info["bytes_received"]), [0, 500, 1000])
+        # the SYN is counted in acknowledged bytes of the client
+        self.assertEqual(list(info["bytes_acked"]), [0, 1001, 500])
+        self.assertEqual(list(info["snd_cwnd"]), [10, 11, 11])
+        self.assertEqual(list(info["rtt"]), [0, 35, 23])
+        self.assertEqual(list(info["rttvar"]), [0, 19, 13])
+        for name in ["retransmits", "lost", "total_retrans"]:
+            self.assertEqual(list(info[name]), [0, 0, 0])
+
+    def test_tcp_info_offsets(self):
+        # every field holds its own position in the struct
+        self.assertEqual(len(TCP_INFO_LAYOUT), len(tcp_info.unpack("\0" * tcp_info.size)))
+        data = tcp_info.pack(*range(len(TCP_INFO_LAYOUT)))
+        values = tcp_info.unpack(data)
+        for name, offset in sockdiag.TCP_INFO_OFFSETS.items():
+            self.assertEqual(values[offset], TCP_INFO_LAYOUT.index(name), name)
+
+    def test_short_tcp_info(self):
+        # older kernels send a shorter tcp_info: missing fields are zero
+        request, datagrams = replay.load("sock_diag_tcp.bin")
+        replies = replay.ReplaySocket(datagrams).request(sockdiag.SOCK_DIAG_BY_FAMILY,
+                request[nlmsghdr.size:])
+        msg_type, payload = replies[1]
+        attr = sockdiag.inet_diag_msg.size
+        while struct.unpack_from("=HH", payload, attr)[1] != sockdiag.INET_DIAG_INFO:
+            attr += align(struct.unpack_from("=HH", payload, attr)[0])
+        # cut the attribute before tcpi_pacing_rate
+        short = 4 + 8 + 24 * 4
+        payload = (payload[:attr] + struct.pack("=HH", short, sockdiag.INET_DIAG_INFO) +
+                payload[attr + 4:attr + short])
+        table = parse_diag_dump([(msg_type, payload)], "tcp")
+        self.assertEqual(list(table.tcp_info["rtt"]), [35])
+        self.assertEqual(list(table.tcp_info["bytes_acked"]), [0])
+
+
+if __name__ == "__main__":
+    unittest.main()
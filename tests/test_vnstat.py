@@ -0,0 +1,145 @@
+"""Tests of vnstat 1.x and 2.x database reading"""
+
+import os
+import time
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from net_monitor.vnstat import VnstatReader, Traffic, parse_date, parse_legacy, \
+        legacy_data, LEGACY_VERSION, LEGACY_DAYS, LEGACY_MONTHS, LEGACY_TOP, \
+        LEGACY_HOURS, MIB, KIB, VNSTAT_DB
+
+CREATED = 1577836800
+UPDATED = 1583300000
+
+def local(*fields):
+    """Unix time of a local date"""
+    fields = fields + (0,) * (6 - len(fields))
+    return int(time.mktime(fields + (0, 0, -1)))
+
+def pack_legacy(name="eth0", version=LEGACY_VERSION):
+    """Packs a vnstat 1.x DATA struct: days and months are kept newest
+    first, as vnstat does, with unused entries at the end"""
+    values = [version, name, "nick", 1, 5, 2, 0, 0, 512, 256, UPDATED, CREATED]
+    for count, used in [(LEGACY_DAYS, 3), (LEGACY_MONTHS, 2), (LEGACY_TOP, 1)]:
+        for i in range(count):
+            if i < used:
+                values += [UPDATED - i * 86400, i + 1, i, 100 * i, 10, 1]
+            else:
+                values += [0, 0, 0, 0, 0, 0]
+    for i in range(LEGACY_HOURS):
+        # hours are a ring, indexed by hour of the day
+        values += [i < 4 and UPDATED - (i + 2) % 4 * 3600 or 0, i, 2 * i]
+    values.append(1583000000)
+    return legacy_data.pack(*values)
+
+# tables of vnstat 2.x
+SCHEMA = """
+CREATE TABLE interface (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, alias TEXT,
+    active INTEGER NOT NULL, created DATE NOT NULL, updated DATE NOT NULL,
+    rxcounter INTEGER NOT NULL, txcounter INTEGER NOT NULL,
+    rxtotal INTEGER NOT NULL, txtotal INTEGER NOT NULL);
+CREATE TABLE hour (id INTEGER PRIMARY KEY, interface INTEGER, date DATE NOT NULL,
+    rx INTEGER NOT NULL, tx INTEGER NOT NULL);
+CREATE TABLE day (id INTEGER PRIMARY KEY, interface INTEGER, date DATE NOT NULL,
+    rx INTEGER NOT NULL, tx INTEGER NOT NULL);
+CREATE TABLE month (id INTEGER PRIMARY KEY, interface INTEGER, date DATE NOT NULL,
+    rx INTEGER NOT NULL, tx INTEGER NOT NULL);
+"""
+
+
+class ParseTest(unittest.TestCase):
+
+    def test_date(self):
+        self.assertEqual(parse_date("2020-03-04 05:06:07"), local(2020, 3, 4, 5, 6, 7))
+        self.assertEqual(parse_date("2020-03-04 05:00"), local(2020, 3, 4, 5))
+        self.assertEqual(parse_date("2020-03-04"), local(2020, 3, 4))
+        self.assertEqual(parse_date("2020-03"), local(2020, 3, 1))
+        self.assertEqual(parse_date("2020"), local(2020, 1, 1))
+
+    def test_legacy(self):
+        data = parse_legacy(pack_legacy())
+        self.assertEqual((data.name, data.created, data.updated), ("eth0", CREATED, UPDATED))
+        self.assertEqual((data.rx, data.tx), (5 * MIB + 512 * KIB, 2 * MIB + 256 * KIB))
+        self.assertEqual(data.days, [Traffic(UPDATED - i * 86400, (i + 1) * MIB + 100 * i * KIB,
+                i * MIB + 10 * KIB) for i in [2, 1, 0]])
+        self.assertEqual(len(data.months), 2)
+        self.assertEqual(data.hours, [Traffic(UPDATED - 3 * 3600, 1 * KIB, 2 * KIB),
+                Traffic(UPDATED - 2 * 3600, 0, 0), Traffic(UPDATED - 3600, 3 * KIB, 6 * KIB),
+                Traffic(UPDATED, 2 * KIB, 4 * KIB)])
+
+    def test_legacy_invalid(self):
+        self.assertEqual(parse_legacy(pack_legacy()[:-1]), None)
+        self.assertEqual(parse_legacy(pack_legacy(version=2)), None)
+        self.assertEqual(parse_legacy(""), None)
+
+
+class ReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def create_db(self):
+        conn = sqlite3.connect(os.path.join(self.dir, VNSTAT_DB))
+        conn.executescript(SCHEMA)
+        conn.executemany("INSERT INTO interface VALUES (?, ?, NULL, 1, ?, ?, 0, 0, ?, ?)",
+                [(1, "eth0", "2020-01-01 00:00:00", "2020-03-04 05:06:07", 3000, 2000),
+                 (2, "wlan0", "2020-02-01 00:00:00", "2020-03-04 05:06:07", 10, 20)])
+        conn.executemany("INSERT INTO hour (interface, date, rx, tx) VALUES (?, ?, ?, ?)",
+                [(1, "2020-03-04 05:00", 30, 20), (1, "2020-03-04 04:00", 40, 10),
+                 (2, "2020-03-04 05:00", 1, 2)])
+        conn.executemany("INSERT INTO day (interface, date, rx, tx) VALUES (?, ?, ?, ?)",
+                [(1, "2020-03-04", 70, 30), (1, "2020-03-03", 500, 400)])
+        conn.execute("INSERT INTO month (interface, date, rx, tx) "
+                "VALUES (1, '2020-03-01', 570, 430)")
+        conn.commit()
+        return conn
+
+    def test_db(self):
+        self.create_db().close()
+        reader = VnstatReader(self.dir)
+        self.assertEqual(sorted(reader.interfaces()), ["eth0", "wlan0"])
+        self.assertTrue(reader.has("wlan0"))
+        self.assertFalse(reader.has("eth1"))
+        data = reader.db_accounting("eth0")
+        self.assertEqual((data.name, data.created, data.updated, data.rx, data.tx),
+                ("eth0", local(2020, 1, 1), local(2020, 3, 4, 5, 6, 7), 3000, 2000))
+        self.assertEqual(data.hours, [Traffic(local(2020, 3, 4, 4), 40, 10),
+                Traffic(local(2020, 3, 4, 5), 30, 20)])
+        self.assertEqual(data.days, [Traffic(local(2020, 3, 3), 500, 400),
+                Traffic(local(2020, 3, 4), 70, 30)])
+        self.assertEqual(data.months, [Traffic(local(2020, 3, 1), 570, 430)])
+        self.assertEqual(reader.db_accounting("eth1"), None)
+        self.assertEqual(reader.get("wlan0").hours, [Traffic(local(2020, 3, 4, 5), 1, 2)])
+
+    def test_db_changes(self):
+        conn = self.create_db()
+        reader = VnstatReader(self.dir)
+        self.assertEqual(reader.get("eth0").rx, 3000)
+        self.assertTrue(reader.get("eth0") is reader.get("eth0"))
+        conn.execute("UPDATE interface SET rxtotal = 3100 WHERE name = 'eth0'")
+        conn.commit()
+        conn.close()
+        # the token may not change within the mtime resolution
+        os.utime(reader.db, (UPDATED, UPDATED))
+        self.assertEqual(reader.get("eth0").rx, 3100)
+
+    def test_legacy(self):
+        with open(os.path.join(self.dir, "eth0"), "wb") as fd:
+            fd.write(pack_legacy())
+        with open(os.path.join(self.dir, ".eth0"), "wb") as fd:
+            fd.write(pack_legacy())
+        reader = VnstatReader(self.dir)
+        self.assertEqual(reader.interfaces(), ["eth0"])
+        self.assertTrue(reader.has("eth0"))
+        self.assertEqual(reader.get("eth0"), parse_legacy(pack_legacy()))
+        self.assertEqual(reader.get("eth1"), None)
+
+
+if __name__ == "__main__":
+    unittest.main()